@@ -0,0 +1,197 @@
+import argparse
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+from migrations import migrate
+
+# Archival of old ledger entries.
+# Transactions older than a cutoff move out of bank.db into one archive
+# database per month (archive/transactions-YYYY-MM.db), a chunk at a time, and
+# each user keeps a row in transaction_rollups with the count, sum and date
+# range of what was archived. Only entries already covered by the user's
+# balance checkpoint are archived, so audits (audit.py) never need them.
+#
+# A chunk is copied into its archives first and only then deleted from
+# bank.db, in a short transaction of its own; archive inserts ignore IDs that
+# are already there, so a chunk interrupted in between is simply redone.
+#
+# The functions taking a cursor run against bank.db; see Database for how they
+# are scheduled around the bot's own reads and writes.
+
+ARCHIVE_CHUNK_SIZE = 1000
+
+_PARTITION_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            type TEXT,
+            amount INTEGER,
+            date TEXT
+        )''',
+    "CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (user_id, date, id)",
+]
+
+
+def _month(date):
+    return date[:7]
+
+
+def _next_month(month):
+    year, month = int(month[:4]), int(month[5:7])
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+
+
+def partition_path(directory, month):
+    return os.path.join(directory, f"transactions-{month}.db")
+
+
+# Up to limit entries that can be archived, oldest first: older than cutoff
+# (ISO date) and covered by their user's checkpoint. Ordered by (date, id) so
+# the date index serves both the range and the order.
+def select_chunk(c, cutoff, limit=ARCHIVE_CHUNK_SIZE):
+    return c.execute('''SELECT t.id, t.user_id, t.type, t.amount, t.date
+                        FROM transactions t JOIN balance_checkpoints k ON k.user_id = t.user_id
+                        WHERE t.date < ? AND t.id <= k.transaction_id
+                        ORDER BY t.date, t.id LIMIT ?''', (cutoff, limit)).fetchall()
+
+
+# Copy rows into their monthly archive databases
+def write_partitions(directory, rows):
+    os.makedirs(directory, exist_ok=True)
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(_month(row[4]), []).append(row)
+    for month, month_rows in by_month.items():
+        conn = sqlite3.connect(partition_path(directory, month))
+        try:
+            for statement in _PARTITION_SCHEMA:
+                conn.execute(statement)
+            conn.executemany("INSERT OR IGNORE INTO transactions (id, user_id, type, amount, date) VALUES (?, ?, ?, ?, ?)",
+                             month_rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+# Delete archived rows from bank.db and add them to their users' rollups.
+# Must run in a write transaction. Returns how many rows were removed.
+def remove_chunk(c, ids):
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS archive_chunk (id INTEGER PRIMARY KEY)")
+    c.execute("DELETE FROM temp.archive_chunk")
+    c.executemany("INSERT INTO temp.archive_chunk (id) VALUES (?)", [(i,) for i in ids])
+    # Aggregated from the rows still present, so a redone chunk is not counted twice
+    c.execute('''INSERT INTO transaction_rollups (user_id, archived_count, archived_amount, first_date, last_date, last_id)
+                 SELECT user_id, COUNT(*), SUM(amount), MIN(date), MAX(date), MAX(id)
+                 FROM transactions WHERE id IN (SELECT id FROM temp.archive_chunk)
+                 GROUP BY user_id
+                 ON CONFLICT (user_id) DO UPDATE SET
+                     archived_count = archived_count + excluded.archived_count,
+                     archived_amount = archived_amount + excluded.archived_amount,
+                     first_date = MIN(first_date, excluded.first_date),
+                     last_date = MAX(last_date, excluded.last_date),
+                     last_id = MAX(last_id, excluded.last_id)''')
+    c.execute("DELETE FROM transactions WHERE id IN (SELECT id FROM temp.archive_chunk)")
+    return c.rowcount
+
+
+# Complete one page of history from the archives.
+# rows is what bank.db returned for the page, sql/params the same query (with
+# its ORDER BY and LIMIT of need rows) to run against each archive, and
+# first_date/last_date the user's archived date range from their rollup.
+# Partitions are read nearest first and only until the page is full.
+def merge_page(directory, rows, sql, params, first_date, last_date, descending, need):
+    months = []
+    month = _month(first_date)
+    while month <= _month(last_date):
+        months.append(month)
+        month = _next_month(month)
+    if descending:
+        months.reverse()
+
+    merged = list(rows)
+    for month in months:
+        if len(merged) >= need:
+            boundary = merged[need - 1][4]
+            # Everything in this and the remaining partitions is further away
+            # than the page already reaches
+            if descending and boundary >= _next_month(month):
+                break
+            if not descending and boundary < month:
+                break
+        path = partition_path(directory, month)
+        if not os.path.exists(path):
+            continue
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            # A chunk being archived right now can be in both databases
+            seen = {row[0] for row in merged}
+            merged.extend(row for row in conn.execute(sql, params).fetchall() if row[0] not in seen)
+        finally:
+            conn.close()
+        merged.sort(key=lambda row: (row[4], row[0]), reverse=descending)
+        del merged[need:]
+    return merged
+
+
+# Return freed pages to the file system, a few at a time. Only works once the
+# database uses auto_vacuum=INCREMENTAL (see enable_incremental_vacuum).
+# Returns False when nothing is left to free.
+def incremental_vacuum(c, pages=256):
+    if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return False
+    if c.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+        return False
+    c.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return True
+
+
+# Switch a database to auto_vacuum=INCREMENTAL. This rewrites the whole file
+# with VACUUM, so it is done offline from the command line, not by the bot.
+def enable_incremental_vacuum(conn):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+
+
+# Command line archival, for a first run over a large backlog or when the bot
+# is not running:
+#   python archive.py [path/to/bank.db] --days 365 [--archive-dir archive] [--vacuum]
+# --vacuum first switches the database to incremental vacuum (a full VACUUM).
+def main(argv):
+    parser = argparse.ArgumentParser(description="Archive old transactions out of bank.db.")
+    parser.add_argument('path', nargs='?', default='bank.db')
+    parser.add_argument('--days', type=float, required=True, help="archive transactions older than this many days")
+    parser.add_argument('--archive-dir', help="default: 'archive' next to the database")
+    parser.add_argument('--vacuum', action='store_true', help="switch to incremental vacuum first")
+    args = parser.parse_args(argv[1:])
+    directory = args.archive_dir or os.path.join(os.path.dirname(os.path.abspath(args.path)), 'archive')
+    cutoff = (datetime.now() - timedelta(days=args.days)).isoformat()
+
+    conn = sqlite3.connect(args.path, timeout=30)
+    migrate(conn)
+    if args.vacuum:
+        enable_incremental_vacuum(conn)
+    archived = 0
+    while True:
+        rows = select_chunk(conn, cutoff)
+        if not rows:
+            break
+        write_partitions(directory, rows)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            archived += remove_chunk(conn.cursor(), [row[0] for row in rows])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    while incremental_vacuum(conn):
+        pass
+    conn.close()
+    print(f"Archived {archived} transaction(s) to {directory}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,100 @@
+import sqlite3
+import sys
+from datetime import datetime
+
+from migrations import migrate
+from money import format_amount
+
+# Balance reconciliation.
+# The transactions table is an append-only ledger: every balance change writes
+# an entry. An account's balance can therefore be verified as its last
+# checkpoint plus the entries written since, without replaying its whole
+# history. An account that verifies gets a new checkpoint, so the next audit
+# only looks at entries newer than this one.
+#
+# These functions take a cursor and must run inside a write transaction, so the
+# balances and entries they compare cannot change underneath them.
+
+AUDIT_BATCH_SIZE = 500
+
+_VERIFY_SQL = '''SELECT a.user_id, a.balance,
+                        COALESCE(k.balance, 0) + COALESCE((
+                            SELECT SUM(t.amount) FROM transactions t
+                            WHERE t.user_id = a.user_id AND t.id > COALESCE(k.transaction_id, 0)
+                        ), 0)
+                 FROM accounts a LEFT JOIN balance_checkpoints k ON k.user_id = a.user_id'''
+
+
+def _checkpoint(c, verified):
+    high = c.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0]
+    now = datetime.now().isoformat()
+    c.executemany('''INSERT OR REPLACE INTO balance_checkpoints (user_id, transaction_id, balance, created_at)
+                     VALUES (?, ?, ?, ?)''',
+                  [(user_id, high, balance, now) for user_id, balance in verified])
+
+
+def _verify(c, rows):
+    verified = []
+    mismatches = []
+    for user_id, balance, expected in rows:
+        if balance == expected:
+            verified.append((user_id, balance))
+        else:
+            mismatches.append((user_id, balance, expected))
+    _checkpoint(c, verified)
+    return mismatches
+
+
+# Verify one account. Returns None if it does not exist, else
+# (balance, expected_balance); it is consistent when the two are equal.
+def audit_account(c, user_id):
+    row = c.execute(_VERIFY_SQL + " WHERE a.user_id=?", (user_id,)).fetchone()
+    if row is None:
+        return None
+    _verify(c, [row])
+    return row[1], row[2]
+
+
+# Verify the next batch of accounts after after_user_id.
+# Returns (last_user_id, checked, mismatches); last_user_id is None once every
+# account has been checked. mismatches is [(user_id, balance, expected)].
+def audit_batch(c, after_user_id=None, limit=AUDIT_BATCH_SIZE):
+    rows = c.execute(_VERIFY_SQL + " WHERE a.user_id > ? ORDER BY a.user_id LIMIT ?",
+                     (after_user_id if after_user_id is not None else -1 << 63, limit)).fetchall()
+    mismatches = _verify(c, rows)
+    last_user_id = rows[-1][0] if len(rows) == limit else None
+    return last_user_id, len(rows), mismatches
+
+
+# Command line audit of a whole bank.db, one short transaction per batch:
+#   python audit.py [path/to/bank.db]
+# Exits with status 1 if any balance does not match its ledger.
+def main(argv):
+    path = argv[1] if len(argv) > 1 else 'bank.db'
+    conn = sqlite3.connect(path, timeout=30)
+    migrate(conn)
+    checked = 0
+    mismatches = []
+    after = None
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            after, count, batch_mismatches = audit_batch(conn.cursor(), after)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        checked += count
+        mismatches.extend(batch_mismatches)
+        if after is None:
+            break
+    conn.close()
+
+    for user_id, balance, expected in mismatches:
+        print(f"MISMATCH user {user_id}: balance {format_amount(balance)}, ledger says {format_amount(expected)}")
+    print(f"Checked {checked} account(s), {len(mismatches)} mismatch(es).")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import sys
+from datetime import datetime
+
+from migrations import CHANGE_LOGGED_TABLES, migrate
+
+# Online backup and point-in-time restore for bank.db.
+#
+# Snapshots are full copies made with SQLite's online backup API, a few pages
+# per step. The copying connection holds one read transaction for the whole
+# backup; in WAL mode that never blocks the bot's writers, and it pins the copy
+# to a single point in time instead of restarting it on every commit.
+#
+# Between snapshots, triggers record every row change in change_log (migration
+# 8). The backup service ships those rows to JSON-lines segments next to the
+# snapshots and removes them from bank.db. A restore copies the newest snapshot
+# taken before the target time and replays the logged changes up to it.
+#
+# Layout of a backup directory:
+#   snapshots/bank-YYYYMMDDTHHMMSS.ffffff.db
+#   changes/changes-<first change id>.jsonl   (a new segment after each snapshot)
+
+BACKUP_STEP_PAGES = 256
+SNAPSHOT_TIME_FORMAT = '%Y%m%dT%H%M%S.%f'
+
+
+def _snapshots_dir(directory):
+    return os.path.join(directory, 'snapshots')
+
+
+def _changes_dir(directory):
+    return os.path.join(directory, 'changes')
+
+
+# [(taken_at, path)] of every snapshot, oldest first
+def list_snapshots(directory):
+    snapshots = []
+    if os.path.isdir(_snapshots_dir(directory)):
+        for name in os.listdir(_snapshots_dir(directory)):
+            if name.startswith('bank-') and name.endswith('.db'):
+                taken_at = datetime.strptime(name[5:-3], SNAPSHOT_TIME_FORMAT).isoformat()
+                snapshots.append((taken_at, os.path.join(_snapshots_dir(directory), name)))
+    return sorted(snapshots)
+
+
+# [(first_change_id, path)] of every change log segment, oldest first
+def list_segments(directory):
+    segments = []
+    if os.path.isdir(_changes_dir(directory)):
+        for name in os.listdir(_changes_dir(directory)):
+            if name.startswith('changes-') and name.endswith('.jsonl'):
+                segments.append((int(name[8:-6]), os.path.join(_changes_dir(directory), name)))
+    return sorted(segments)
+
+
+# Last change ID a database (or snapshot) has seen
+def change_position(conn):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='change_log'").fetchone()
+    return row[0] if row else 0
+
+
+# Copy the database at source_path to target_path as of one point in time.
+# The copy is written to a temporary file, checked and then renamed, so a
+# snapshot that exists is always complete. Returns its change position.
+def take_snapshot(source_path, target_path, pages=BACKUP_STEP_PAGES, sleep=0.005):
+    tmp = target_path + '.tmp'
+    source = sqlite3.connect(source_path, timeout=30)
+    target = sqlite3.connect(tmp)
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages, sleep=sleep)
+        source.rollback()
+        # A snapshot is a plain file, not a WAL database
+        target.execute("PRAGMA journal_mode=DELETE")
+        if target.execute("PRAGMA quick_check").fetchone()[0] != 'ok':
+            raise sqlite3.DatabaseError(f"Backup of {source_path} failed its integrity check")
+        position = change_position(target)
+    finally:
+        target.close()
+        source.close()
+    os.replace(tmp, target_path)
+    return position
+
+
+# Change log rows after after_id, oldest first
+def read_changes(c, after_id, limit):
+    return c.execute("SELECT id, at, tbl, op, data FROM change_log WHERE id > ? ORDER BY id LIMIT ?",
+                     (after_id, limit)).fetchall()
+
+
+def forget_changes(c, up_to_id):
+    c.execute("DELETE FROM change_log WHERE id <= ?", (up_to_id,))
+
+
+def enable_change_log(c, enabled):
+    c.execute("UPDATE change_log_config SET enabled=?", (1 if enabled else 0,))
+
+
+def change_log_enabled(c):
+    return bool(c.execute("SELECT enabled FROM change_log_config").fetchone()[0])
+
+
+def _last_shipped(directory):
+    segments = list_segments(directory)
+    for _, path in reversed(segments):
+        last = None
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    last = line
+        if last is not None:
+            return json.loads(last)['id']
+    return 0
+
+
+# Replay logged changes onto a restored database, in order, skipping those the
+# database already has. Changes are applied a transaction at a time, up to its
+# 'commit' marker (see CHANGE_LOG_COMMIT), and replay stops at the first
+# transaction committed after the target time (ISO, local time like every other
+# date in the bank). Returns the ID of the last change applied.
+def replay(conn, directory, position, until=None):
+    columns = {}
+    keys = {}
+    for table in CHANGE_LOGGED_TABLES:
+        info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+        columns[table] = [column[1] for column in info]
+        keys[table] = next(column[1] for column in info if column[5] == 1)
+
+    def apply(changes):
+        for change in changes:
+            table = change['tbl']
+            data = change['data']
+            if change['op'] == 'delete':
+                conn.execute(f"DELETE FROM {table} WHERE {keys[table]}=?", (data[keys[table]],))
+            elif change['op'] != 'commit':
+                # An upsert rather than INSERT OR REPLACE, so the aggregate
+                # triggers (migration 9) see updates as updates
+                names = columns[table]
+                updates = ', '.join(f"{name}=excluded.{name}" for name in names if name != keys[table])
+                conn.execute(f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                             f"ON CONFLICT ({keys[table]}) DO UPDATE SET {updates}",
+                             [data.get(name) for name in names])
+
+    last = position
+    pending = []
+    for _, path in list_segments(directory):
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                change = json.loads(line)
+                if change['id'] <= last:
+                    continue
+                pending.append(change)
+                if change['op'] == 'commit':
+                    if until is not None and change['at'] > until:
+                        return last
+                    apply(pending)
+                    last = change['id']
+                    pending = []
+    # Changes made outside the bot (command line tools) have no marker; each
+    # of those statements committed on its own
+    for change in pending:
+        if until is not None and change['at'] > until:
+            break
+        apply([change])
+        last = change['id']
+    return last
+
+
+# Restore the bank as of until (ISO time, default: as late as the backups go)
+# into target_path
+def restore(directory, target_path, until=None):
+    snapshots = [snapshot for snapshot in list_snapshots(directory) if until is None or snapshot[0] <= until]
+    if not snapshots:
+        raise FileNotFoundError(f"No snapshot in {directory} taken before {until}")
+    if os.path.exists(target_path):
+        raise FileExistsError(f"{target_path} already exists")
+    shutil.copyfile(snapshots[-1][1], target_path)
+
+    conn = sqlite3.connect(target_path)
+    try:
+        migrate(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        c = conn.cursor()
+        # The replayed changes are already in the log; don't log them again
+        enable_change_log(c, False)
+        last = replay(c, directory, change_position(c), until)
+        # Unshipped rows the snapshot carried are replayed from the log instead;
+        # new changes continue after the last one applied. The backup service
+        # turns logging back on when the bot starts with backups enabled.
+        c.execute("DELETE FROM change_log")
+        c.execute("UPDATE sqlite_sequence SET seq=? WHERE name='change_log'", (last,))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return snapshots[-1][0], last
+
+
+# Backup scheduler for a running bot (SQLite backend).
+# Takes a snapshot every snapshot_interval seconds and ships the change log
+# every ship_interval seconds, keeping the newest keep snapshots and the log
+# segments still needed to roll them forward. Change log reads and deletes go
+# through the Database's own threads; snapshots copy on a thread of their own.
+#
+# The change log is only recorded while the service runs. Changes made while it
+# was off are in no segment, so after a restart nothing rolls forward past them
+# until a new snapshot has been taken; the service takes one right away.
+class BackupService:
+    def __init__(self, db, directory, snapshot_interval=86400.0, ship_interval=5.0, keep=7, batch_size=5000):
+        if not db.supports_backup:
+            raise ValueError("Online backups need the SQLite storage backend (BANK_STORAGE=sqlite)")
+        self.db = db
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.ship_interval = ship_interval
+        self.keep = keep
+        self.batch_size = batch_size
+        self._shipped = 0
+        self._segment = None
+        self._task = None
+        self._gap = False
+
+    async def start(self):
+        os.makedirs(_snapshots_dir(self.directory), exist_ok=True)
+        os.makedirs(_changes_dir(self.directory), exist_ok=True)
+        self._gap = not await self.db.read(change_log_enabled)
+        await self.db.write(enable_change_log, True)
+        self._shipped = await asyncio.to_thread(_last_shipped, self.directory)
+        segments = list_segments(self.directory)
+        self._segment = segments[-1][1] if segments else None
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            # Nothing ships the log while the service is stopped
+            await self.db.write(enable_change_log, False)
+            await self.ship()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        snapshots = list_snapshots(self.directory)
+        if snapshots and not self._gap:
+            age = (datetime.now() - datetime.fromisoformat(snapshots[-1][0])).total_seconds()
+            next_snapshot = loop.time() + max(0.0, self.snapshot_interval - age)
+        else:
+            next_snapshot = loop.time()
+        while True:
+            try:
+                await self.ship()
+                if loop.time() >= next_snapshot:
+                    await self.snapshot()
+                    self._gap = False
+                    next_snapshot = loop.time() + self.snapshot_interval
+            except Exception as e:
+                print(f"Backup failed: {e}")
+            await asyncio.sleep(self.ship_interval)
+
+    # Append new change log rows to the current segment, then drop them from
+    # bank.db. A batch that fills up is cut after its last commit marker, so a
+    # transaction is never split between a shipped and an unshipped part.
+    # Only rows logged before the call are shipped, so it returns even while
+    # writes keep coming; returns how many rows it shipped.
+    async def ship(self):
+        shipped = 0
+        # Every transaction up to here has committed along with its marker
+        high = await self.db.read(change_position)
+        while self._shipped < high:
+            rows = await self.db.read(read_changes, self._shipped, self.batch_size)
+            rows = [row for row in rows if row[0] <= high]
+            full = len(rows) == self.batch_size
+            if full:
+                ends = [i for i, row in enumerate(rows) if row[3] == 'commit']
+                if ends:
+                    rows = rows[:ends[-1] + 1]
+            if not rows:
+                return shipped
+            if self._segment is None:
+                self._segment = os.path.join(_changes_dir(self.directory), f"changes-{rows[0][0]}.jsonl")
+            await asyncio.to_thread(self._append, self._segment, rows)
+            self._shipped = rows[-1][0]
+            await self.db.write(forget_changes, self._shipped)
+            shipped += len(rows)
+            if not full:
+                break
+        return shipped
+
+    @staticmethod
+    def _append(path, rows):
+        with open(path, 'a') as f:
+            for change_id, at, table, op, data in rows:
+                f.write(json.dumps({'id': change_id, 'at': at, 'tbl': table, 'op': op,
+                                    'data': json.loads(data) if data is not None else None}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    # Take a snapshot now and start a new log segment after it
+    async def snapshot(self):
+        path = os.path.join(_snapshots_dir(self.directory), f"bank-{datetime.now().strftime(SNAPSHOT_TIME_FORMAT)}.db")
+        await asyncio.to_thread(take_snapshot, self.db.path, path)
+        self._segment = None
+        await asyncio.to_thread(self._prune)
+        return path
+
+    def _prune(self):
+        snapshots = list_snapshots(self.directory)
+        for _, path in snapshots[:-self.keep]:
+            os.remove(path)
+        oldest = snapshots[-self.keep:][0][1]
+        conn = sqlite3.connect(f"file:{oldest}?mode=ro", uri=True)
+        try:
+            position = change_position(conn)
+        finally:
+            conn.close()
+        # A segment is only needed if some change in it is newer than the oldest
+        # snapshot; it ends where the next one starts
+        segments = list_segments(self.directory)
+        for (_, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first - 1 <= position:
+                os.remove(path)
+
+
+# Command line:
+#   python backup.py snapshot [bank.db] --backup-dir backups
+#   python backup.py restore --backup-dir backups --target restored.db [--at 2024-05-01T12:00:00]
+def main(argv):
+    parser = argparse.ArgumentParser(description="Back up and restore bank.db.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    snapshot_parser = commands.add_parser('snapshot', help="take a snapshot of a database")
+    snapshot_parser.add_argument('path', nargs='?', default='bank.db')
+    snapshot_parser.add_argument('--backup-dir', default='backups')
+    restore_parser = commands.add_parser('restore', help="restore a database from backups")
+    restore_parser.add_argument('--backup-dir', default='backups')
+    restore_parser.add_argument('--target', required=True, help="path of the restored database (must not exist)")
+    restore_parser.add_argument('--at', help="restore to this ISO time instead of the latest")
+    args = parser.parse_args(argv[1:])
+
+    if args.command == 'snapshot':
+        os.makedirs(_snapshots_dir(args.backup_dir), exist_ok=True)
+        path = os.path.join(_snapshots_dir(args.backup_dir), f"bank-{datetime.now().strftime(SNAPSHOT_TIME_FORMAT)}.db")
+        position = take_snapshot(args.path, path)
+        print(f"Snapshot {path} at change {position}.")
+    else:
+        taken_at, last = restore(args.backup_dir, args.target, args.at)
+        print(f"Restored {args.target} from the snapshot of {taken_at}, rolled forward to change {last}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
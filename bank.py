@@ -0,0 +1,410 @@
+import discord
+from discord import app_commands
+from discord.ext import commands, tasks
+from datetime import date, datetime, timedelta
+from typing import Optional
+import hashlib
+import json
+import math
+import os
+import time
+
+from backup import BackupService, enable_change_log
+from batcher import WriteBatcher
+from cache import AccountCache
+from feed import LedgerFeed
+from idempotency import RecentOperations
+from leaderboard import Leaderboard
+from ledger import Ledger, AccountUnavailable, DuplicateOperation, LOCKED, current_status
+from limits import RateLimiter, WriteGate, parse_limit, parse_command_limits
+from metrics import Metrics, InstrumentedStorage, LoopLagMonitor, MetricsServer
+from money import format_amount, parse_rate
+from notify import Notifier
+from storage import open_storage
+from timers import TimerWheel
+
+DISCORD_API_KEY = os.getenv('DISCORD_API_KEY')
+STARTED_AT = time.perf_counter()  # for the time to ready logged by on_ready
+
+# Latency histograms for commands, storage calls, DMs and event loop lag.
+# Shown by /stats, and served for Prometheus on http://METRICS_HOST:METRICS_PORT/metrics
+# when METRICS_PORT is set.
+metrics = Metrics()
+metrics.describe('command_seconds', "Slash command latency by command and outcome")
+metrics.describe('dm_seconds', "DM delivery latency by stage")
+loop_lag = LoopLagMonitor(metrics)
+metrics_server = MetricsServer(metrics, host=os.getenv('METRICS_HOST', '127.0.0.1'),
+                               port=int(os.getenv('METRICS_PORT', '0')))
+
+# Storage backend (SQLite by default, see storage.py for the settings)
+# All queries run off the event loop, and every call is timed
+db = InstrumentedStorage(open_storage(), metrics)
+accounts = AccountCache(db, maxsize=int(os.getenv('ACCOUNT_CACHE_SIZE', '10000')))
+metrics.gauge('account_cache_size', "Accounts held in the account cache", lambda: accounts.stats()['size'])
+metrics.gauge('account_cache_hit_rate', "Account cache hit rate since start", lambda: accounts.stats()['hit_rate'])
+
+# Idempotency keys of deposits, withdrawals and transfers are kept this long,
+# so a command retried within that time is applied only once
+IDEMPOTENCY_TTL = timedelta(hours=float(os.getenv('IDEMPOTENCY_TTL_HOURS', '24')))
+operations = RecentOperations(maxsize=int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000')),
+                              ttl=IDEMPOTENCY_TTL.total_seconds())
+# Richest accounts for /leaderboard, kept in memory and refreshed from the
+# balance index every LEADERBOARD_REFRESH_SECONDS
+leaderboard = Leaderboard(db, size=int(os.getenv('LEADERBOARD_SIZE', '10')),
+                          refresh=float(os.getenv('LEADERBOARD_REFRESH_SECONDS', '60')))
+ledger = Ledger(db, cache=accounts, operations=operations, leaderboard=leaderboard)
+
+# Deposit/withdrawal requests are group-committed: inserts arriving within a few
+# milliseconds of each other share one transaction
+intake = WriteBatcher(
+    db.add_requests,
+    max_batch=int(os.getenv('INTAKE_BATCH_SIZE', '256')),
+    max_delay=float(os.getenv('INTAKE_MAX_DELAY_MS', '5')) / 1000
+)
+
+# Online backups of bank.db (SQLite only, see backup.py): a snapshot every
+# BACKUP_INTERVAL_HOURS plus a change log shipped every few seconds for
+# point-in-time restore. Off unless BACKUP_DIR is set; setting it with another
+# backend fails here, at startup.
+backups = BackupService(
+    db, os.getenv('BACKUP_DIR'),
+    snapshot_interval=float(os.getenv('BACKUP_INTERVAL_HOURS', '24')) * 3600,
+    ship_interval=float(os.getenv('BACKUP_SHIP_SECONDS', '5')),
+    keep=int(os.getenv('BACKUP_KEEP', '7'))
+) if os.getenv('BACKUP_DIR') else None
+
+# Locks and freezes with an expiry are lifted by a timer wheel in the process
+# that set them (and, after a restart, in every process). Until that happens
+# a lapsed lock is already treated as lifted everywhere.
+async def expire_statuses(user_ids):
+    for user_id in await ledger.expire_statuses(user_ids):
+        send_dm(user_id, "Account Unlocked", "Your account is active again.", COLOR_SUCCESS)
+
+status_timers = TimerWheel(expire_statuses)
+
+def schedule_expiry(user_ids, until):
+    for user_id in user_ids:
+        if until is None:
+            status_timers.cancel(user_id)
+        else:
+            status_timers.schedule(user_id, datetime.fromisoformat(until).timestamp())
+
+# Other bot processes sharing the database change balances too; their ledger
+# entries invalidate the cached accounts they touch
+feed = LedgerFeed(db, accounts, interval=float(os.getenv('LEDGER_FEED_INTERVAL', '1.0')))
+
+# Sharding. By default one process runs every shard Discord recommends. To split
+# the bot across processes, give each the same SHARD_COUNT and its own
+# comma-separated SHARD_IDS, e.g. SHARD_COUNT=4 and SHARD_IDS=0,1 / SHARD_IDS=2,3.
+# All processes must share one database (PostgreSQL, or SQLite on one host).
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS').split(',')] if os.getenv('SHARD_IDS') else None
+
+# Admission control. Limits are "count/seconds" token buckets ("off" disables
+# one): per user and command, per user, per guild and global. Write commands
+# also pass a concurrency gate; when it is full they are turned away at once.
+# Either way the user gets an ephemeral "slow down" reply that never touches
+# the database. RATE_LIMIT_STATE names a file that keeps the buckets across
+# restarts.
+limiter = RateLimiter(
+    user=parse_limit(os.getenv('RATE_LIMIT_USER', '30/60')),
+    commands=parse_command_limits(os.getenv('RATE_LIMIT_COMMANDS', 'register=2/60,deposit=5/60,withdraw=5/60,transfer=10/60')),
+    guild=parse_limit(os.getenv('RATE_LIMIT_GUILD', 'off')),
+    global_limit=parse_limit(os.getenv('RATE_LIMIT_GLOBAL', '50/1')),
+    state_path=os.getenv('RATE_LIMIT_STATE')
+)
+WRITE_COMMANDS = {'register', 'deposit', 'withdraw', 'transfer', 'standing_order', 'cancel_standing_order',
+                  'approve', 'reject', 'approve_batch', 'setbalance', 'lock', 'unlock', 'lock_batch', 'reset'}
+write_gate = WriteGate(
+    limit=int(os.getenv('WRITE_CONCURRENCY', '32')),
+    max_waiting=int(os.getenv('WRITE_QUEUE', '256')),
+    timeout=float(os.getenv('WRITE_QUEUE_TIMEOUT_MS', '1500')) / 1000
+)
+metrics.describe('commands_shed_total', "Commands turned away by rate limits or the write gate")
+metrics.gauge('write_gate_active', "Write commands running", lambda: write_gate.active)
+metrics.gauge('write_gate_waiting', "Write commands waiting for the write gate", lambda: write_gate.waiting)
+
+# Record how long a command took, from the tree's check to completion or error,
+# and give back its write gate slot
+def finish_command(interaction: discord.Interaction, status: str):
+    if interaction.extras.pop('write_slot', False):
+        write_gate.leave()
+    started = interaction.extras.get('started')
+    if started is None:
+        return
+    command = interaction.command.qualified_name if interaction.command else 'unknown'
+    metrics.observe('command_seconds', time.perf_counter() - started, command=command, status=status)
+
+async def shed(interaction: discord.Interaction, command: str, reason: str, description: str):
+    interaction.extras['shed'] = True
+    metrics.increment('commands_shed_total', command=command, reason=reason)
+    embed = discord.Embed(
+        title="Slow Down",
+        description=description,
+        color=COLOR_WARNING
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Command tree that admits and times every slash command
+class BankTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras['started'] = time.perf_counter()
+        command = interaction.command.qualified_name if interaction.command else 'unknown'
+
+        scope, retry_after = limiter.acquire(interaction.user.id, interaction.guild_id, command)
+        if scope is not None:
+            await shed(interaction, command, scope,
+                       f"You are sending commands too quickly. Please try again in {math.ceil(retry_after)} seconds.")
+            return False
+
+        if command in WRITE_COMMANDS:
+            if not await write_gate.enter():
+                await shed(interaction, command, 'overload',
+                           "The bank is busy right now. Please try again in a few seconds.")
+                return False
+            interaction.extras['write_slot'] = True
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        if interaction.extras.get('shed'):
+            finish_command(interaction, 'shed')
+            return
+        finish_command(interaction, 'error')
+        await super().on_error(interaction, error)
+
+# Background services: the database, the change feed and the metrics. They are
+# started before the bot connects and stopped after it disconnects.
+async def start_services():
+    limiter.open()
+    await db.open()
+    await feed.start()
+    for user_id, until in await db.get_status_expiries():
+        schedule_expiry([user_id], until)
+    status_timers.start()
+    if bot.is_primary:
+        if backups is not None:
+            await backups.start()
+        elif db.supports_backup:
+            # Backups are off; a change log nobody ships would only grow
+            await db.write(enable_change_log, False)
+    loop_lag.start()
+    if metrics_server.port:
+        await metrics_server.start()
+
+async def stop_services():
+    await notifier.close()
+    await metrics_server.close()
+    await loop_lag.close()
+    await intake.close()
+    await feed.close()
+    await status_timers.close()
+    if backups is not None:
+        await backups.close()
+    await db.close()
+    limiter.close()
+
+# Slash commands live in extension modules in cogs/, imported when the bot
+# starts rather than with this module. COMMAND_MODULES picks which to load.
+COMMAND_MODULES = [name.strip() for name in
+                   os.getenv('COMMAND_MODULES', 'accounts,standing_orders,analytics,approvals,admin').split(',')
+                   if name.strip()]
+
+async def load_commands():
+    for name in COMMAND_MODULES:
+        await bot.load_extension(f'cogs.{name}')
+
+# Syncing the command tree is a global REST call, slow and rate limited, so it
+# is only done when the definitions change. The hash of the last synced tree is
+# kept in COMMAND_SYNC_STATE; delete that file to force a sync.
+COMMAND_SYNC_STATE = os.getenv('COMMAND_SYNC_STATE', 'command_tree.sha256')
+
+def command_tree_hash(tree, application_id):
+    definitions = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda command: command['name'])
+    payload = json.dumps({'application_id': application_id, 'commands': definitions}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def read_synced_hash(path=COMMAND_SYNC_STATE):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def write_synced_hash(digest, path=COMMAND_SYNC_STATE):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(digest + '\n')
+    os.replace(tmp, path)
+
+class BankBot(commands.AutoShardedBot):
+    # Runs once per process, after login and before connecting to the gateway;
+    # reconnects and resumes do not repeat it
+    async def setup_hook(self):
+        await load_commands()
+        await start_services()
+        if self.is_primary:
+            await self.sync_commands()
+            checkpoint_balances.start()
+            expire_operations.start()
+            run_scheduled_jobs.start()
+            if ARCHIVE_AFTER is not None:
+                if db.supports_archive:
+                    archive_transactions.start()
+                else:
+                    print("ARCHIVE_AFTER_DAYS is set but this storage backend cannot archive; not archiving")
+
+    # Returns whether the tree had to be synced
+    async def sync_commands(self):
+        digest = command_tree_hash(self.tree, self.application_id)
+        if digest == read_synced_hash():
+            return False
+        await self.tree.sync()
+        write_synced_hash(digest)
+        print(f"Synced {len(self.tree.get_commands())} commands")
+        return True
+
+    # DMs still waiting to be sent go out before the HTTP session is closed
+    async def close(self):
+        await notifier.close()
+        await super().close()
+        await stop_services()
+
+    # Work done once per deployment (syncing commands, checkpoints) runs only in
+    # the process that owns shard 0
+    @property
+    def is_primary(self):
+        return self.shard_ids is None or 0 in self.shard_ids
+
+# Set up the bot
+intents = discord.Intents.default()
+intents.message_content = True
+bot = BankBot(command_prefix='/', intents=intents, tree_cls=BankTree, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+
+# Define Embed Colors
+COLOR_SUCCESS = discord.Color.green()
+COLOR_WARNING = discord.Color.orange()
+COLOR_ERROR = discord.Color.red()
+COLOR_INFO = discord.Color.from_rgb(255, 255, 255)  # White
+
+# DMs are sent in the background by a pool of notifier workers
+notifier = Notifier(bot, metrics=metrics)
+
+# Send DM, user may be a discord.User or a user ID. Returns immediately.
+def send_dm(user, title: str, description: str, color: discord.Color):
+    notifier.notify(user, title, description, color)
+
+# Idempotency key of a command: the interaction ID, which Discord keeps when it
+# redelivers an interaction, or the user's own reference, which also catches a
+# double click (each click is a new interaction)
+def operation_key(interaction: discord.Interaction, command: str, reference: Optional[str] = None):
+    if reference:
+        return f"{command}:{interaction.user.id}:{reference}"
+    return f"{command}:{interaction.id}"
+
+# Queue a deposit or withdrawal request. Returns (request_id, submitted);
+# submitted is False if this request had already been made, and request_id is
+# then the ID of the original.
+async def submit_request(interaction: discord.Interaction, request_type: str, amount: int, reference: Optional[str]):
+    key = operation_key(interaction, request_type, reference)
+    row = (interaction.user.id, request_type, amount, datetime.now().isoformat(), key)
+    try:
+        return await operations.run(key, intake.submit, row), True  # ID of this caller's own row
+    except DuplicateOperation as e:
+        return e.result, False
+
+# Reply that an account's status does not allow what was asked
+async def send_unavailable(interaction: discord.Interaction, error: AccountUnavailable):
+    whose = "Your account" if error.user_id == interaction.user.id else f"The account of user ID {error.user_id}"
+    description = f"{whose} is {error.status}"
+    if error.reason:
+        description += f": {error.reason}"
+    if error.until:
+        description += f" (until {error.until})"
+    embed = discord.Embed(
+        title="Account Locked" if error.status == LOCKED else "Account Frozen",
+        description=description + ".",
+        color=COLOR_ERROR
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Raise AccountUnavailable if the account's status does not allow a movement
+def check_status(account, allowed):
+    status = current_status(account.status, account.status_until, datetime.now().isoformat())
+    if not allowed(status):
+        raise AccountUnavailable(account.user_id, status, account.status_reason, account.status_until)
+
+# Verify every account, one short write transaction per batch so commands are
+# never held up for long. Verified accounts get a new checkpoint.
+async def audit_bank():
+    checked = 0
+    mismatches = []
+    after = None
+    while True:
+        after, count, batch_mismatches = await db.audit_batch(after)
+        checked += count
+        mismatches.extend(batch_mismatches)
+        if after is None:
+            return checked, mismatches
+
+# Periodically advance balance checkpoints so audits stay incremental
+@tasks.loop(hours=6)
+async def checkpoint_balances():
+    checked, mismatches = await audit_bank()
+    for user_id, balance, expected in mismatches:
+        print(f"Audit mismatch for user {user_id}: balance {format_amount(balance)}, ledger says {format_amount(expected)}")
+
+# Move transactions older than ARCHIVE_AFTER_DAYS out of the live database
+# (SQLite only, see archive.py). Off unless ARCHIVE_AFTER_DAYS is set, and
+# on other backends.
+ARCHIVE_AFTER = timedelta(days=float(os.getenv('ARCHIVE_AFTER_DAYS'))) if os.getenv('ARCHIVE_AFTER_DAYS') else None
+
+@tasks.loop(hours=1)
+async def archive_transactions():
+    archived = await db.archive_transactions((datetime.now() - ARCHIVE_AFTER).isoformat())
+    if archived:
+        print(f"Archived {archived} transaction(s)")
+
+# Drop idempotency keys past their TTL
+@tasks.loop(hours=1)
+async def expire_operations():
+    await db.expire_operations((datetime.now() - IDEMPOTENCY_TTL).isoformat())
+
+# Standing orders and daily interest at INTEREST_DAILY_RATE (a fraction with at
+# most six decimal places, e.g. 0.0001; off at 0), paid in batches of
+# SCHEDULE_BATCH_SIZE. Their due times
+# are kept in the database, so whatever fell due while the bot was down is
+# caught up on the next run. DMs go out once each batch has committed; interest
+# is not announced, since it would be a DM to every account every day.
+INTEREST_DAILY_RATE = parse_rate(os.getenv('INTEREST_DAILY_RATE', '0'))
+if INTEREST_DAILY_RATE is None:
+    raise ValueError("INTEREST_DAILY_RATE must be a non-negative fraction with at most six decimal places")
+SCHEDULE_BATCH_SIZE = int(os.getenv('SCHEDULE_BATCH_SIZE', '1000'))
+
+@tasks.loop(minutes=1)
+async def run_scheduled_jobs():
+    while True:
+        paid, skipped = await ledger.run_standing_orders(datetime.now().isoformat(timespec='seconds'),
+                                                         SCHEDULE_BATCH_SIZE)
+        if not paid and not skipped:
+            break
+        for order_id, sender_id, recipient_id, amount in paid:
+            send_dm(sender_id, "Standing Order Paid",
+                    f"Standing order #{order_id} transferred {format_amount(amount)} to user with ID {recipient_id}.", COLOR_SUCCESS)
+            send_dm(recipient_id, "Money Received", f"You have received {format_amount(amount)} from user with ID {sender_id}.", COLOR_SUCCESS)
+        for order_id, sender_id, reason in skipped:
+            send_dm(sender_id, "Standing Order Skipped", f"Standing order #{order_id} was not paid this time: {reason}.", COLOR_WARNING)
+    while True:
+        result = await ledger.pay_interest(INTEREST_DAILY_RATE, date.today().isoformat(), SCHEDULE_BATCH_SIZE)
+        if result is None:
+            break
+        day, paid = result
+        if paid:
+            print(f"Paid interest for {day} to {len(paid)} account(s)")
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    finish_command(interaction, 'ok')
+
+@bot.event
+async def on_ready():
+    print(f'Logged in as {bot.user} ({time.perf_counter() - STARTED_AT:.2f}s after start)')
@@ -0,0 +1,122 @@
+import asyncio
+
+
+class BatcherClosed(Exception):
+    pass
+
+
+# Put on the queue by close(): every row queued before it is still written
+_STOP = object()
+
+
+# Group-commit write queue.
+# Rows submitted within max_delay seconds of each other (up to max_batch of
+# them) are handed to write_batch together, which writes them in one
+# transaction, so a burst costs one fsync instead of one per row. write_batch
+# returns one result per row (e.g. Storage.add_requests); every caller's future
+# resolves with its own row's result, or raises its own row's exception.
+class WriteBatcher:
+    def __init__(self, write_batch, max_batch=256, max_delay=0.005):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = None
+        self._task = None
+        self._closed = False
+
+    # The flush task is started lazily because the batcher is created before
+    # the event loop is running
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    # Queue one row and wait until its batch is committed
+    async def submit(self, row):
+        if self._closed:
+            raise BatcherClosed("the write batcher is closed")
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((row, future))
+        return await future
+
+    # Fill batch from the queue; returns True once the stop marker is reached
+    async def _collect(self, batch):
+        loop = asyncio.get_running_loop()
+        item = await self._queue.get()
+        if item is _STOP:
+            return True
+        batch.append(item)
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                item = self._queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is _STOP:
+                return True
+            batch.append(item)
+        return False
+
+    async def _run(self):
+        batch = []
+        try:
+            while True:
+                batch = []
+                stop = await self._collect(batch)
+                if batch:
+                    await self._flush(batch)
+                if stop:
+                    return
+        finally:
+            # Only reached with unresolved futures if the task was cancelled
+            # mid-batch; their callers must not wait forever
+            _fail(batch)
+
+    async def _flush(self, batch):
+        try:
+            results = await self.write_batch([row for row, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    # Stop taking rows, let the flush task write everything queued so far
+    # (including a batch it is in the middle of) and wait for it to finish.
+    # Rows it did not get to are written here.
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._task is not None:
+            if not self._task.done():
+                self._queue.put_nowait(_STOP)
+            await asyncio.wait([self._task])
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            batch = []
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    batch.append(item)
+            if batch:
+                await self._flush(batch)
+
+
+def _fail(batch):
+    for _, future in batch:
+        if not future.done():
+            future.set_exception(BatcherClosed("the write batcher stopped before this row was written"))
@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loadtest import FakeInteraction, FakeUser, git_commit
+
+# /dashboard latency with a cold and a warm account cache. bank.py is imported
+# against a temporary bank.db and the dashboard command's callback is called
+# directly with fake interactions that respond at once, so only the handler
+# itself is timed. "cold" clears the cache before every call, so each one reads
+# the account from the database; "warm" loads the accounts first. A third
+# phase draws users from a skewed distribution over more accounts than the
+# cache holds and reports the hit rate it reaches:
+#   python benchmarks/dashboard_cache.py --accounts 10000 --calls 5000 --output dashboard.json
+
+
+# Exact percentiles; a cached lookup is well below the smallest bucket of
+# metrics.Histogram
+def summarize(samples):
+    samples = sorted(samples)
+    def quantile(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'p50_ms': quantile(0.5),
+        'p95_ms': quantile(0.95),
+        'p99_ms': quantile(0.99),
+    }
+
+
+async def run(bank, args):
+    rng = random.Random(args.seed)
+    await bank.load_commands()
+    await bank.start_services()
+    try:
+        now = datetime.now().isoformat()
+        for user_id in range(1, args.accounts + 1):
+            await bank.db.create_account(user_id, f"user{user_id}", now)
+        users = {user_id: FakeUser(user_id, 0.0) for user_id in range(1, args.accounts + 1)}
+        dashboard = bank.bot.tree.get_command('dashboard')
+
+        async def phase(user_ids, cold=False):
+            bank.accounts.clear()
+            bank.accounts.hits = bank.accounts.misses = 0
+            if not cold:
+                for user_id in set(user_ids):
+                    await bank.accounts.get(user_id)
+                bank.accounts.hits = bank.accounts.misses = 0
+            latency = []
+            for user_id in user_ids:
+                if cold:
+                    bank.accounts.clear()
+                interaction = FakeInteraction(users[user_id], 0.0)
+                before = time.perf_counter()
+                await dashboard.callback(interaction)
+                latency.append(time.perf_counter() - before)
+                assert interaction.response.embeds[0].title == "Account Dashboard"
+            return dict(summarize(latency), cache=bank.accounts.stats())
+
+        hot = [rng.randint(1, min(args.accounts, bank.accounts.maxsize)) for _ in range(args.calls)]
+        results = {
+            'cold': await phase(hot, cold=True),
+            'warm': await phase(hot),
+        }
+        # Zipf-like: a few accounts are looked up far more often than the rest
+        skewed = [min(args.accounts, int(rng.paretovariate(1.2))) for _ in range(args.calls)]
+        bank.accounts.clear()
+        bank.accounts.hits = bank.accounts.misses = 0
+        latency = []
+        for user_id in skewed:
+            interaction = FakeInteraction(users[user_id], 0.0)
+            before = time.perf_counter()
+            await dashboard.callback(interaction)
+            latency.append(time.perf_counter() - before)
+        results['skewed'] = dict(summarize(latency), cache=bank.accounts.stats())
+        return results
+    finally:
+        await bank.stop_services()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="/dashboard latency with a cold and a warm account cache.")
+    parser.add_argument('--accounts', type=int, default=20000)
+    parser.add_argument('--calls', type=int, default=5000, help="dashboard calls per phase")
+    parser.add_argument('--cache-size', type=int, default=10000, help="ACCOUNT_CACHE_SIZE")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # bank.py builds its storage and cache at import time
+        os.environ['BANK_STORAGE'] = 'sqlite'
+        os.environ['BANK_DB_PATH'] = os.path.join(tmp, 'bank.db')
+        os.environ['ACCOUNT_CACHE_SIZE'] = str(args.cache_size)
+        for name in ('METRICS_PORT', 'BACKUP_DIR', 'RATE_LIMIT_STATE'):
+            os.environ.pop(name, None)
+        import bank
+        phases = asyncio.run(run(bank, args))
+
+    results = {
+        'commit': git_commit(),
+        'config': {'accounts': args.accounts, 'calls': args.calls, 'cache_size': args.cache_size, 'seed': args.seed},
+        'phases': phases,
+    }
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from ledger import InsufficientFunds, Ledger
+from loadtest import git_commit, summarize
+from metrics import Histogram
+from migrations import migrate
+
+# Interaction latency with SQLite on the event loop versus on the Database
+# executor. Interactions arrive open-loop (Poisson, at --rate per second), each
+# one reads an account or makes a transfer and then waits rest_latency for its
+# response to be sent, and its latency is measured from when it arrived. The
+# "blocking" mode does what the bot did before db.Database: one sqlite3
+# connection used straight from the handlers, committing on the event loop, so
+# every commit holds up every other interaction. The "executor" mode runs the
+# same work through db.Database and the Ledger. Reports p50/p95/p99 per mode:
+#   python benchmarks/db_executor.py --rate 500 --seconds 10 --output db_executor.json
+
+
+def create_accounts(path, accounts, balance):
+    conn = sqlite3.connect(path)
+    try:
+        migrate(conn)
+        now = datetime.now().isoformat()
+        conn.executemany("INSERT INTO accounts (user_id, username, balance, created_at) VALUES (?, ?, ?, ?)",
+                         [(user_id, f"user{user_id}", balance, now) for user_id in range(1, accounts + 1)])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# The handlers as they were: every statement and the commit on the event loop
+class BlockingBank:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+
+    async def read(self, user_id):
+        return self.conn.execute("SELECT * FROM accounts WHERE user_id=?", (user_id,)).fetchone()
+
+    async def transfer(self, sender_id, recipient_id, amount):
+        c = self.conn.cursor()
+        balance = c.execute("SELECT balance FROM accounts WHERE user_id=?", (sender_id,)).fetchone()[0]
+        if balance < amount:
+            raise InsufficientFunds(sender_id)
+        now = datetime.now().isoformat()
+        c.execute("UPDATE accounts SET balance = balance - ? WHERE user_id=?", (amount, sender_id))
+        c.execute("UPDATE accounts SET balance = balance + ? WHERE user_id=?", (amount, recipient_id))
+        c.executemany("INSERT INTO transactions (user_id, type, amount, date) VALUES (?, ?, ?, ?)",
+                      [(sender_id, 'transfer out', -amount, now), (recipient_id, 'transfer in', amount, now)])
+        self.conn.commit()
+
+    async def close(self):
+        self.conn.close()
+
+
+class ExecutorBank:
+    def __init__(self, path):
+        self.db = Database(path)
+        self.ledger = Ledger(self.db)
+
+    async def open(self):
+        await self.db.open()
+
+    async def read(self, user_id):
+        return await self.db.get_account(user_id)
+
+    async def transfer(self, sender_id, recipient_id, amount):
+        await self.ledger.transfer(sender_id, recipient_id, amount)
+
+    async def close(self):
+        await self.db.close()
+
+
+async def run_mode(bank, args, seed):
+    rng = random.Random(seed)
+    latency = Histogram()
+    rest_latency = args.rest_latency_ms / 1000
+
+    async def interaction(arrived):
+        if rng.random() < args.write_fraction:
+            sender_id, recipient_id = rng.sample(range(1, args.accounts + 1), 2)
+            try:
+                await bank.transfer(sender_id, recipient_id, rng.randint(1, 100))
+            except InsufficientFunds:
+                pass
+        else:
+            await bank.read(rng.randint(1, args.accounts))
+        await asyncio.sleep(rest_latency)
+        latency.observe(time.perf_counter() - arrived)
+
+    loop = asyncio.get_running_loop()
+    tasks = []
+    start = time.perf_counter()
+    arrival = start
+    while arrival - start < args.seconds:
+        arrival += rng.expovariate(args.rate)
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(loop.create_task(interaction(arrival)))
+    await asyncio.gather(*tasks)
+    return dict(summarize(latency), duration_seconds=time.perf_counter() - start)
+
+
+async def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in args.modes:
+            path = os.path.join(tmp, f"{mode}.db")
+            create_accounts(path, args.accounts, args.initial_balance * 100)
+            bank = BlockingBank(path) if mode == 'blocking' else ExecutorBank(path)
+            if mode == 'executor':
+                await bank.open()
+            try:
+                results[mode] = await run_mode(bank, args, args.seed)
+            finally:
+                await bank.close()
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Interaction latency with SQLite on and off the event loop.")
+    parser.add_argument('--rate', type=float, default=300.0, help="interactions per second")
+    parser.add_argument('--seconds', type=float, default=5.0, help="how long interactions keep arriving")
+    parser.add_argument('--write-fraction', type=float, default=0.5, help="share of interactions that are transfers")
+    parser.add_argument('--accounts', type=int, default=1000)
+    parser.add_argument('--initial-balance', type=int, default=1000)
+    parser.add_argument('--rest-latency-ms', type=float, default=50.0, help="simulated Discord REST latency")
+    parser.add_argument('--modes', type=lambda value: value.split(','), default=['blocking', 'executor'],
+                        help="comma-separated modes to run (blocking, executor)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args(argv[1:])
+
+    results = {
+        'commit': git_commit(),
+        'config': {'rate': args.rate, 'seconds': args.seconds, 'write_fraction': args.write_fraction,
+                   'accounts': args.accounts, 'rest_latency_ms': args.rest_latency_ms, 'seed': args.seed},
+        'modes': asyncio.run(run(args)),
+    }
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
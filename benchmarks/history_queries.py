@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from loadtest import git_commit, summarize
+from metrics import Histogram
+from migrations import migrate
+
+# Query time of /transactions and /view_requests on a large ledger, before and
+# after the migrations. Builds a bank.db with the original bot's schema (no
+# indexes, REAL money, rollback journal) holding --rows transactions, times
+# the original queries on it, upgrades it in place with migrations.py and
+# times the same lookups through db.Database:
+#   python benchmarks/history_queries.py --rows 10000000 --output history.json
+
+BASELINE_SCHEMA = [
+    '''CREATE TABLE accounts (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            balance REAL,
+            created_at TEXT
+        )''',
+    '''CREATE TABLE transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            type TEXT,
+            amount REAL,
+            date TEXT
+        )''',
+    '''CREATE TABLE pending_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            type TEXT,
+            amount REAL,
+            status TEXT,
+            date TEXT
+        )''',
+]
+
+CHUNK_ROWS = 1000000
+
+
+def build_baseline(path, rows, users, requests):
+    conn = sqlite3.connect(path)
+    try:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(statement)
+        conn.execute('''WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                        INSERT INTO accounts (user_id, username, balance, created_at)
+                        SELECT i, 'user' || i, 0.0, '2024-01-01T00:00:00' FROM n''', (users,))
+        for first in range(0, rows, CHUNK_ROWS):
+            conn.execute('''WITH RECURSIVE n(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                            INSERT INTO transactions (user_id, type, amount, date)
+                            SELECT abs(random()) % ? + 1,
+                                   CASE i % 3 WHEN 0 THEN 'deposit' WHEN 1 THEN 'transfer in' ELSE 'transfer out' END,
+                                   (abs(random()) % 100000) / 100.0,
+                                   strftime('%Y-%m-%dT%H:%M:%S', '2024-01-01', '+' || (i / 10) || ' seconds')
+                            FROM n''', (first + 1, min(first + CHUNK_ROWS, rows), users))
+            conn.commit()
+        # Most requests were handled long ago; a few are still pending
+        conn.execute('''WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                        INSERT INTO pending_requests (user_id, type, amount, status, date)
+                        SELECT abs(random()) % ? + 1, 'deposit', 10.0,
+                               CASE WHEN i % 1000 = 0 THEN 'pending' ELSE 'approved' END, '2024-01-01T00:00:00'
+                        FROM n''', (requests, users))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def time_queries(queries, run):
+    histogram = Histogram()
+    for query in queries:
+        before = time.perf_counter()
+        run(query)
+        histogram.observe(time.perf_counter() - before)
+    return summarize(histogram)
+
+
+def measure_baseline(path, user_ids, view_requests):
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            'transactions': time_queries(user_ids, lambda user_id: conn.execute(
+                "SELECT * FROM transactions WHERE user_id=?", (user_id,)).fetchall()),
+            'view_requests': time_queries(range(view_requests), lambda _: conn.execute(
+                "SELECT * FROM pending_requests WHERE status='pending'").fetchall()),
+        }
+    finally:
+        conn.close()
+
+
+async def measure_migrated(path, user_ids, view_requests, page_size):
+    db = Database(path)
+    await db.open()
+    try:
+        results = {}
+        for name, queries, query in (
+                ('transactions', user_ids, lambda user_id: db.get_transactions_page(user_id, page_size)),
+                ('view_requests', range(view_requests), lambda _: db.get_pending_requests())):
+            histogram = Histogram()
+            for argument in queries:
+                before = time.perf_counter()
+                await query(argument)
+                histogram.observe(time.perf_counter() - before)
+            results[name] = summarize(histogram)
+        return results
+    finally:
+        await db.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="/transactions and /view_requests query time before and after the migrations.")
+    parser.add_argument('--rows', type=int, default=10000000, help="transactions in the ledger")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=100000, help="rows in pending_requests")
+    parser.add_argument('--queries', type=int, default=50, help="lookups timed per query and version")
+    parser.add_argument('--page-size', type=int, default=10, help="/transactions page size after the migrations")
+    parser.add_argument('--db', help="database path (default: a temporary file; must not exist)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args(argv[1:])
+
+    rng = random.Random(args.seed)
+    user_ids = [rng.randint(1, args.users) for _ in range(args.queries)]
+    results = {
+        'commit': git_commit(),
+        'config': {'rows': args.rows, 'users': args.users, 'requests': args.requests,
+                   'queries': args.queries, 'page_size': args.page_size},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, 'bank.db')
+        before = time.perf_counter()
+        build_baseline(path, args.rows, args.users, args.requests)
+        results['build_seconds'] = time.perf_counter() - before
+        results['before'] = measure_baseline(path, user_ids, args.queries)
+
+        conn = sqlite3.connect(path)
+        try:
+            before = time.perf_counter()
+            migrate(conn)
+            results['migration_seconds'] = time.perf_counter() - before
+        finally:
+            conn.close()
+        results['after'] = asyncio.run(measure_migrated(path, user_ids, args.queries, args.page_size))
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
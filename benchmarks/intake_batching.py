@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batcher import WriteBatcher
+from db import Database
+from loadtest import git_commit, summarize
+from metrics import Histogram
+
+# Deposit/withdrawal request intake with and without group commit. A burst of
+# --requests requests is submitted by --concurrency callers at once, either
+# each in its own transaction (add_requests with one row, as /deposit did
+# before the WriteBatcher) or through a WriteBatcher that coalesces them.
+# Reports throughput, per-request latency and how many transactions it took:
+#   python benchmarks/intake_batching.py --requests 20000 --concurrency 500 --output intake.json
+
+
+async def run_mode(path, args, batched):
+    db = Database(path)
+    await db.open()
+    transactions = 0
+
+    async def write_batch(rows):
+        nonlocal transactions
+        transactions += 1
+        return await db.add_requests(rows)
+
+    batcher = WriteBatcher(write_batch, max_batch=args.max_batch, max_delay=args.max_delay_ms / 1000)
+    latency = Histogram()
+    ids = []
+    try:
+        async def caller(worker):
+            for i in range(worker, args.requests, args.concurrency):
+                row = (i % 1000 + 1, 'deposit', 100, datetime.now().isoformat(), None)
+                before = time.perf_counter()
+                if batched:
+                    ids.append(await batcher.submit(row))
+                else:
+                    ids.append((await write_batch([row]))[0])
+                latency.observe(time.perf_counter() - before)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(caller(worker) for worker in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        await batcher.close()
+        await db.close()
+    # Every caller got an ID of its own
+    assert len(set(ids)) == args.requests
+    return dict(summarize(latency), duration_seconds=elapsed, transactions=transactions,
+                throughput_per_second=args.requests / elapsed if elapsed else 0.0)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Request intake throughput with and without group commit.")
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=200, help="callers submitting at the same time")
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-delay-ms', type=float, default=5.0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args(argv[1:])
+
+    results = {
+        'commit': git_commit(),
+        'config': {'requests': args.requests, 'concurrency': args.concurrency,
+                   'max_batch': args.max_batch, 'max_delay_ms': args.max_delay_ms},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        results['unbatched'] = asyncio.run(run_mode(os.path.join(tmp, 'unbatched.db'), args, False))
+        results['batched'] = asyncio.run(run_mode(os.path.join(tmp, 'batched.db'), args, True))
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
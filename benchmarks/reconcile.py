@@ -0,0 +1,141 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from loadtest import git_commit
+from migrations import migrate
+
+from history_queries import BASELINE_SCHEMA, CHUNK_ROWS
+
+# Reconciliation over millions of ledger rows with REAL and INTEGER money.
+# Builds a bank.db with the original REAL schema whose balances were kept the
+# way the old commands did it, one float addition per entry, then a copy of
+# it upgraded to integer cents by the migrations. Times a full reconciliation
+# (every balance against the SUM of its entries) on both and counts the
+# accounts that do not match exactly, plus, for REAL, the balances that have
+# drifted from the exact decimal total of their entries. Then times audit.py's
+# checkpointed audit: a first pass over everything and a second one after a
+# few new entries.
+#   python benchmarks/reconcile.py --rows 5000000 --output reconcile.json
+
+RECONCILE_SQL = '''SELECT a.user_id, a.balance, COALESCE(t.total, 0)
+                   FROM accounts a LEFT JOIN (SELECT user_id, SUM(amount) AS total FROM transactions
+                                              GROUP BY user_id) t ON t.user_id = a.user_id'''
+# The exact total of a REAL ledger, summed as integer cents
+EXACT_CENTS_SQL = RECONCILE_SQL.replace('SUM(amount)', 'SUM(CAST(ROUND(amount * 100) AS INTEGER))')
+
+
+def build_real(path, rows, users):
+    conn = sqlite3.connect(path)
+    try:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(statement)
+        for first in range(0, rows, CHUNK_ROWS):
+            conn.execute('''WITH RECURSIVE n(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                            INSERT INTO transactions (user_id, type, amount, date)
+                            SELECT abs(random()) % ? + 1, 'deposit', (abs(random()) % 100000) / 100.0,
+                                   strftime('%Y-%m-%dT%H:%M:%S', '2024-01-01', '+' || (i / 10) || ' seconds')
+                            FROM n''', (first + 1, min(first + CHUNK_ROWS, rows), users))
+        balances = [0.0] * (users + 1)
+        for user_id, amount in conn.execute("SELECT user_id, amount FROM transactions ORDER BY id"):
+            balances[user_id] = balances[user_id] + amount
+        conn.executemany("INSERT INTO accounts (user_id, username, balance, created_at) VALUES (?, ?, ?, ?)",
+                         [(user_id, f"user{user_id}", balances[user_id], '2024-01-01T00:00:00')
+                          for user_id in range(1, users + 1)])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def reconcile(path, real):
+    conn = sqlite3.connect(path)
+    try:
+        before = time.perf_counter()
+        rows = conn.execute(RECONCILE_SQL).fetchall()
+        elapsed = time.perf_counter() - before
+        results = {
+            'seconds': elapsed,
+            'accounts': len(rows),
+            'exact_mismatches': sum(1 for _, balance, total in rows if balance != total),
+        }
+        if real:
+            results['drifted'] = sum(1 for _, balance, cents in conn.execute(EXACT_CENTS_SQL)
+                                     if balance != cents / 100)
+    finally:
+        conn.close()
+    return results
+
+
+async def audit(path, new_entries):
+    db = Database(path)
+    await db.open()
+    try:
+        # The upgrade checkpointed every balance; start from nothing so the
+        # first pass has to read the whole ledger
+        await db.execute("DELETE FROM balance_checkpoints")
+        results = {}
+        for name in ('first_pass', 'second_pass'):
+            if name == 'second_pass':
+                await db.write(lambda c: c.executemany(
+                    "INSERT INTO transactions (user_id, type, amount, date) VALUES (?, 'deposit', 100, ?)",
+                    [(user_id, '2025-01-01T00:00:00') for user_id in range(1, new_entries + 1)]))
+                await db.write(lambda c: c.execute(
+                    "UPDATE accounts SET balance = balance + 100 WHERE user_id <= ?", (new_entries,)))
+            before = time.perf_counter()
+            checked = mismatches = 0
+            after = None
+            while True:
+                after, batch_checked, batch_mismatches = await db.audit_batch(after)
+                checked += batch_checked
+                mismatches += len(batch_mismatches)
+                if after is None:
+                    break
+            results[name] = {'seconds': time.perf_counter() - before, 'checked': checked, 'mismatches': mismatches}
+        return results
+    finally:
+        await db.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Reconciliation time and exactness with REAL and INTEGER money.")
+    parser.add_argument('--rows', type=int, default=2000000, help="transactions in the ledger")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--new-entries', type=int, default=1000, help="entries added before the second audit pass")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args(argv[1:])
+
+    results = {'commit': git_commit(), 'config': {'rows': args.rows, 'users': args.users,
+                                                  'new_entries': args.new_entries}}
+    with tempfile.TemporaryDirectory() as tmp:
+        real_path = os.path.join(tmp, 'real.db')
+        integer_path = os.path.join(tmp, 'integer.db')
+        build_real(real_path, args.rows, args.users)
+        shutil.copyfile(real_path, integer_path)
+        conn = sqlite3.connect(integer_path)
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+        results['real'] = reconcile(real_path, True)
+        results['integer'] = reconcile(integer_path, False)
+        results['audit'] = asyncio.run(audit(integer_path, min(args.new_entries, args.users)))
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
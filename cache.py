@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+
+class AccountRecord:
+    __slots__ = ('user_id', 'username', 'balance', 'created_at', 'status', 'status_reason', 'status_until')
+
+    def __init__(self, user_id, username, balance, created_at, status='active', status_reason=None, status_until=None):
+        self.user_id = user_id
+        self.username = username
+        self.balance = balance
+        self.created_at = created_at
+        self.status = status
+        self.status_reason = status_reason
+        self.status_until = status_until
+
+
+# LRU cache of account rows keyed by user_id.
+# Balance and status changes that go through the ledger are written through
+# with what the transaction committed; anything else that changes an account
+# must invalidate() it. Only existing accounts are cached.
+class AccountCache:
+    def __init__(self, db, maxsize=10000):
+        self.db = db
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._records = OrderedDict()
+        # Bumped on every write so a load that raced a write is not cached
+        self._epoch = 0
+
+    async def get(self, user_id):
+        record = self._records.get(user_id)
+        if record is not None:
+            self._records.move_to_end(user_id)
+            self.hits += 1
+            return record
+
+        self.misses += 1
+        epoch = self._epoch
+        row = await self.db.get_account(user_id)
+        if row is None:
+            return None
+        record = AccountRecord(*row[:7])
+        if epoch == self._epoch:
+            self._put(record)
+        return record
+
+    def _put(self, record):
+        self._records[record.user_id] = record
+        self._records.move_to_end(record.user_id)
+        if len(self._records) > self.maxsize:
+            self._records.popitem(last=False)
+
+    # Write-through of a committed balance
+    def set_balance(self, user_id, balance):
+        self._epoch += 1
+        record = self._records.get(user_id)
+        if record is not None:
+            record.balance = balance
+
+    # The cached record, if any, without loading it or counting a hit
+    def peek(self, user_id):
+        return self._records.get(user_id)
+
+    # Write-through of a committed status change
+    def set_status(self, user_id, status, reason, until):
+        self._epoch += 1
+        record = self._records.get(user_id)
+        if record is not None:
+            record.status = status
+            record.status_reason = reason
+            record.status_until = until
+
+    def invalidate(self, user_id):
+        self._epoch += 1
+        self._records.pop(user_id, None)
+
+    def clear(self):
+        self._epoch += 1
+        self._records.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._records),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
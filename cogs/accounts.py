@@ -0,0 +1,319 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+from bank import (accounts, db, ledger, check_status, operation_key, send_dm, send_unavailable, submit_request,
+                  COLOR_SUCCESS, COLOR_WARNING, COLOR_ERROR, COLOR_INFO)
+from ledger import (AccountNotFound, AccountUnavailable, InsufficientFunds, ACTIVE, current_status, can_send,
+                    can_receive)
+from money import MAX_AMOUNT, parse_amount, format_amount
+
+# Account holders' commands: registering, deposits and withdrawals, transfers and history.
+# Loaded as an extension by bank.load_commands().
+
+# Register account
+@app_commands.command(name="register", description="Register a new bank account.")
+async def register(interaction: discord.Interaction):
+    user_id = interaction.user.id
+    username = str(interaction.user)
+    created_at = datetime.now().isoformat()
+
+    # Registering again, even concurrently, finds the account already there
+    if not await db.create_account(user_id, username, created_at):
+        embed = discord.Embed(
+            title="Registration Failed",
+            description="You already have an account.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="Account Registered",
+            description=f"Account successfully registered for {username}.",
+            color=COLOR_SUCCESS
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        send_dm(interaction.user, "Account Registered", "Your bank account has been successfully registered.", COLOR_SUCCESS)
+
+# Request deposit
+@app_commands.command(name="deposit", description="Request to deposit an amount into your account.")
+@app_commands.describe(amount="Amount to deposit", reference="Optional reference; repeating a request with the same reference has no effect")
+async def deposit(interaction: discord.Interaction, amount: float, reference: Optional[str] = None):
+    user_id = interaction.user.id
+    amount = parse_amount(amount)
+    if amount is None or amount <= 0:
+        embed = discord.Embed(
+            title="Invalid Amount",
+            description=f"Deposit amount must be a positive value with at most two decimal places, up to {format_amount(MAX_AMOUNT)}.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    account = await accounts.get(user_id)
+    if account:
+        try:
+            check_status(account, can_receive)
+        except AccountUnavailable as e:
+            await send_unavailable(interaction, e)
+            return
+        request_id, submitted = await submit_request(interaction, 'deposit', amount, reference)
+
+        embed = discord.Embed(
+            title="Deposit Requested",
+            description=f"Your deposit request has been submitted with ID {request_id}. Please wait for admin approval.",
+            color=COLOR_WARNING
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        if submitted:
+            send_dm(interaction.user, "Deposit Requested", f"Your deposit request has been submitted with ID {request_id}.", COLOR_WARNING)
+    else:
+        embed = discord.Embed(
+            title="Account Not Found",
+            description="No account found. Please use /register to create one.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Request withdrawal
+@app_commands.command(name="withdraw", description="Request to withdraw an amount from your account.")
+@app_commands.describe(amount="Amount to withdraw", reference="Optional reference; repeating a request with the same reference has no effect")
+async def withdraw(interaction: discord.Interaction, amount: float, reference: Optional[str] = None):
+    user_id = interaction.user.id
+    amount = parse_amount(amount)
+    if amount is None or amount <= 0:
+        embed = discord.Embed(
+            title="Invalid Amount",
+            description=f"Withdrawal amount must be a positive value with at most two decimal places, up to {format_amount(MAX_AMOUNT)}.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    account = await accounts.get(user_id)
+    if account:
+        try:
+            check_status(account, can_send)
+        except AccountUnavailable as e:
+            await send_unavailable(interaction, e)
+            return
+        request_id, submitted = await submit_request(interaction, 'withdraw', amount, reference)
+
+        embed = discord.Embed(
+            title="Withdrawal Requested",
+            description=f"Your withdrawal request has been submitted with ID {request_id}. Please wait for admin approval.",
+            color=COLOR_WARNING
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        if submitted:
+            send_dm(interaction.user, "Withdrawal Requested", f"Your withdrawal request has been submitted with ID {request_id}.", COLOR_WARNING)
+    else:
+        embed = discord.Embed(
+            title="Account Not Found",
+            description="No account found. Please use /register to create one.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# View dashboard
+@app_commands.command(name="dashboard", description="View your account details and balance.")
+async def dashboard(interaction: discord.Interaction):
+    user_id = interaction.user.id
+    account = await accounts.get(user_id)
+    if account:
+        username = account.username
+        account_id = account.user_id
+        balance = account.balance
+        created_at = account.created_at
+
+        embed = discord.Embed(
+            title="Account Dashboard",
+            color=COLOR_INFO
+        )
+        embed.add_field(name="Account Holder", value=username, inline=False)
+        embed.add_field(name="Account ID", value=account_id, inline=False)
+        embed.add_field(name="Balance", value=format_amount(balance), inline=False)
+        embed.add_field(name="Created At", value=created_at, inline=False)
+        status = current_status(account.status, account.status_until, datetime.now().isoformat())
+        if status != ACTIVE:
+            details = f"{status.capitalize()}"
+            if account.status_reason:
+                details += f": {account.status_reason}"
+            if account.status_until:
+                details += f" (until {account.status_until})"
+            embed.add_field(name="Status", value=details, inline=False)
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="Account Not Found",
+            description="No account found. Please use /register to create one.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Transfer money
+@app_commands.command(name="transfer", description="Transfer an amount to another user's account.")
+@app_commands.describe(recipient_id="Recipient's user ID", amount="Amount to transfer",
+                       reference="Optional reference; repeating a transfer with the same reference has no effect")
+async def transfer(interaction: discord.Interaction, recipient_id: int, amount: float, reference: Optional[str] = None):
+    sender_id = interaction.user.id
+    amount = parse_amount(amount)
+    if amount is None or amount <= 0:
+        embed = discord.Embed(
+            title="Invalid Amount",
+            description=f"Transfer amount must be a positive value with at most two decimal places, up to {format_amount(MAX_AMOUNT)}.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    # Keyed so a retried or repeated command cannot move the money twice
+    try:
+        applied = await ledger.transfer(sender_id, recipient_id, amount,
+                                        idempotency_key=operation_key(interaction, 'transfer', reference))
+    except AccountNotFound:
+        embed = discord.Embed(
+            title="Account Not Found",
+            description="One or both accounts were not found. Please check the recipient ID and try again.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    except InsufficientFunds:
+        embed = discord.Embed(
+            title="Insufficient Funds",
+            description="You do not have enough funds to complete this transfer.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    except AccountUnavailable as e:
+        await send_unavailable(interaction, e)
+        return
+
+    embed = discord.Embed(
+        title="Transfer Completed",
+        description=f"Successfully transferred {format_amount(amount)} to user with ID {recipient_id}.",
+        color=COLOR_SUCCESS
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+    if not applied:
+        return
+    # Send DM to the sender
+    send_dm(interaction.user, "Transfer Completed", f"You have successfully transferred {format_amount(amount)} to user with ID {recipient_id}.", COLOR_SUCCESS)
+    # Send DM to the recipient
+    send_dm(recipient_id, "Money Received", f"You have received {format_amount(amount)} from user with ID {sender_id}.", COLOR_SUCCESS)
+
+# Review transactions
+TRANSACTIONS_PAGE_SIZE = 10  # Well under Discord's 25-field embed limit
+
+# Paged transaction history. Only the page on screen is held in memory; Next and
+# Prev fetch the neighbouring page by keyset from the last/first row shown.
+class TransactionHistoryView(discord.ui.View):
+    def __init__(self, user_id, transaction_type=None, start=None, end=None):
+        super().__init__(timeout=300)
+        self.user_id = user_id
+        self.filters = {'transaction_type': transaction_type, 'start': start, 'end': end}
+        self.rows = []
+        self.page = 1
+
+    async def load(self, after=None, before=None):
+        rows, has_more = await db.get_transactions_page(self.user_id, TRANSACTIONS_PAGE_SIZE,
+                                                        after=after, before=before, **self.filters)
+        if before:
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = after is not None, has_more
+        self.rows = rows
+        self.prev_page.disabled = not has_newer
+        self.next_page.disabled = not has_older
+
+    def embed(self):
+        embed = discord.Embed(
+            title="Transaction History",
+            color=COLOR_INFO
+        )
+        for t in self.rows:
+            embed.add_field(name=t[2], value=f"Amount: {format_amount(t[3])} on {t[4]}", inline=False)
+        embed.set_footer(text=f"Page {self.page}")
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return interaction.user.id == self.user_id
+
+    @discord.ui.button(label="Prev", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        first = self.rows[0]
+        await self.load(before=(first[4], first[0]))
+        self.page -= 1
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        last = self.rows[-1]
+        await self.load(after=(last[4], last[0]))
+        self.page += 1
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+# Parse a YYYY-MM-DD command option, returns None if it is not a valid date
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+
+@app_commands.command(name="transactions", description="Review your transaction history.")
+@app_commands.rename(transaction_type="type")
+@app_commands.describe(transaction_type="Only show this type of transaction",
+                       start="Only show transactions on or after this date (YYYY-MM-DD)",
+                       end="Only show transactions on or before this date (YYYY-MM-DD)")
+@app_commands.choices(transaction_type=[
+    app_commands.Choice(name="Deposit", value="deposit"),
+    app_commands.Choice(name="Withdrawal", value="withdrawal"),
+    app_commands.Choice(name="Transfer In", value="transfer in"),
+    app_commands.Choice(name="Transfer Out", value="transfer out"),
+])
+async def transactions(interaction: discord.Interaction, transaction_type: Optional[app_commands.Choice[str]] = None,
+                       start: Optional[str] = None, end: Optional[str] = None):
+    user_id = interaction.user.id
+    start_date = parse_date(start) if start else None
+    end_date = parse_date(end) if end else None
+    if (start and not start_date) or (end and not end_date):
+        embed = discord.Embed(
+            title="Invalid Date",
+            description="Dates must be in the format YYYY-MM-DD.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    view = TransactionHistoryView(
+        user_id,
+        transaction_type=transaction_type.value if transaction_type else None,
+        start=start_date.isoformat() if start_date else None,
+        # Dates are stored as ISO timestamps, so the end bound is the start of the next day
+        end=(end_date + timedelta(days=1)).isoformat() if end_date else None
+    )
+    await view.load()
+    if view.rows:
+        await interaction.response.send_message(embed=view.embed(), view=view, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="No Transactions Found",
+            description="You have no transaction history.",
+            color=COLOR_WARNING
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+COMMANDS = [register, deposit, withdraw, dashboard, transfer, transactions]
+
+async def setup(bot):
+    for command in COMMANDS:
+        bot.tree.add_command(command)
+
+async def teardown(bot):
+    for command in COMMANDS:
+        bot.tree.remove_command(command.name)
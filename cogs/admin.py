@@ -0,0 +1,352 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+from bank import (accounts, db, ledger, metrics, write_gate, audit_bank, schedule_expiry, send_dm,
+                  COLOR_SUCCESS, COLOR_WARNING, COLOR_ERROR, COLOR_INFO)
+from ledger import ACTIVE, LOCKED, FROZEN
+from money import MAX_AMOUNT, parse_amount, format_amount
+
+# Admin commands for accounts: balances, locks, audits and statistics.
+# Loaded as an extension by bank.load_commands().
+
+# Set balance for a specific user
+@app_commands.command(name="setbalance", description="Set the balance for a specific user.")
+@app_commands.describe(user="User ID", amount="Amount to set")
+async def setbalance(interaction: discord.Interaction, user: int, amount: float):
+    if not interaction.user.guild_permissions.administrator:
+        embed = discord.Embed(
+            title="Permission Denied",
+            description="You do not have the required permissions to use this command.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    amount = parse_amount(amount)
+    if amount is None:
+        embed = discord.Embed(
+            title="Invalid Amount",
+            description=f"Balance must be a number with at most two decimal places, between -{format_amount(MAX_AMOUNT)} and {format_amount(MAX_AMOUNT)}.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    account = await accounts.get(user)
+    if account:
+        await ledger.set_balance(user, amount, 'adjustment')
+
+        embed = discord.Embed(
+            title="Balance Updated",
+            description=f"Balance for user ID {user} has been set to {format_amount(amount)}.",
+            color=COLOR_SUCCESS
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="Account Not Found",
+            description="The account associated with this user ID was not found.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Lock or freeze accounts. A locked account can neither send nor receive
+# money, a frozen one can still receive it. Balances are left alone.
+STATUS_CHOICES = [
+    app_commands.Choice(name="Lock", value=LOCKED),
+    app_commands.Choice(name="Freeze", value=FROZEN),
+]
+
+# Expiry of a lock or freeze lasting hours (not negative) from now, as an ISO
+# time; None when there is no expiry
+def status_until(hours):
+    return (datetime.now() + timedelta(hours=hours)).isoformat() if hours else None
+
+# Apply a status to accounts and tell their owners. Returns the IDs changed.
+async def change_status(user_ids, status, reason=None, until=None):
+    updated = await ledger.set_status(user_ids, status, reason, until)
+    schedule_expiry(updated, until)
+    if status == ACTIVE:
+        title, description, color = "Account Unlocked", "Your account is active again.", COLOR_SUCCESS
+    else:
+        title = "Account Locked" if status == LOCKED else "Account Frozen"
+        description = f"Your account has been {status}"
+        if reason:
+            description += f": {reason}"
+        if until:
+            description += f" (until {until})"
+        description += "."
+        color = COLOR_WARNING
+    for user_id in updated:
+        send_dm(user_id, title, description, color)
+    return updated
+
+# Lock account
+@app_commands.command(name="lock", description="Lock or freeze a user’s account.")
+@app_commands.describe(user="User ID to lock", reason="Reason shown to the user",
+                       hours="Lift the lock automatically after this many hours", mode="Lock (default) or freeze")
+@app_commands.choices(mode=STATUS_CHOICES)
+async def lock(interaction: discord.Interaction, user: int, reason: Optional[str] = None,
+               hours: Optional[float] = None, mode: Optional[app_commands.Choice[str]] = None):
+    if not interaction.user.guild_permissions.administrator:
+        embed = discord.Embed(
+            title="Permission Denied",
+            description="You do not have the required permissions to use this command.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    if hours is not None and hours < 0:
+        embed = discord.Embed(
+            title="Invalid Duration",
+            description="The number of hours cannot be negative.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    status = mode.value if mode else LOCKED
+    if await change_status([user], status, reason, status_until(hours)):
+        embed = discord.Embed(
+            title="Account Locked" if status == LOCKED else "Account Frozen",
+            description=f"Account for user ID {user} has been {status}.",
+            color=COLOR_WARNING
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="Account Not Found",
+            description="The account associated with this user ID was not found.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Unlock account
+@app_commands.command(name="unlock", description="Unlock a user’s account.")
+@app_commands.describe(user="User ID to unlock")
+async def unlock(interaction: discord.Interaction, user: int):
+    if not interaction.user.guild_permissions.administrator:
+        embed = discord.Embed(
+            title="Permission Denied",
+            description="You do not have the required permissions to use this command.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    if await change_status([user], ACTIVE):
+        embed = discord.Embed(
+            title="Account Unlocked",
+            description=f"Account for user ID {user} has been unlocked.",
+            color=COLOR_SUCCESS
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="Account Not Found",
+            description="The account associated with this user ID was not found.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Parse a list of user IDs separated by commas or spaces, returns None if
+# anything in it is not an ID
+def parse_user_ids(value):
+    parts = value.replace(',', ' ').split()
+    if not parts or not all(part.isdigit() for part in parts):
+        return None
+    return list(dict.fromkeys(int(part) for part in parts))
+
+# Lock, freeze or unlock many accounts in one transaction
+@app_commands.command(name="lock_batch", description="Lock, freeze or unlock many accounts at once.")
+@app_commands.describe(action="What to do with the accounts", users="User IDs separated by commas or spaces",
+                       reason="Reason shown to the users", hours="Lift the lock automatically after this many hours")
+@app_commands.choices(action=STATUS_CHOICES + [app_commands.Choice(name="Unlock", value=ACTIVE)])
+async def lock_batch(interaction: discord.Interaction, action: app_commands.Choice[str], users: str,
+                     reason: Optional[str] = None, hours: Optional[float] = None):
+    if not interaction.user.guild_permissions.administrator:
+        embed = discord.Embed(
+            title="Permission Denied",
+            description="You do not have the required permissions to use this command.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    user_ids = parse_user_ids(users)
+    if user_ids is None:
+        embed = discord.Embed(
+            title="Invalid Selection",
+            description="Give one or more user IDs separated by commas or spaces.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    if hours is not None and hours < 0:
+        embed = discord.Embed(
+            title="Invalid Duration",
+            description="The number of hours cannot be negative.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    updated = await change_status(user_ids, action.value, reason, status_until(hours))
+    changed = set(updated)
+    missing = [str(user_id) for user_id in user_ids if user_id not in changed]
+    past = "unlocked" if action.value == ACTIVE else action.value
+    embed = discord.Embed(
+        title=f"Accounts {past.capitalize()}",
+        description=f"{len(updated)} account(s) {past}, {len(missing)} not found.",
+        color=COLOR_SUCCESS if updated else COLOR_WARNING
+    )
+    if missing:
+        listed = ", ".join(missing[:20])
+        if len(missing) > 20:
+            listed += f" and {len(missing) - 20} more"
+        embed.add_field(name="Not Found", value=listed, inline=False)
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+# Reset account balance
+@app_commands.command(name="reset", description="Reset a user’s account balance to $0.")
+@app_commands.describe(user="User ID to reset")
+async def reset(interaction: discord.Interaction, user: int):
+    if not interaction.user.guild_permissions.administrator:
+        embed = discord.Embed(
+            title="Permission Denied",
+            description="You do not have the required permissions to use this command.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    account = await accounts.get(user)
+    if account:
+        await ledger.set_balance(user, 0, 'reset')
+
+        embed = discord.Embed(
+            title="Balance Reset",
+            description=f"Balance for user ID {user} has been reset to $0.",
+            color=COLOR_SUCCESS
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="Account Not Found",
+            description="The account associated with this user ID was not found.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Audit balances against the ledger
+@app_commands.command(name="audit", description="Verify balances against the transaction ledger.")
+@app_commands.describe(user="User ID to audit, or leave empty to audit the whole bank")
+async def audit_command(interaction: discord.Interaction, user: Optional[int] = None):
+    if not interaction.user.guild_permissions.administrator:
+        embed = discord.Embed(
+            title="Permission Denied",
+            description="You do not have the required permissions to use this command.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    if user is not None:
+        result = await db.audit_account(user)
+        if result is None:
+            embed = discord.Embed(
+                title="Account Not Found",
+                description="The account associated with this user ID was not found.",
+                color=COLOR_ERROR
+            )
+        elif result[0] == result[1]:
+            embed = discord.Embed(
+                title="Audit Passed",
+                description=f"Balance for user ID {user} matches the ledger ({format_amount(result[0])}).",
+                color=COLOR_SUCCESS
+            )
+        else:
+            embed = discord.Embed(
+                title="Audit Failed",
+                description=f"Balance for user ID {user} is {format_amount(result[0])}, the ledger says {format_amount(result[1])}.",
+                color=COLOR_ERROR
+            )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        return
+
+    checked, mismatches = await audit_bank()
+    embed = discord.Embed(
+        title="Audit Passed" if not mismatches else "Audit Failed",
+        description=f"Checked {checked} account(s), {len(mismatches)} mismatch(es).",
+        color=COLOR_SUCCESS if not mismatches else COLOR_ERROR
+    )
+    if mismatches:
+        lines = [f"User ID {user_id}: {format_amount(balance)}, ledger says {format_amount(expected)}"
+                 for user_id, balance, expected in mismatches[:20]]
+        if len(mismatches) > 20:
+            lines.append(f"... and {len(mismatches) - 20} more")
+        embed.add_field(name="Mismatches", value="\n".join(lines), inline=False)
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+# Latency summary
+STATS_TOP = 10
+
+def format_latency(histogram, unit="calls"):
+    return (f"{histogram.count} {unit}, p50 {histogram.quantile(0.5) * 1000:.1f} ms, "
+            f"p95 {histogram.quantile(0.95) * 1000:.1f} ms, p99 {histogram.quantile(0.99) * 1000:.1f} ms")
+
+@app_commands.command(name="stats", description="Show command, storage and event loop latency.")
+async def stats(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        embed = discord.Embed(
+            title="Permission Denied",
+            description="You do not have the required permissions to use this command.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    embed = discord.Embed(
+        title="Bot Statistics",
+        description=f"Slowest first by p95, top {STATS_TOP} of each.",
+        color=COLOR_INFO
+    )
+    for title, name, label in (("Commands", 'command_seconds', 'command'),
+                               ("Storage", 'storage_seconds', 'operation'),
+                               ("DMs", 'dm_seconds', 'stage')):
+        series = sorted(metrics.series(name), key=lambda item: item[1].quantile(0.95), reverse=True)[:STATS_TOP]
+        lines = []
+        for labels, histogram in series:
+            status = f" ({labels['status']})" if labels.get('status', 'ok') != 'ok' else ""
+            lines.append(f"**{labels[label]}**{status}: {format_latency(histogram)}")
+        embed.add_field(name=title, value="\n".join(lines) or "No data yet.", inline=False)
+
+    shed_counts = {}
+    for labels, count in metrics.counter('commands_shed_total').items():
+        reason = dict(labels)['reason']
+        shed_counts[reason] = shed_counts.get(reason, 0) + count
+    embed.add_field(name="Shed Commands",
+                    value=", ".join(f"{reason}: {count}" for reason, count in sorted(shed_counts.items())) or "None.",
+                    inline=False)
+    embed.add_field(name="Write Gate", value=f"{write_gate.active} running, {write_gate.waiting} waiting", inline=False)
+    embed.add_field(name="Event Loop Lag", value=format_latency(metrics.histogram('event_loop_lag_seconds'), "samples"), inline=False)
+    cache = accounts.stats()
+    embed.add_field(name="Account Cache", value=f"{cache['size']} accounts, {cache['hit_rate']:.1%} hit rate", inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+COMMANDS = [setbalance, lock, unlock, lock_batch, reset, audit_command, stats]
+
+async def setup(bot):
+    for command in COMMANDS:
+        bot.tree.add_command(command)
+
+async def teardown(bot):
+    for command in COMMANDS:
+        bot.tree.remove_command(command.name)
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+from bank import db, leaderboard, COLOR_WARNING, COLOR_ERROR, COLOR_INFO
+from money import format_amount
+
+# Read-only views over the aggregates: the leaderboard, bank totals and monthly summaries.
+# Loaded as an extension by bank.load_commands().
+
+# Richest accounts
+@app_commands.command(name="leaderboard", description="Show the accounts with the highest balances.")
+async def leaderboard_command(interaction: discord.Interaction):
+    ranking = await leaderboard.top()
+    if ranking:
+        embed = discord.Embed(
+            title="Leaderboard",
+            description="\n".join(f"**{rank}.** <@{user_id}>: {format_amount(balance)}"
+                                   for rank, (user_id, balance) in enumerate(ranking, start=1)),
+            color=COLOR_INFO
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="Leaderboard Empty",
+            description="No account has a positive balance yet.",
+            color=COLOR_WARNING
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Bank-wide totals and the daily volume of the last BANK_STATS_DAYS days
+BANK_STATS_DAYS = 7
+
+@app_commands.command(name="bank_stats", description="Show bank-wide totals and daily volume.")
+async def bank_stats(interaction: discord.Interaction):
+    account_count, money_supply, deposits, withdrawals, transfers = await db.get_bank_totals()
+    since = (datetime.now() - timedelta(days=BANK_STATS_DAYS - 1)).strftime('%Y-%m-%d')
+    days = await db.get_daily_totals(since)
+
+    embed = discord.Embed(
+        title="Bank Statistics",
+        color=COLOR_INFO
+    )
+    embed.add_field(name="Accounts", value=account_count, inline=True)
+    embed.add_field(name="Money Supply", value=format_amount(money_supply), inline=True)
+    embed.add_field(name="Total Deposits", value=format_amount(deposits), inline=True)
+    embed.add_field(name="Total Withdrawals", value=format_amount(withdrawals), inline=True)
+    embed.add_field(name="Total Transferred", value=format_amount(transfers), inline=True)
+    lines = [f"**{day}**: {entries} entries, deposits {format_amount(day_deposits)}, "
+             f"withdrawals {format_amount(day_withdrawals)}, transfers {format_amount(day_transfers)}"
+             for day, day_deposits, day_withdrawals, day_transfers, entries in days]
+    embed.add_field(name=f"Daily Volume (last {BANK_STATS_DAYS} days)", value="\n".join(lines) or "No activity.", inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Per-month totals of the user's own ledger entries
+SUMMARY_MONTHS = 6
+
+@app_commands.command(name="monthly_summary", description="Summarize your account activity by month.")
+@app_commands.describe(month="Only this month (YYYY-MM), or leave empty for the last few months")
+async def monthly_summary(interaction: discord.Interaction, month: Optional[str] = None):
+    if month:
+        try:
+            month = datetime.strptime(month, '%Y-%m').strftime('%Y-%m')
+        except ValueError:
+            embed = discord.Embed(
+                title="Invalid Month",
+                description="Months must be in the format YYYY-MM.",
+                color=COLOR_ERROR
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
+
+    summaries = await db.get_monthly_summaries(interaction.user.id, SUMMARY_MONTHS, month=month)
+    if summaries:
+        embed = discord.Embed(
+            title="Monthly Summary",
+            color=COLOR_INFO
+        )
+        for summary_month, deposits, withdrawals, transfers_in, transfers_out, adjustments, entries in summaries:
+            value = (f"Deposits: {format_amount(deposits)}\nWithdrawals: {format_amount(withdrawals)}\n"
+                     f"Received: {format_amount(transfers_in)}\nSent: {format_amount(transfers_out)}\n"
+                     f"Net change: {format_amount(deposits - withdrawals + transfers_in - transfers_out + adjustments)} "
+                     f"over {entries} transaction(s)")
+            embed.add_field(name=summary_month, value=value, inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="No Transactions Found",
+            description="You have no transactions in this period.",
+            color=COLOR_WARNING
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+COMMANDS = [leaderboard_command, bank_stats, monthly_summary]
+
+async def setup(bot):
+    for command in COMMANDS:
+        bot.tree.add_command(command)
+
+async def teardown(bot):
+    for command in COMMANDS:
+        bot.tree.remove_command(command.name)
@@ -0,0 +1,223 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+from bank import db, ledger, send_dm, send_unavailable, COLOR_SUCCESS, COLOR_WARNING, COLOR_ERROR, COLOR_INFO
+from ledger import AccountNotFound, AccountUnavailable, InsufficientFunds, RequestNotFound
+from money import parse_amount, format_amount
+
+# Admin commands for pending deposit and withdrawal requests.
+# Loaded as an extension by bank.load_commands().
+
+# Approve deposit
+@app_commands.command(name="approve", description="Approve a deposit or withdrawal request.")
+@app_commands.describe(request_id="Request ID to approve")
+async def approve(interaction: discord.Interaction, request_id: int):
+    try:
+        request = await ledger.approve_request(request_id)
+    except RequestNotFound:
+        embed = discord.Embed(
+            title="Request Not Found",
+            description="Request not found. Please check the request ID and try again.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    except AccountNotFound:
+        embed = discord.Embed(
+            title="Account Not Found",
+            description="The account associated with this request was not found.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    except InsufficientFunds:
+        embed = discord.Embed(
+            title="Insufficient Funds",
+            description="The account does not have enough funds to complete this withdrawal.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    except AccountUnavailable as e:
+        await send_unavailable(interaction, e)
+        return
+
+    embed = discord.Embed(
+        title="Request Approved",
+        description=f"Request ID {request_id} has been approved.",
+        color=COLOR_SUCCESS
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+    # Send DM to the user
+    user_id = request[0]
+    send_dm(user_id, "Request Approved", f"Your request ID {request_id} has been approved.", COLOR_SUCCESS)
+
+# Reject request
+@app_commands.command(name="reject", description="Reject a deposit or withdrawal request.")
+@app_commands.describe(request_id="Request ID to reject")
+async def reject(interaction: discord.Interaction, request_id: int):
+    request = await db.get_request(request_id)
+    if request:
+        await db.delete_request(request_id)
+
+        embed = discord.Embed(
+            title="Request Rejected",
+            description=f"Request ID {request_id} has been rejected and removed.",
+            color=COLOR_WARNING
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        # Send DM to the user
+        user_id = request[1]
+        send_dm(user_id, "Request Rejected", f"Your request ID {request_id} has been rejected.", COLOR_WARNING)
+    else:
+        embed = discord.Embed(
+            title="Request Not Found",
+            description="Request not found. Please check the request ID and try again.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Parse a request ID selection like "1,2,5-9" into inclusive (low, high) ranges.
+# Returns None if the selection is malformed.
+def parse_id_ranges(value):
+    ranges = []
+    for part in value.replace(' ', '').split(','):
+        if not part:
+            continue
+        low, _, high = part.partition('-')
+        if not low.isdigit() or (high and not high.isdigit()):
+            return None
+        low, high = int(low), int(high or low)
+        if low > high:
+            return None
+        ranges.append((low, high))
+    return ranges or None
+
+# Approve or reject many requests at once
+@app_commands.command(name="approve_batch", description="Approve or reject many pending requests in one go.")
+@app_commands.describe(action="Approve or reject the selected requests",
+                       ids="Request IDs and ranges, e.g. 1,2,5-9",
+                       request_type="Only requests of this type",
+                       max_amount="Only requests up to this amount",
+                       older_than_days="Only requests older than this many days")
+@app_commands.choices(action=[
+    app_commands.Choice(name="Approve", value="approve"),
+    app_commands.Choice(name="Reject", value="reject"),
+], request_type=[
+    app_commands.Choice(name="Deposit", value="deposit"),
+    app_commands.Choice(name="Withdrawal", value="withdraw"),
+])
+async def approve_batch(interaction: discord.Interaction, action: app_commands.Choice[str], ids: Optional[str] = None,
+                        request_type: Optional[app_commands.Choice[str]] = None, max_amount: Optional[float] = None,
+                        older_than_days: Optional[int] = None):
+    if not interaction.user.guild_permissions.administrator:
+        embed = discord.Embed(
+            title="Permission Denied",
+            description="You do not have the required permissions to use this command.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    ranges = parse_id_ranges(ids) if ids else None
+    max_cents = parse_amount(max_amount) if max_amount is not None else None
+    if (ids and not ranges) or (max_amount is not None and max_cents is None) or not (ranges or request_type or max_amount is not None or older_than_days is not None):
+        embed = discord.Embed(
+            title="Invalid Selection",
+            description="Give valid request IDs (e.g. 1,2,5-9) and/or at least one filter.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    before = (datetime.now() - timedelta(days=older_than_days)).isoformat() if older_than_days is not None else None
+    applied, skipped = await ledger.apply_requests(
+        action.value,
+        ranges=ranges,
+        request_type=request_type.value if request_type else None,
+        max_amount=max_cents,
+        before=before
+    )
+
+    past = "approved" if action.value == 'approve' else "rejected"
+    embed = discord.Embed(
+        title=f"Requests {past.capitalize()}",
+        description=f"{len(applied)} request(s) {past}, {len(skipped)} skipped.",
+        color=COLOR_SUCCESS if applied else COLOR_WARNING
+    )
+    if skipped:
+        lines = [f"ID {request_id}: {reason}" for request_id, reason in skipped[:20]]
+        if len(skipped) > 20:
+            lines.append(f"... and {len(skipped) - 20} more")
+        embed.add_field(name="Skipped", value="\n".join(lines), inline=False)
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+    # One DM per user, covering all of their requests
+    by_user = {}
+    for request_id, user_id in applied:
+        by_user.setdefault(user_id, []).append(str(request_id))
+    color = COLOR_SUCCESS if action.value == 'approve' else COLOR_WARNING
+    for user_id, request_ids in by_user.items():
+        listed = ', '.join(request_ids[:20])
+        if len(request_ids) > 20:
+            listed += f" and {len(request_ids) - 20} more"
+        send_dm(user_id, f"Request {past.capitalize()}", f"Your request ID(s) {listed} have been {past}.", color)
+
+# View pending requests
+@app_commands.command(name="view_requests", description="View all pending requests.")
+async def view_requests(interaction: discord.Interaction):
+    requests = await db.get_pending_requests()
+    if requests:
+        embed = discord.Embed(
+            title="Pending Requests",
+            color=COLOR_INFO
+        )
+        for req in requests:
+            embed.add_field(name=f"Request ID: {req[0]}", value=f"Type: {req[2]}, Amount: {format_amount(req[3])}, Date: {req[5]}", inline=False)
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="No Pending Requests",
+            description="There are no pending requests at the moment.",
+            color=COLOR_WARNING
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Get info about a specific request
+@app_commands.command(name="request_info", description="Get info about a specific request.")
+@app_commands.describe(request_id="Request ID to get info about")
+async def request_info(interaction: discord.Interaction, request_id: int):
+    request = await db.get_request(request_id)
+    if request:
+        embed = discord.Embed(
+            title=f"Request ID: {request_id}",
+            color=COLOR_INFO
+        )
+        embed.add_field(name="Type", value=request[2], inline=False)
+        embed.add_field(name="Amount", value=format_amount(request[3]), inline=False)
+        embed.add_field(name="Status", value=request[4], inline=False)
+        embed.add_field(name="Date", value=request[5], inline=False)
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="Request Not Found",
+            description="Request not found. Please check the request ID and try again.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+COMMANDS = [approve, reject, approve_batch, view_requests, request_info]
+
+async def setup(bot):
+    for command in COMMANDS:
+        bot.tree.add_command(command)
+
+async def teardown(bot):
+    for command in COMMANDS:
+        bot.tree.remove_command(command.name)
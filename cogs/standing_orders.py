@@ -0,0 +1,135 @@
+from datetime import datetime
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+from bank import accounts, db, COLOR_SUCCESS, COLOR_WARNING, COLOR_ERROR, COLOR_INFO
+from money import MAX_AMOUNT, parse_amount, format_amount
+
+# Standing orders: transfers repeated every so many days. They are paid by the
+# scheduled job runner in bank.py, not by these commands.
+# Loaded as an extension by bank.load_commands().
+
+MAX_STANDING_ORDERS = 10
+MAX_INTERVAL_DAYS = 365
+
+# Set up a standing order
+@app_commands.command(name="standing_order", description="Transfer an amount to another user every few days.")
+@app_commands.describe(recipient_id="Recipient's user ID", amount="Amount to transfer each time",
+                       every_days="Days between transfers (7 for weekly)",
+                       start="Date of the first transfer (YYYY-MM-DD), or leave empty to start now")
+async def standing_order(interaction: discord.Interaction, recipient_id: int, amount: float, every_days: int,
+                         start: Optional[str] = None):
+    sender_id = interaction.user.id
+    amount = parse_amount(amount)
+    if amount is None or amount <= 0:
+        embed = discord.Embed(
+            title="Invalid Amount",
+            description=f"Transfer amount must be a positive value with at most two decimal places, up to {format_amount(MAX_AMOUNT)}.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    if not 1 <= every_days <= MAX_INTERVAL_DAYS:
+        embed = discord.Embed(
+            title="Invalid Interval",
+            description=f"Days between transfers must be between 1 and {MAX_INTERVAL_DAYS}.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    now = datetime.now()
+    next_run = now
+    if start:
+        try:
+            next_run = max(datetime.strptime(start, '%Y-%m-%d'), now)
+        except ValueError:
+            embed = discord.Embed(
+                title="Invalid Date",
+                description="Dates must be given as YYYY-MM-DD.",
+                color=COLOR_ERROR
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
+
+    if recipient_id == sender_id or not await accounts.get(sender_id) or not await accounts.get(recipient_id):
+        embed = discord.Embed(
+            title="Account Not Found",
+            description="One or both accounts were not found. Please check the recipient ID and try again.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    if len(await db.get_standing_orders(sender_id)) >= MAX_STANDING_ORDERS:
+        embed = discord.Embed(
+            title="Too Many Standing Orders",
+            description=f"You can have at most {MAX_STANDING_ORDERS} standing orders. Cancel one to set up another.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    order_id = await db.create_standing_order(sender_id, recipient_id, amount, every_days,
+                                              next_run.isoformat(timespec='seconds'), now.isoformat())
+    embed = discord.Embed(
+        title="Standing Order Created",
+        description=f"Standing order #{order_id} will transfer {format_amount(amount)} to user with ID {recipient_id} "
+                    f"every {every_days} day(s), starting {next_run.strftime('%Y-%m-%d')}.",
+        color=COLOR_SUCCESS
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# List standing orders
+@app_commands.command(name="standing_orders", description="View your standing orders.")
+async def standing_orders(interaction: discord.Interaction):
+    orders = await db.get_standing_orders(interaction.user.id)
+    if orders:
+        embed = discord.Embed(
+            title="Standing Orders",
+            color=COLOR_INFO
+        )
+        for order_id, _, recipient_id, amount, interval_days, next_run, last_status, _ in orders:
+            value = (f"{format_amount(amount)} to user ID {recipient_id} every {interval_days} day(s), "
+                     f"next on {next_run[:10]}")
+            if last_status:
+                value += f", last run: {last_status}"
+            embed.add_field(name=f"Order #{order_id}", value=value, inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        embed = discord.Embed(
+            title="No Standing Orders",
+            description="You have no standing orders.",
+            color=COLOR_WARNING
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Cancel a standing order
+@app_commands.command(name="cancel_standing_order", description="Cancel one of your standing orders.")
+@app_commands.describe(order_id="Standing order ID to cancel")
+async def cancel_standing_order(interaction: discord.Interaction, order_id: int):
+    if await db.cancel_standing_order(order_id, interaction.user.id):
+        embed = discord.Embed(
+            title="Standing Order Cancelled",
+            description=f"Standing order #{order_id} has been cancelled.",
+            color=COLOR_SUCCESS
+        )
+    else:
+        embed = discord.Embed(
+            title="Standing Order Not Found",
+            description=f"You have no standing order #{order_id}.",
+            color=COLOR_ERROR
+        )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+COMMANDS = [standing_order, standing_orders, cancel_standing_order]
+
+async def setup(bot):
+    for command in COMMANDS:
+        bot.tree.add_command(command)
+
+async def teardown(bot):
+    for command in COMMANDS:
+        bot.tree.remove_command(command.name)
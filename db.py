@@ -0,0 +1,660 @@
+import asyncio
+import functools
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import archive
+import audit
+from ledger import (ACTIVE, STATUS_ENTRY_TYPES, AccountNotFound, AccountUnavailable, DuplicateOperation,
+                    InsufficientFunds, RequestNotFound, can_receive, can_send, current_status)
+from migrations import CHANGE_LOG_COMMIT, migrate
+from money import RATE_SCALE
+from storage import OwnEntries, Storage, next_day, uncovered_debits
+
+
+def _balance(c, user_id):
+    return c.execute("SELECT balance FROM accounts WHERE user_id=?", (user_id,)).fetchone()[0]
+
+
+# Raise unless the account exists and its status allows the movement
+def _check_status(c, user_id, allowed, now):
+    row = c.execute("SELECT status, status_reason, status_until FROM accounts WHERE user_id=?", (user_id,)).fetchone()
+    if not row:
+        raise AccountNotFound(user_id)
+    status = current_status(row[0], row[2], now)
+    if not allowed(status):
+        raise AccountUnavailable(user_id, status, row[1], row[2])
+
+
+# SQLite storage backend for bank.db.
+# SQLite calls block, so none of them run on the event loop. Writes go through a
+# single writer thread that owns the write connection (SQLite only allows one
+# writer anyway), reads are spread over a small pool of reader threads that each
+# hold their own connection. Command handlers only ever await these methods.
+#
+# Ledger operations run as one BEGIN IMMEDIATE transaction each, and balances
+# are only ever changed in SQL (balance = balance - ? WHERE balance >= ?), never
+# computed in Python from an earlier read, so concurrent movements cannot lose
+# updates. Within this process the writer thread is the write lock; BEGIN
+# IMMEDIATE takes SQLite's own write lock against other processes.
+#
+# Old transactions can be moved to monthly archive databases in archive_dir
+# (see archive.py); history pages read from them when they get that far back.
+class Database(Storage):
+    supports_archive = True
+    supports_backup = True
+
+    def __init__(self, path='bank.db', readers=2, timeout=5.0, cache_size_kib=65536, archive_dir=None):
+        self.path = path
+        self.archive_dir = archive_dir or os.path.join(os.path.dirname(os.path.abspath(path)), 'archive')
+        self.timeout = timeout
+        self.cache_size_kib = cache_size_kib
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+        self._change_log = False  # set once open() has brought the schema up to date
+        self.own_entries = OwnEntries()
+
+    # Each worker thread lazily opens its own connection
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            # WAL lets the reader threads run alongside the writer; with WAL,
+            # synchronous=NORMAL only fsyncs at checkpoints and stays durable
+            # against application crashes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _run_read(self, fn, args):
+        return fn(self._connection().cursor(), *args)
+
+    def _run_write(self, fn, args):
+        conn = self._connection()
+        try:
+            result = fn(conn.cursor(), *args)
+            self._log_commit(conn)
+            conn.commit()
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+
+    # Same as _run_write, but takes the SQLite write lock up front so a busy
+    # database fails at BEGIN, before any statement has run. Holding the lock
+    # also means every ledger entry written in between is this process's own.
+    def _run_transaction(self, fn, args):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            first = self._last_entry_id(conn) + 1
+            result = fn(conn.cursor(), *args)
+            last = self._last_entry_id(conn)
+            self._log_commit(conn)
+            conn.commit()
+            if last >= first:
+                self.own_entries.add(first, last)
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+
+    # Highest ledger entry ID ever handed out (transactions is AUTOINCREMENT)
+    @staticmethod
+    def _last_entry_id(conn):
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='transactions'").fetchone()
+        return row[0] if row else 0
+
+    # Mark the end of a transaction in the change log (see backup.py)
+    def _log_commit(self, conn):
+        if self._change_log:
+            conn.execute(CHANGE_LOG_COMMIT)
+
+    # Run fn(cursor, *args) on a reader thread
+    async def read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(self._run_read, fn, args))
+
+    # Run fn(cursor, *args) on the writer thread as one transaction
+    async def write(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, functools.partial(self._run_write, fn, args))
+
+    # Run fn(cursor, *args) on the writer thread inside BEGIN IMMEDIATE
+    async def transaction(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, functools.partial(self._run_transaction, fn, args))
+
+    # Create or upgrade the schema (see migrations.py)
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        start = await loop.run_in_executor(self._writer, lambda: migrate(self._connection()))
+        self._change_log = True
+        return start
+
+    def _close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    async def close(self):
+        await asyncio.to_thread(self._close)
+
+    # SQLite reports lock contention as an OperationalError
+    def is_retryable(self, error):
+        if not isinstance(error, sqlite3.OperationalError):
+            return False
+        message = str(error).lower()
+        return 'locked' in message or 'busy' in message
+
+    # Generic helpers
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda c: c.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda c: c.execute(sql, params).fetchall())
+
+    # Returns the cursor's lastrowid
+    async def execute(self, sql, params=()):
+        def _execute(c):
+            c.execute(sql, params)
+            return c.lastrowid
+        return await self.write(_execute)
+
+    # Accounts
+
+    async def get_account(self, user_id):
+        return await self.fetchone("SELECT * FROM accounts WHERE user_id=?", (user_id,))
+
+    async def create_account(self, user_id, username, created_at):
+        def _create(c):
+            c.execute("INSERT OR IGNORE INTO accounts (user_id, username, balance, created_at) VALUES (?, ?, ?, ?)",
+                      (user_id, username, 0, created_at))
+            return c.rowcount == 1
+        return await self.write(_create)
+
+    # Status changes are written to the ledger as entries of amount 0, which
+    # also lets the change feed invalidate the account in other processes
+    async def set_status(self, user_ids, status, reason=None, until=None):
+        def _set(c):
+            c.execute("CREATE TEMP TABLE IF NOT EXISTS status_users (user_id INTEGER PRIMARY KEY)")
+            c.execute("DELETE FROM status_users")
+            c.executemany("INSERT OR IGNORE INTO status_users (user_id) VALUES (?)", [(user_id,) for user_id in user_ids])
+            c.execute('''UPDATE accounts SET status=?, status_reason=?, status_until=?
+                         WHERE user_id IN (SELECT user_id FROM status_users)''', (status, reason, until))
+            c.execute('''INSERT INTO transactions (user_id, type, amount, date)
+                         SELECT user_id, ?, 0, ? FROM accounts
+                         WHERE user_id IN (SELECT user_id FROM status_users) ORDER BY user_id''',
+                      (STATUS_ENTRY_TYPES[status], datetime.now().isoformat()))
+            updated = [row[0] for row in c.execute('''SELECT user_id FROM accounts
+                                                      WHERE user_id IN (SELECT user_id FROM status_users)
+                                                      ORDER BY user_id''').fetchall()]
+            c.execute("DELETE FROM status_users")
+            return updated
+        return await self.transaction(_set)
+
+    async def expire_statuses(self, user_ids, now):
+        def _expire(c):
+            expired = [user_id for user_id in user_ids if c.execute(
+                "SELECT 1 FROM accounts WHERE user_id=? AND status != 'active' AND status_until <= ?", (user_id, now)
+            ).fetchone()]
+            for user_id in expired:
+                c.execute("UPDATE accounts SET status=?, status_reason=NULL, status_until=NULL WHERE user_id=?",
+                          (ACTIVE, user_id))
+            c.executemany("INSERT INTO transactions (user_id, type, amount, date) VALUES (?, ?, 0, ?)",
+                          [(user_id, STATUS_ENTRY_TYPES[ACTIVE], now) for user_id in expired])
+            return expired
+        return await self.transaction(_expire)
+
+    # Reads idx_accounts_status_until, which only holds accounts with an expiry
+    async def get_status_expiries(self):
+        return await self.fetchall('''SELECT user_id, status_until FROM accounts
+                                      WHERE status != 'active' AND status_until IS NOT NULL''')
+
+    # Transactions
+
+    # Keyset pagination makes every page a bounded walk of
+    # idx_transactions_user_date no matter how long the history is. Archived
+    # history is only opened when the user has some (a transaction_rollups row)
+    # and the page reaches into its date range.
+    async def get_transactions_page(self, user_id, limit, after=None, before=None,
+                                    transaction_type=None, start=None, end=None):
+        sql = "SELECT id, user_id, type, amount, date FROM transactions WHERE user_id=?"
+        params = [user_id]
+        if transaction_type:
+            sql += " AND type=?"
+            params.append(transaction_type)
+        if start:
+            sql += " AND date >= ?"
+            params.append(start)
+        if end:
+            sql += " AND date < ?"
+            params.append(end)
+        if before:
+            sql += " AND (date, id) > (?, ?) ORDER BY date ASC, id ASC LIMIT ?"
+            params.extend([before[0], before[1], limit + 1])
+        else:
+            if after:
+                sql += " AND (date, id) < (?, ?)"
+                params.extend(after)
+            sql += " ORDER BY date DESC, id DESC LIMIT ?"
+            params.append(limit + 1)
+
+        def _page(c):
+            rows = c.execute(sql, params).fetchall()
+            rollup = c.execute("SELECT first_date, last_date FROM transaction_rollups WHERE user_id=?",
+                               (user_id,)).fetchone()
+            if rollup is None:
+                return rows
+            first_date, last_date = rollup
+            if before:
+                reaches = before[0] <= last_date and (len(rows) <= limit or rows[limit][4] >= first_date)
+            else:
+                reaches = (after is None or after[0] >= first_date) and (len(rows) <= limit or rows[limit][4] <= last_date)
+            if not reaches:
+                return rows
+            return archive.merge_page(self.archive_dir, rows, sql, params, first_date, last_date,
+                                      descending=not before, need=limit + 1)
+
+        rows = await self.read(_page)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before:
+            rows.reverse()
+        return rows, has_more
+
+    # Pending requests
+
+    # Every row runs under its own SAVEPOINT, so a failing row (a constraint,
+    # a duplicate key, an amount too large to bind) only fails itself
+    async def add_requests(self, requests):
+        def _insert(c):
+            results = []
+            for user_id, request_type, amount, date, key in requests:
+                c.execute("SAVEPOINT add_request")
+                try:
+                    c.execute("INSERT INTO pending_requests (user_id, type, amount, status, date) VALUES (?, ?, ?, 'pending', ?)",
+                              (user_id, request_type, amount, date))
+                    request_id = c.lastrowid
+                    if key is not None:
+                        c.execute("INSERT OR IGNORE INTO ledger_operations (key, result, created_at) VALUES (?, ?, ?)",
+                                  (key, request_id, date))
+                        if c.rowcount == 0:
+                            original = c.execute("SELECT result FROM ledger_operations WHERE key=?", (key,)).fetchone()[0]
+                            raise DuplicateOperation(key, original)
+                    results.append(request_id)
+                except Exception as e:
+                    c.execute("ROLLBACK TO add_request")
+                    results.append(e)
+                c.execute("RELEASE add_request")
+            return results
+        return await self.transaction(_insert)
+
+    async def get_request(self, request_id):
+        return await self.fetchone("SELECT * FROM pending_requests WHERE id=?", (request_id,))
+
+    async def delete_request(self, request_id):
+        await self.execute("DELETE FROM pending_requests WHERE id=?", (request_id,))
+
+    async def get_pending_requests(self):
+        return await self.fetchall("SELECT * FROM pending_requests WHERE status='pending'")
+
+    # Ledger operations
+
+    async def transfer(self, sender_id, recipient_id, amount, idempotency_key=None):
+        def _transfer(c):
+            if idempotency_key is not None:
+                c.execute("INSERT OR IGNORE INTO ledger_operations (key, created_at) VALUES (?, ?)",
+                          (idempotency_key, datetime.now().isoformat()))
+                if c.rowcount == 0:
+                    raise DuplicateOperation(idempotency_key)
+            now = datetime.now().isoformat()
+            _check_status(c, recipient_id, can_receive, now)
+            # The status check rides along in the debit itself
+            c.execute('''UPDATE accounts SET balance = balance - ?
+                         WHERE user_id=? AND balance >= ? AND (status = 'active' OR status_until <= ?)''',
+                      (amount, sender_id, amount, now))
+            if c.rowcount == 0:
+                _check_status(c, sender_id, can_send, now)
+                raise InsufficientFunds(sender_id)
+            c.execute("UPDATE accounts SET balance = balance + ? WHERE user_id=?", (amount, recipient_id))
+            c.executemany("INSERT INTO transactions (user_id, type, amount, date) VALUES (?, ?, ?, ?)",
+                          [(sender_id, 'transfer out', -amount, now),
+                           (recipient_id, 'transfer in', amount, now)])
+            return [(user_id, _balance(c, user_id)) for user_id in (sender_id, recipient_id)]
+        return await self.transaction(_transfer)
+
+    # The difference to the old balance is written as a ledger entry
+    async def set_balance(self, user_id, balance, entry_type):
+        def _set(c):
+            row = c.execute("SELECT balance FROM accounts WHERE user_id=?", (user_id,)).fetchone()
+            if not row:
+                raise AccountNotFound(user_id)
+            c.execute("UPDATE accounts SET balance=? WHERE user_id=?", (balance, user_id))
+            c.execute("INSERT INTO transactions (user_id, type, amount, date) VALUES (?, ?, ?, ?)",
+                      (user_id, entry_type, balance - row[0], datetime.now().isoformat()))
+        await self.transaction(_set)
+
+    async def approve_request(self, request_id):
+        def _approve(c):
+            request = c.execute("SELECT user_id, type, amount FROM pending_requests WHERE id=?",
+                                (request_id,)).fetchone()
+            if not request:
+                raise RequestNotFound(request_id)
+            user_id, request_type, amount = request
+            _check_status(c, user_id, can_receive if request_type == 'deposit' else can_send, datetime.now().isoformat())
+
+            if request_type == 'deposit':
+                c.execute("UPDATE accounts SET balance = balance + ? WHERE user_id=?", (amount, user_id))
+                entry = ('deposit', amount)
+            else:
+                c.execute("UPDATE accounts SET balance = balance - ? WHERE user_id=? AND balance >= ?",
+                          (amount, user_id, amount))
+                if c.rowcount == 0:
+                    raise InsufficientFunds(user_id)
+                entry = ('withdrawal', -amount)
+
+            c.execute("DELETE FROM pending_requests WHERE id=?", (request_id,))
+            c.execute("INSERT INTO transactions (user_id, type, amount, date) VALUES (?, ?, ?, ?)",
+                      (user_id, entry[0], entry[1], datetime.now().isoformat()))
+            return request, _balance(c, user_id)
+        return await self.transaction(_approve)
+
+    # Selected requests are collected in a temp table and applied set-based
+    async def apply_requests(self, action, ranges=None, request_type=None, max_amount=None, before=None):
+        where = ["status='pending'"]
+        params = []
+        if ranges:
+            where.append("EXISTS (SELECT 1 FROM batch_ranges r WHERE p.id BETWEEN r.low AND r.high)")
+        if request_type:
+            where.append("type=?")
+            params.append(request_type)
+        if max_amount is not None:
+            where.append("amount <= ?")
+            params.append(max_amount)
+        if before:
+            where.append("date < ?")
+            params.append(before)
+
+        def _apply(c):
+            c.execute("CREATE TEMP TABLE IF NOT EXISTS batch_ranges (low INTEGER, high INTEGER)")
+            c.execute('''CREATE TEMP TABLE IF NOT EXISTS batch_requests (
+                            id INTEGER PRIMARY KEY,
+                            user_id INTEGER,
+                            type TEXT,
+                            amount INTEGER,
+                            skip TEXT
+                        )''')
+            c.execute("CREATE INDEX IF NOT EXISTS temp.idx_batch_requests_user ON batch_requests (user_id, type)")
+            c.execute("DELETE FROM batch_ranges")
+            c.execute("DELETE FROM batch_requests")
+            if ranges:
+                c.executemany("INSERT INTO batch_ranges (low, high) VALUES (?, ?)", ranges)
+            c.execute(f'''INSERT INTO batch_requests (id, user_id, type, amount)
+                          SELECT id, user_id, type, amount FROM pending_requests p
+                          WHERE {' AND '.join(where)}''', params)
+
+            if action == 'approve':
+                c.execute('''UPDATE batch_requests SET skip='account not found'
+                             WHERE user_id NOT IN (SELECT user_id FROM accounts)''')
+                now = datetime.now().isoformat()
+                c.execute('''UPDATE batch_requests SET skip='account locked'
+                             WHERE skip IS NULL AND user_id IN (
+                                 SELECT user_id FROM accounts
+                                 WHERE status='locked' AND (status_until IS NULL OR status_until > ?)
+                             )''', (now,))
+                c.execute('''UPDATE batch_requests SET skip='account frozen'
+                             WHERE skip IS NULL AND type='withdraw' AND user_id IN (
+                                 SELECT user_id FROM accounts
+                                 WHERE status='frozen' AND (status_until IS NULL OR status_until > ?)
+                             )''', (now,))
+                # Withdrawals are covered in ID order from the balance plus the
+                # batch's deposits; a refused one does not use up any of it
+                withdrawals = c.execute('''SELECT id, user_id, amount FROM batch_requests
+                                           WHERE type='withdraw' AND skip IS NULL ORDER BY id''').fetchall()
+                available = c.execute('''SELECT a.user_id, a.balance + COALESCE((
+                                             SELECT SUM(d.amount) FROM batch_requests d
+                                             WHERE d.user_id = a.user_id AND d.type='deposit' AND d.skip IS NULL
+                                         ), 0)
+                                         FROM accounts a WHERE a.user_id IN (
+                                             SELECT user_id FROM batch_requests WHERE type='withdraw' AND skip IS NULL
+                                         )''').fetchall()
+                c.executemany("UPDATE batch_requests SET skip='insufficient funds' WHERE id=?",
+                              [(request_id,) for request_id in uncovered_debits(withdrawals, dict(available))])
+                c.execute('''UPDATE accounts SET balance = balance + (
+                                 SELECT SUM(CASE WHEN b.type='deposit' THEN b.amount ELSE -b.amount END)
+                                 FROM batch_requests b WHERE b.user_id = accounts.user_id AND b.skip IS NULL
+                             )
+                             WHERE user_id IN (SELECT user_id FROM batch_requests WHERE skip IS NULL)''')
+                c.execute('''INSERT INTO transactions (user_id, type, amount, date)
+                             SELECT user_id,
+                                    CASE WHEN type='deposit' THEN 'deposit' ELSE 'withdrawal' END,
+                                    CASE WHEN type='deposit' THEN amount ELSE -amount END,
+                                    ?
+                             FROM batch_requests WHERE skip IS NULL ORDER BY id''', (datetime.now().isoformat(),))
+
+            c.execute("DELETE FROM pending_requests WHERE id IN (SELECT id FROM batch_requests WHERE skip IS NULL)")
+            applied = c.execute("SELECT id, user_id FROM batch_requests WHERE skip IS NULL ORDER BY id").fetchall()
+            skipped = c.execute("SELECT id, skip FROM batch_requests WHERE skip IS NOT NULL ORDER BY id").fetchall()
+            balances = c.execute('''SELECT user_id, balance FROM accounts
+                                    WHERE user_id IN (SELECT user_id FROM batch_requests WHERE skip IS NULL)''').fetchall()
+            c.execute("DELETE FROM batch_ranges")
+            c.execute("DELETE FROM batch_requests")
+            return applied, skipped, balances
+
+        return await self.transaction(_apply)
+
+    async def expire_operations(self, before, batch_size=5000):
+        def _expire(c):
+            c.execute('''DELETE FROM ledger_operations WHERE key IN (
+                             SELECT key FROM ledger_operations WHERE created_at < ? LIMIT ?
+                         )''', (before, batch_size))
+            return c.rowcount
+        # Short transactions, so ledger writes are not held up behind a big delete
+        removed = 0
+        while True:
+            count = await self.transaction(_expire)
+            removed += count
+            if count < batch_size:
+                return removed
+
+    # Scheduled jobs
+
+    async def create_standing_order(self, sender_id, recipient_id, amount, interval_days, next_run, created_at):
+        return await self.execute('''INSERT INTO standing_orders (sender_id, recipient_id, amount, interval_days, next_run, created_at)
+                                     VALUES (?, ?, ?, ?, ?, ?)''',
+                                  (sender_id, recipient_id, amount, interval_days, next_run, created_at))
+
+    async def get_standing_orders(self, sender_id):
+        return await self.fetchall('''SELECT id, sender_id, recipient_id, amount, interval_days, next_run, last_status, created_at
+                                      FROM standing_orders WHERE sender_id=? ORDER BY id''', (sender_id,))
+
+    async def cancel_standing_order(self, order_id, sender_id):
+        def _cancel(c):
+            c.execute("DELETE FROM standing_orders WHERE id=? AND sender_id=?", (order_id, sender_id))
+            return c.rowcount > 0
+        return await self.write(_cancel)
+
+    # Due orders are taken off idx_standing_orders_next_run into a temp table
+    # and paid set-based, like apply_requests. Each sender's orders are paid in
+    # order while the balance covers them; money received in the same batch
+    # does not count towards it.
+    async def run_standing_orders(self, now, limit):
+        def _run(c):
+            c.execute('''CREATE TEMP TABLE IF NOT EXISTS due_orders (
+                            id INTEGER PRIMARY KEY,
+                            sender_id INTEGER,
+                            recipient_id INTEGER,
+                            amount INTEGER,
+                            skip TEXT
+                        )''')
+            c.execute("DELETE FROM due_orders")
+            c.execute('''INSERT INTO due_orders (id, sender_id, recipient_id, amount)
+                         SELECT id, sender_id, recipient_id, amount FROM standing_orders
+                         WHERE next_run <= ? ORDER BY next_run, id LIMIT ?''', (now, limit))
+            c.execute('''UPDATE due_orders SET skip='account not found'
+                         WHERE sender_id NOT IN (SELECT user_id FROM accounts)
+                            OR recipient_id NOT IN (SELECT user_id FROM accounts)''')
+            c.execute('''UPDATE due_orders SET skip='account ' || (SELECT status FROM accounts WHERE user_id = sender_id)
+                         WHERE skip IS NULL AND sender_id IN (
+                             SELECT user_id FROM accounts
+                             WHERE status != 'active' AND (status_until IS NULL OR status_until > ?)
+                         )''', (now,))
+            c.execute('''UPDATE due_orders SET skip='recipient locked'
+                         WHERE skip IS NULL AND recipient_id IN (
+                             SELECT user_id FROM accounts
+                             WHERE status='locked' AND (status_until IS NULL OR status_until > ?)
+                         )''', (now,))
+            # A refused order does not use up the balance for the sender's later ones
+            orders = c.execute("SELECT id, sender_id, amount FROM due_orders WHERE skip IS NULL ORDER BY id").fetchall()
+            available = c.execute('''SELECT user_id, balance FROM accounts
+                                     WHERE user_id IN (SELECT sender_id FROM due_orders WHERE skip IS NULL)''').fetchall()
+            c.executemany("UPDATE due_orders SET skip='insufficient funds' WHERE id=?",
+                          [(order_id,) for order_id in uncovered_debits(orders, dict(available))])
+            c.execute('''UPDATE accounts SET balance = balance
+                             + COALESCE((SELECT SUM(amount) FROM due_orders
+                                         WHERE recipient_id = accounts.user_id AND skip IS NULL), 0)
+                             - COALESCE((SELECT SUM(amount) FROM due_orders
+                                         WHERE sender_id = accounts.user_id AND skip IS NULL), 0)
+                         WHERE user_id IN (SELECT sender_id FROM due_orders WHERE skip IS NULL
+                                           UNION SELECT recipient_id FROM due_orders WHERE skip IS NULL)''')
+            c.execute('''INSERT INTO transactions (user_id, type, amount, date)
+                         SELECT user_id, type, amount, ? FROM (
+                             SELECT id, 0 AS leg, sender_id AS user_id, 'transfer out' AS type, -amount AS amount
+                             FROM due_orders WHERE skip IS NULL
+                             UNION ALL
+                             SELECT id, 1, recipient_id, 'transfer in', amount FROM due_orders WHERE skip IS NULL
+                         ) ORDER BY id, leg''', (datetime.now().isoformat(),))
+            c.execute('''UPDATE standing_orders
+                         SET next_run = strftime('%Y-%m-%dT%H:%M:%S', next_run, '+' || interval_days || ' days'),
+                             last_status = COALESCE((SELECT skip FROM due_orders d WHERE d.id = standing_orders.id), 'paid')
+                         WHERE id IN (SELECT id FROM due_orders)''')
+            paid = c.execute('''SELECT id, sender_id, recipient_id, amount FROM due_orders
+                                WHERE skip IS NULL ORDER BY id''').fetchall()
+            skipped = c.execute("SELECT id, sender_id, skip FROM due_orders WHERE skip IS NOT NULL ORDER BY id").fetchall()
+            balances = c.execute('''SELECT user_id, balance FROM accounts
+                                    WHERE user_id IN (SELECT sender_id FROM due_orders WHERE skip IS NULL
+                                                      UNION SELECT recipient_id FROM due_orders WHERE skip IS NULL)''').fetchall()
+            c.execute("DELETE FROM due_orders")
+            return paid, skipped, balances
+        return await self.transaction(_run)
+
+    # One batch walks accounts in user ID order from the job's cursor; the
+    # interest is worked out once into a temp table, which then feeds both
+    # the balance UPDATE and the ledger entries. balance * rate / RATE_SCALE is
+    # split at RATE_SCALE so the integer product cannot overflow.
+    async def pay_interest(self, rate, today, limit):
+        def _pay(c):
+            day, cursor = c.execute("SELECT next_run, cursor FROM scheduled_jobs WHERE name='interest'").fetchone()
+            if day is None:
+                # Interest starts the day after it is first run
+                c.execute("UPDATE scheduled_jobs SET next_run=?, cursor=0 WHERE name='interest'", (next_day(today),))
+                return None
+            if day > today:
+                return None
+            if not rate:
+                c.execute("UPDATE scheduled_jobs SET next_run=?, cursor=0 WHERE name='interest'", (next_day(today),))
+                return day, [], []
+            c.execute("CREATE TEMP TABLE IF NOT EXISTS interest_batch (user_id INTEGER PRIMARY KEY, amount INTEGER)")
+            c.execute("DELETE FROM interest_batch")
+            c.execute('''INSERT INTO interest_batch (user_id, amount)
+                         SELECT user_id, (balance / ?) * ? + (balance % ?) * ? / ? FROM accounts
+                         WHERE user_id > ? AND balance > 0
+                           AND NOT (status = 'locked' AND (status_until IS NULL OR status_until > ?))
+                         ORDER BY user_id LIMIT ?''',
+                      (RATE_SCALE, rate, RATE_SCALE, rate, RATE_SCALE, cursor, datetime.now().isoformat(), limit))
+            count, last = c.execute("SELECT COUNT(*), MAX(user_id) FROM interest_batch").fetchone()
+            c.execute("DELETE FROM interest_batch WHERE amount <= 0")
+            c.execute('''UPDATE accounts SET balance = balance + (
+                             SELECT amount FROM interest_batch b WHERE b.user_id = accounts.user_id
+                         )
+                         WHERE user_id IN (SELECT user_id FROM interest_batch)''')
+            c.execute('''INSERT INTO transactions (user_id, type, amount, date)
+                         SELECT user_id, 'interest', amount, ? FROM interest_batch ORDER BY user_id''',
+                      (datetime.now().isoformat(),))
+            if count < limit:
+                c.execute("UPDATE scheduled_jobs SET next_run=?, cursor=0 WHERE name='interest'", (next_day(day),))
+            else:
+                c.execute("UPDATE scheduled_jobs SET cursor=? WHERE name='interest'", (last,))
+            paid = c.execute("SELECT user_id, amount FROM interest_batch ORDER BY user_id").fetchall()
+            balances = c.execute('''SELECT user_id, balance FROM accounts
+                                    WHERE user_id IN (SELECT user_id FROM interest_batch)''').fetchall()
+            c.execute("DELETE FROM interest_batch")
+            return day, paid, balances
+        return await self.transaction(_pay)
+
+    # Archival
+
+    # Move transactions older than cutoff (ISO date) to the archives, one chunk
+    # at a time. Chunks are read on a reader thread and copied on a thread of
+    # their own; only the delete takes the writer, briefly, and the pause
+    # between chunks leaves room for the bot's own writes. Returns how many
+    # transactions were archived.
+    async def archive_transactions(self, cutoff, chunk_size=archive.ARCHIVE_CHUNK_SIZE, pause=0.05):
+        archived = 0
+        while True:
+            rows = await self.read(archive.select_chunk, cutoff, chunk_size)
+            if not rows:
+                break
+            await asyncio.to_thread(archive.write_partitions, self.archive_dir, rows)
+            archived += await self.transaction(archive.remove_chunk, [row[0] for row in rows])
+            await asyncio.sleep(pause)
+        while await self.write(archive.incremental_vacuum):
+            await asyncio.sleep(pause)
+        return archived
+
+    # Change feed
+
+    async def get_last_transaction_id(self):
+        return (await self.fetchone("SELECT COALESCE(MAX(id), 0) FROM transactions"))[0]
+
+    async def get_ledger_changes(self, after_id, limit):
+        return await self.fetchall("SELECT id, user_id FROM transactions WHERE id > ? ORDER BY id LIMIT ?",
+                                   (after_id, limit))
+
+    # Analytics (aggregates kept by the triggers of migration 9)
+
+    # Walks idx_accounts_balance from the top
+    async def get_top_balances(self, limit):
+        return await self.fetchall('''SELECT user_id, balance FROM accounts WHERE balance > 0
+                                      ORDER BY balance DESC, user_id LIMIT ?''', (limit,))
+
+    async def get_bank_totals(self):
+        return await self.fetchone('''SELECT COALESCE(SUM(accounts), 0), COALESCE(SUM(money_supply), 0),
+                                             COALESCE(SUM(deposits), 0), COALESCE(SUM(withdrawals), 0),
+                                             COALESCE(SUM(transfers), 0)
+                                      FROM bank_totals''')
+
+    async def get_daily_totals(self, since):
+        return await self.fetchall('''SELECT day, SUM(deposits), SUM(withdrawals), SUM(transfers), SUM(entries)
+                                      FROM daily_totals WHERE day >= ? GROUP BY day ORDER BY day DESC''', (since,))
+
+    async def get_monthly_summaries(self, user_id, limit, month=None):
+        sql = '''SELECT month, deposits, withdrawals, transfers_in, transfers_out, adjustments, entries
+                 FROM monthly_summaries WHERE user_id=?'''
+        if month:
+            return await self.fetchall(sql + " AND month=?", (user_id, month))
+        return await self.fetchall(sql + " ORDER BY month DESC LIMIT ?", (user_id, limit))
+
+    # Audit
+
+    async def audit_account(self, user_id):
+        return await self.transaction(audit.audit_account, user_id)
+
+    async def audit_batch(self, after_user_id=None):
+        return await self.transaction(audit.audit_batch, after_user_id)
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+
+# Ledger change feed.
+# When several bot processes share one storage backend (one per group of
+# shards), each keeps its own AccountCache, and a balance changed by one process
+# would stay stale in the others. Every balance change writes a ledger entry, so
+# each process tails the transactions table and invalidates the accounts touched
+# since it last looked. Entries this process wrote itself are skipped: the
+# ledger already wrote their balances through to the cache, and invalidating
+# them would only throw away the fresh values (see OwnEntries in storage.py).
+#
+# On PostgreSQL transaction IDs come from a sequence and can commit out of
+# order, so an ID skipped by one poll may still appear a moment later. Skipped
+# IDs are re-checked on every poll until they show up or have been missing for
+# gap_timeout seconds (a rolled back insert leaves a gap that never fills).
+class LedgerFeed:
+    def __init__(self, db, cache, interval=1.0, batch_size=1000, gap_timeout=10.0):
+        self.db = db
+        self.cache = cache
+        self.interval = interval
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout
+        self._after = None
+        self._gaps = {}
+        self._task = None
+
+    async def start(self):
+        if self._task is not None:
+            return
+        # Everything committed before now is already reflected in the database,
+        # and the cache is empty or will be loaded from it
+        self._after = await self.db.get_last_transaction_id()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"Ledger feed poll failed: {e}")
+
+    # Invalidate every account with ledger entries committed since the last poll
+    async def poll(self):
+        if self._gaps:
+            await self._recheck_gaps()
+        while True:
+            changes = await self.db.get_ledger_changes(self._after, self.batch_size)
+            now = time.monotonic()
+            for transaction_id, user_id in changes:
+                for missing in range(self._after + 1, transaction_id):
+                    self._gaps[missing] = now
+                self._after = transaction_id
+                self._invalidate(transaction_id, user_id)
+            if len(changes) < self.batch_size:
+                break
+        own = self.db.own_entries
+        if own is not None:
+            own.forget(min(self._gaps) - 1 if self._gaps else self._after)
+
+    def _invalidate(self, transaction_id, user_id):
+        own = self.db.own_entries
+        if own is None or transaction_id not in own:
+            self.cache.invalidate(user_id)
+
+    async def _recheck_gaps(self):
+        first = min(self._gaps)
+        for transaction_id, user_id in await self.db.get_ledger_changes(first - 1, self.batch_size):
+            if self._gaps.pop(transaction_id, None) is not None:
+                self._invalidate(transaction_id, user_id)
+        deadline = time.monotonic() - self.gap_timeout
+        self._gaps = {transaction_id: opened for transaction_id, opened in self._gaps.items() if opened > deadline}
@@ -0,0 +1,72 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from ledger import DuplicateOperation
+
+
+# In-memory front for idempotency keys.
+# The storage backend is the authority on which operations have run: an
+# operation records its key in ledger_operations inside its own transaction and
+# fails with DuplicateOperation if the key is already there. That check costs no
+# extra round trip for a new key, so this front only handles repeats, which are
+# answered from memory without touching the database:
+#   - a key that completed recently (LRU, expires after ttl seconds, like the
+#     stored keys) raises DuplicateOperation with the first run's result
+#   - a key that is still running waits for that run instead of starting a
+#     second one, then raises DuplicateOperation, or the first run's error
+# Repeats served by another process are still caught by the backend.
+class RecentOperations:
+    def __init__(self, maxsize=10000, ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._done = OrderedDict()
+        self._running = {}
+
+    # Run operation(*args) once per key. A None key always runs.
+    async def run(self, key, operation, *args):
+        if key is None:
+            return await operation(*args)
+
+        done = self._done.get(key)
+        if done is not None:
+            result, finished = done
+            if time.monotonic() - finished < self.ttl:
+                self._done.move_to_end(key)
+                raise DuplicateOperation(key, result)
+            del self._done[key]
+
+        running = self._running.get(key)
+        if running is not None:
+            result = await asyncio.shield(running)
+            raise DuplicateOperation(key, result)
+
+        future = asyncio.get_running_loop().create_future()
+        self._running[key] = future
+        try:
+            result = await operation(*args)
+        except DuplicateOperation as e:
+            self._finish(key, e.result)
+            future.set_exception(e)
+            raise
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            self._finish(key, result)
+            future.set_result(result)
+            return result
+        finally:
+            del self._running[key]
+            # There may be nobody waiting; mark the error as retrieved
+            if future.done() and not future.cancelled():
+                future.exception()
+
+    def _finish(self, key, result):
+        self._done[key] = (result, time.monotonic())
+        self._done.move_to_end(key)
+        if len(self._done) > self.maxsize:
+            self._done.popitem(last=False)
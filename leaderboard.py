@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+
+# In-memory top-K of account balances for /leaderboard.
+# Holds the size + spare richest accounts with a positive balance, loaded from
+# the balance index (one short walk of K rows), and keeps them current from the
+# balances the Ledger writes through, the same way as the AccountCache.
+#
+# Every account not held has a balance of at most bound, so a balance written
+# through above bound belongs in the list, and a held account that drops below
+# bound has to leave it (someone not held may now be richer). When fewer than
+# size accounts are left that way the list is reloaded, and it is reloaded
+# every refresh seconds anyway to pick up balances other bot processes changed.
+class Leaderboard:
+    def __init__(self, db, size=10, spare=10, refresh=60.0):
+        self.db = db
+        self.size = size
+        self.capacity = size + spare
+        self.refresh = refresh
+        self._balances = {}  # user_id -> balance
+        self._bound = 0
+        self._loaded_at = None
+        self._loading = None  # balances written through while a load runs
+        self._lock = asyncio.Lock()
+
+    # Write-through of a committed balance
+    def set_balance(self, user_id, balance):
+        if self._loading is not None:
+            self._loading[user_id] = balance
+        if self._loaded_at is None:
+            return
+        if balance > self._bound:
+            self._balances[user_id] = balance
+            if len(self._balances) > self.capacity:
+                lowest = min(self._balances, key=self._balances.get)
+                self._bound = max(self._bound, self._balances.pop(lowest))
+        else:
+            # It may have fallen below an account that is not held
+            self._balances.pop(user_id, None)
+
+    async def _load(self):
+        self._loading = {}
+        try:
+            rows = await self.db.get_top_balances(self.capacity)
+        finally:
+            written, self._loading = self._loading, None
+        self._balances = dict(rows)
+        # With fewer rows than asked for every positive balance is held
+        self._bound = rows[-1][1] if len(rows) == self.capacity else 0
+        self._loaded_at = time.monotonic()
+        for user_id, balance in written.items():
+            self.set_balance(user_id, balance)
+
+    def _stale(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh:
+            return True
+        return len(self._balances) < self.size and self._bound > 0
+
+    # [(user_id, balance)] of the limit (at most size) richest accounts
+    async def top(self, limit=None):
+        if self._stale():
+            async with self._lock:
+                if self._stale():
+                    await self._load()
+        ranked = sorted(self._balances.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:min(limit or self.size, self.size)]
+
@@ -0,0 +1,205 @@
+import asyncio
+import random
+from datetime import datetime
+
+
+class LedgerError(Exception):
+    pass
+
+
+class AccountNotFound(LedgerError):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+class RequestNotFound(LedgerError):
+    pass
+
+
+# The account's status does not allow this movement: a locked account can
+# neither send nor receive money, a frozen one can still receive it
+class AccountUnavailable(LedgerError):
+    def __init__(self, user_id, status, reason=None, until=None):
+        super().__init__(user_id)
+        self.user_id = user_id
+        self.status = status
+        self.reason = reason
+        self.until = until
+
+
+# Account statuses. A lock or freeze may have an expiry (an ISO time, like
+# every other date in the bank), after which the account is active again.
+ACTIVE = 'active'
+LOCKED = 'locked'
+FROZEN = 'frozen'
+
+# Ledger entry type recorded when an account changes to a status
+STATUS_ENTRY_TYPES = {ACTIVE: 'unlock', LOCKED: 'lock', FROZEN: 'freeze'}
+
+
+# Status of an account at the ISO time now, treating a lapsed lock or freeze
+# as active even before it has been cleared
+def current_status(status, until, now):
+    if status != ACTIVE and until is not None and until <= now:
+        return ACTIVE
+    return status
+
+
+def can_send(status):
+    return status == ACTIVE
+
+
+def can_receive(status):
+    return status != LOCKED
+
+
+# An operation with this idempotency key has already been applied. result is
+# what the first run returned, where the backend records one (the request ID
+# of a deposit or withdrawal request).
+class DuplicateOperation(LedgerError):
+    def __init__(self, key, result=None):
+        super().__init__(key)
+        self.key = key
+        self.result = result
+
+
+# Ledger engine.
+# Every balance change goes through here and writes an entry to the
+# append-only transactions table (see audit.py), including admin overrides.
+# Each operation is one atomic transaction in the storage backend (see
+# storage.py). Operations that fail on contention (busy database, serialization
+# failure) are retried with jittered exponential backoff. If an AccountCache or
+# a Leaderboard is given, the balances each transaction committed are written
+# through to them.
+# Repeats of keyed operations are answered by the RecentOperations front when
+# one is given (see idempotency.py).
+class Ledger:
+    def __init__(self, db, cache=None, operations=None, leaderboard=None, retries=5, backoff=0.05):
+        self.db = db
+        self.operations = operations
+        self.cache = cache
+        self.leaderboard = leaderboard
+        self.retries = retries
+        self.backoff = backoff
+
+    async def _run(self, operation, *args):
+        delay = self.backoff
+        for attempt in range(self.retries):
+            try:
+                return await operation(*args)
+            except Exception as e:
+                if not self.db.is_retryable(e) or attempt == self.retries - 1:
+                    raise
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            delay *= 2
+
+    # Turn a movement away early if the cached account already shows it
+    # cannot happen. The storage backend checks again in the transaction itself,
+    # so an account that is not cached, or cached stale, is still caught.
+    def _check_status(self, user_id, allowed):
+        record = self.cache.peek(user_id) if self.cache is not None else None
+        if record is None:
+            return
+        status = current_status(record.status, record.status_until, datetime.now().isoformat())
+        if not allowed(status):
+            raise AccountUnavailable(user_id, status, record.status_reason, record.status_until)
+
+    def _write_through(self, balances):
+        for user_id, balance in balances:
+            if self.cache is not None:
+                self.cache.set_balance(user_id, balance)
+            if self.leaderboard is not None:
+                self.leaderboard.set_balance(user_id, balance)
+
+    # Move amount from sender to recipient
+    # With an idempotency_key (e.g. the interaction ID) the transfer happens
+    # exactly once even if it is retried or replayed by another bot process.
+    # Returns False if it had already been applied.
+    async def transfer(self, sender_id, recipient_id, amount, idempotency_key=None):
+        self._check_status(sender_id, can_send)
+        self._check_status(recipient_id, can_receive)
+        try:
+            if self.operations is not None:
+                balances = await self.operations.run(idempotency_key, self._run, self.db.transfer,
+                                                     sender_id, recipient_id, amount, idempotency_key)
+            else:
+                balances = await self._run(self.db.transfer, sender_id, recipient_id, amount, idempotency_key)
+        except DuplicateOperation:
+            return False
+        self._write_through(balances)
+        return True
+
+    # Overwrite a balance (admin commands). The difference is written to the
+    # ledger as an entry of the given type so the books still reconcile.
+    async def set_balance(self, user_id, balance, entry_type):
+        await self._run(self.db.set_balance, user_id, balance, entry_type)
+        self._write_through([(user_id, balance)])
+
+    # Apply a pending deposit or withdrawal request and remove it.
+    # Returns (user_id, type, amount) of the applied request.
+    async def approve_request(self, request_id):
+        request, balance = await self._run(self.db.approve_request, request_id)
+        self._write_through([(request[0], balance)])
+        return request
+
+    # Approve or reject many pending requests in one transaction.
+    # Requests are selected by ID ranges (list of (low, high), inclusive) and/or
+    # filters; all balance changes are applied set-based, one UPDATE per batch.
+    # Withdrawals are taken per user in request order while the balance plus
+    # that user's approved deposits covers them; the rest are skipped.
+    # Returns (applied, skipped): applied is [(request_id, user_id)], skipped is
+    # [(request_id, reason)].
+    async def apply_requests(self, action, ranges=None, request_type=None, max_amount=None, before=None):
+        applied, skipped, balances = await self._run(self.db.apply_requests, action, ranges,
+                                                     request_type, max_amount, before)
+        if action == 'approve':
+            self._write_through(balances)
+        return applied, skipped
+
+    # Pay up to limit standing orders due by now (ISO time) in one
+    # transaction, set-based like apply_requests. Each order moves on one
+    # interval per run, so an order that missed several runs is caught up by
+    # calling this until nothing is left due. Returns (paid, skipped): paid is
+    # [(order_id, sender_id, recipient_id, amount)], skipped is
+    # [(order_id, sender_id, reason)].
+    async def run_standing_orders(self, now, limit):
+        paid, skipped, balances = await self._run(self.db.run_standing_orders, now, limit)
+        self._write_through(balances)
+        return paid, skipped
+
+    # Pay one batch of daily interest for the oldest unpaid day up to today
+    # (YYYY-MM-DD): one set-based UPDATE plus one bulk ledger insert. Days
+    # missed while the bot was down are paid one after another, each on the
+    # balances the day before left. Returns None once no day is due, else
+    # (day, paid) with paid as [(user_id, amount)].
+    async def pay_interest(self, rate, today, limit):
+        result = await self._run(self.db.pay_interest, rate, today, limit)
+        if result is None:
+            return None
+        day, paid, balances = result
+        self._write_through(balances)
+        return day, paid
+
+    # Lock, freeze or unlock many accounts in one transaction. until (ISO
+    # time) makes a lock or freeze lapse by itself. Returns the IDs of the
+    # accounts that exist and were changed.
+    async def set_status(self, user_ids, status, reason=None, until=None):
+        if status == ACTIVE:
+            reason = until = None
+        updated = await self._run(self.db.set_status, user_ids, status, reason, until)
+        if self.cache is not None:
+            for user_id in updated:
+                self.cache.set_status(user_id, status, reason, until)
+        return updated
+
+    # Reactivate the given accounts whose lock or freeze has lapsed by now.
+    # Returns the IDs of those reactivated.
+    async def expire_statuses(self, user_ids):
+        expired = await self._run(self.db.expire_statuses, user_ids, datetime.now().isoformat())
+        if self.cache is not None:
+            for user_id in expired:
+                self.cache.set_status(user_id, ACTIVE, None, None)
+        return expired
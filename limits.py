@@ -0,0 +1,163 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+
+
+# Parse a limit written as "count/seconds", e.g. "5/60" for a burst of 5
+# refilled at 5 per minute. Returns (rate per second, burst), or None for an
+# empty value or "off".
+def parse_limit(value):
+    if not value or value.strip().lower() == 'off':
+        return None
+    count, _, seconds = value.partition('/')
+    count = float(count)
+    return count / float(seconds or 1), count
+
+
+# Parse "command=count/seconds,..." into {command: (rate, burst)}
+def parse_command_limits(value):
+    limits = {}
+    for part in (value or '').split(','):
+        if not part.strip():
+            continue
+        command, _, limit = part.partition('=')
+        limits[command.strip()] = parse_limit(limit)
+    return limits
+
+
+class _Bucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, tokens, updated):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = tokens
+        self.updated = updated
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+# Token-bucket rate limiter for slash commands.
+# Each command invocation takes one token from up to four buckets: the user's
+# bucket for that command, the user's bucket across all commands, the guild's
+# bucket and the global bucket. It is only admitted if every bucket has a token,
+# and then takes one from each. Buckets live in memory in an LRU; a bucket that
+# gets evicted would have refilled anyway unless it was very recently used, so
+# maxsize only needs to cover the users active within one refill period.
+#
+# With a state_path the buckets are saved on close() and loaded on open(), so a
+# restart does not hand every user a fresh burst.
+class RateLimiter:
+    def __init__(self, user=None, commands=None, guild=None, global_limit=None,
+                 maxsize=100000, state_path=None):
+        self.user = user
+        self.commands = commands or {}
+        self.guild = guild
+        self.global_limit = global_limit
+        self.maxsize = maxsize
+        self.state_path = state_path
+        self._buckets = OrderedDict()  # key -> _Bucket
+
+    def _rules(self, user_id, guild_id, command):
+        rules = []
+        if command in self.commands and self.commands[command] is not None:
+            rules.append((('command', user_id, command), self.commands[command]))
+        if self.user is not None:
+            rules.append((('user', user_id), self.user))
+        if self.guild is not None and guild_id is not None:
+            rules.append((('guild', guild_id), self.guild))
+        if self.global_limit is not None:
+            rules.append((('global',), self.global_limit))
+        return rules
+
+    def _bucket(self, key, rate, burst, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(rate, burst, burst, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.rate, bucket.burst = rate, burst
+        return bucket
+
+    # Take a token for one invocation. Returns (None, 0) if it is admitted,
+    # else (scope, retry_after) for the first bucket that is empty, where scope
+    # is 'command', 'user', 'guild' or 'global'.
+    def acquire(self, user_id, guild_id, command):
+        now = time.monotonic()
+        buckets = []
+        for key, (rate, burst) in self._rules(user_id, guild_id, command):
+            bucket = self._bucket(key, rate, burst, now)
+            bucket.refill(now)
+            if bucket.tokens < 1:
+                return key[0], (1 - bucket.tokens) / rate
+            buckets.append(bucket)
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return None, 0.0
+
+    def open(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        with open(self.state_path) as f:
+            state = json.load(f)
+        # Buckets refill for the time the bot was down
+        elapsed = max(0.0, time.time() - state['saved_at'])
+        now = time.monotonic()
+        for key, rate, burst, tokens in state['buckets']:
+            self._buckets[tuple(key)] = _Bucket(rate, burst, tokens, now - elapsed)
+
+    def close(self):
+        if not self.state_path:
+            return
+        now = time.monotonic()
+        buckets = []
+        for key, bucket in self._buckets.items():
+            bucket.refill(now)
+            # Full buckets are the default and need not be saved
+            if bucket.tokens < bucket.burst:
+                buckets.append((list(key), bucket.rate, bucket.burst, bucket.tokens))
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'saved_at': time.time(), 'buckets': buckets}, f)
+        os.replace(tmp, self.state_path)
+
+
+# Bounded concurrency gate for write commands.
+# At most limit write commands run at once; up to max_waiting more wait for a
+# slot, for at most timeout seconds (Discord wants a response within three).
+# Anything beyond that is shed at once instead of piling up behind the single
+# database writer.
+class WriteGate:
+    def __init__(self, limit=32, max_waiting=256, timeout=1.5):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = None
+
+    # Returns True once a slot is held, False if the command should be shed
+    async def enter(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return True
+
+    def leave(self):
+        self.active -= 1
+        self._semaphore.release()
@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from metrics import Histogram
+
+# Offline load test of the slash command handlers.
+# bank.py is imported against a temporary bank.db, the command modules in cogs/
+# are loaded and their callbacks are called directly with fake interactions, so
+# no gateway or token is needed. Discord's REST API (interaction responses,
+# fetch_user, DMs) is replaced by stubs that just wait rest_latency. Every
+# virtual user registers, then runs its share of a weighted mix of commands
+# back to back. Reports throughput, per-command latency percentiles, storage
+# latency and database growth, and writes them as JSON so runs of different
+# versions can be compared:
+#   python loadtest.py --users 100 --operations 50 --mix deposit=3,transfer=5,approve=1,transactions=2 --output results.json
+
+DEFAULT_MIX = 'register=1,deposit=3,transfer=5,approve=1,transactions=2'
+COMMANDS = ('register', 'deposit', 'withdraw', 'transfer', 'approve', 'transactions', 'dashboard')
+ADMIN_ID = 1
+
+
+class FakePermissions:
+    def __init__(self, administrator):
+        self.administrator = administrator
+
+
+class FakeUser:
+    def __init__(self, user_id, rest_latency, administrator=False):
+        self.id = user_id
+        self.name = f"loadtest-{user_id}"
+        self.guild_permissions = FakePermissions(administrator)
+        self.rest_latency = rest_latency
+        self.dms = 0
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, *args, **kwargs):
+        await asyncio.sleep(self.rest_latency)
+        self.dms += 1
+
+
+class FakeResponse:
+    def __init__(self, rest_latency):
+        self.rest_latency = rest_latency
+        self.embeds = []
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, *args, embed=None, **kwargs):
+        await asyncio.sleep(self.rest_latency)
+        self._done = True
+        self.embeds.append(embed)
+
+    async def edit_message(self, *args, embed=None, **kwargs):
+        await asyncio.sleep(self.rest_latency)
+        self._done = True
+        self.embeds.append(embed)
+
+    async def defer(self, *args, **kwargs):
+        await asyncio.sleep(self.rest_latency)
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, response):
+        self.response = response
+
+    async def send(self, *args, embed=None, **kwargs):
+        await asyncio.sleep(self.response.rest_latency)
+        self.response.embeds.append(embed)
+
+
+class FakeInteraction:
+    _ids = itertools.count(1 << 40)
+
+    def __init__(self, user, rest_latency):
+        self.id = next(self._ids)
+        self.user = user
+        self.response = FakeResponse(rest_latency)
+        self.followup = FakeFollowup(self.response)
+        self.extras = {}
+        self.command = None
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in COMMANDS:
+            raise argparse.ArgumentTypeError(f"unknown command {name!r}, expected one of {', '.join(COMMANDS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# Size of the database file once the WAL has been folded back into it
+def database_size(path):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    return os.path.getsize(path)
+
+
+def summarize(histogram):
+    return {
+        'count': histogram.count,
+        'mean_ms': histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+        'p50_ms': histogram.quantile(0.5) * 1000,
+        'p95_ms': histogram.quantile(0.95) * 1000,
+        'p99_ms': histogram.quantile(0.99) * 1000,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class LoadTest:
+    def __init__(self, bank, args):
+        self.bank = bank
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.rest_latency = args.rest_latency_ms / 1000
+        self.admin = FakeUser(ADMIN_ID, self.rest_latency, administrator=True)
+        self.users = {}
+        self.user_ids = []
+        self.latency = {name: Histogram() for name in COMMANDS}
+        self.outcomes = {name: Counter() for name in COMMANDS}
+        self.errors = Counter()
+        self.approved = 0
+
+    def new_user(self):
+        user = FakeUser(ADMIN_ID + 1 + len(self.users), self.rest_latency)
+        self.users[user.id] = user
+        return user
+
+    async def call(self, name, user, *args):
+        interaction = FakeInteraction(user, self.rest_latency)
+        command = self.bank.bot.tree.get_command(name)
+        start = time.perf_counter()
+        try:
+            await command.callback(interaction, *args)
+        except Exception as e:
+            self.errors[f"{name}: {type(e).__name__}"] += 1
+            return
+        finally:
+            self.latency[name].observe(time.perf_counter() - start)
+        for embed in interaction.response.embeds:
+            self.outcomes[name][embed.title if embed is not None else 'none'] += 1
+
+    def amount(self, low, high):
+        return round(self.rng.uniform(low, high), 2)
+
+    async def step(self, user, name):
+        if name == 'register':
+            new = self.new_user()
+            await self.call('register', new)
+            self.user_ids.append(new.id)
+        elif name in ('deposit', 'withdraw'):
+            await self.call(name, user, self.amount(1, 100))
+        elif name == 'transfer':
+            await self.call('transfer', user, self.rng.choice(self.user_ids), self.amount(1, 20))
+        elif name == 'approve':
+            # Request IDs are sequential in a fresh database; once every
+            # submitted request is approved this exercises the not-found path
+            self.approved += 1
+            await self.call('approve', self.admin, self.approved)
+        elif name == 'transactions':
+            await self.call('transactions', user)
+        elif name == 'dashboard':
+            await self.call('dashboard', user)
+
+    async def run_user(self, user):
+        names = list(self.args.mix)
+        weights = [self.args.mix[name] for name in names]
+        for name in self.rng.choices(names, weights, k=self.args.operations):
+            await self.step(user, name)
+            if self.args.think_ms:
+                await asyncio.sleep(self.rng.expovariate(1000 / self.args.think_ms))
+
+    async def run(self):
+        bank = self.bank
+        # Mock REST layer for the DM notifier
+        bank.bot.get_user = lambda user_id: None
+
+        async def fetch_user(user_id):
+            await asyncio.sleep(self.rest_latency)
+            return self.users.get(user_id) or FakeUser(user_id, self.rest_latency)
+        bank.bot.fetch_user = fetch_user
+
+        await bank.load_commands()
+        await bank.start_services()
+        try:
+            virtual_users = [self.new_user() for _ in range(self.args.users)]
+            for user in virtual_users:
+                await self.call('register', user)
+                await bank.ledger.set_balance(user.id, self.args.initial_balance * 100, 'adjustment')
+                self.user_ids.append(user.id)
+            # Only the workload itself is measured
+            self.latency = {name: Histogram() for name in COMMANDS}
+            self.outcomes = {name: Counter() for name in COMMANDS}
+
+            size_before = database_size(self.args.db)
+            start = time.perf_counter()
+            await asyncio.gather(*(self.run_user(user) for user in virtual_users))
+            elapsed = time.perf_counter() - start
+            # Let the notifier flush coalesced DMs before counting them
+            await asyncio.sleep(bank.notifier.coalesce_window + 1 + self.rest_latency * 2)
+            size_after = database_size(self.args.db)
+        finally:
+            await bank.stop_services()
+
+        operations = sum(histogram.count for histogram in self.latency.values())
+        return {
+            'commit': git_commit(),
+            'label': self.args.label,
+            'config': {
+                'users': self.args.users,
+                'operations_per_user': self.args.operations,
+                'mix': self.args.mix,
+                'rest_latency_ms': self.args.rest_latency_ms,
+                'think_ms': self.args.think_ms,
+                'initial_balance': self.args.initial_balance,
+                'seed': self.args.seed,
+            },
+            'duration_seconds': elapsed,
+            'operations': operations,
+            'throughput_per_second': operations / elapsed if elapsed else 0.0,
+            'errors': dict(self.errors),
+            'commands': {
+                name: dict(summarize(histogram), outcomes=dict(self.outcomes[name]))
+                for name, histogram in self.latency.items() if histogram.count
+            },
+            'storage': {labels['operation']: summarize(histogram)
+                        for labels, histogram in bank.metrics.series('storage_seconds')},
+            'event_loop_lag': summarize(bank.metrics.histogram('event_loop_lag_seconds')),
+            'dms_sent': sum(user.dms for user in self.users.values()),
+            'database': {
+                'size_before_bytes': size_before,
+                'size_after_bytes': size_after,
+                'growth_bytes': size_after - size_before,
+                'growth_per_operation_bytes': (size_after - size_before) / operations if operations else 0.0,
+            },
+        }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Offline load test of the bank bot's slash commands.")
+    parser.add_argument('--users', type=int, default=50, help="concurrent virtual users")
+    parser.add_argument('--operations', type=int, default=20, help="commands per virtual user")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"weighted command mix (default {DEFAULT_MIX})")
+    parser.add_argument('--rest-latency-ms', type=float, default=50.0, help="simulated Discord REST latency")
+    parser.add_argument('--think-ms', type=float, default=0.0, help="mean pause between a user's commands")
+    parser.add_argument('--initial-balance', type=int, default=1000, help="starting balance of every virtual user")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help="database path (default: a temporary file)")
+    parser.add_argument('--label', help="free-form label stored in the results")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.db is None:
+            args.db = os.path.join(tmp, 'bank.db')
+        # bank.py builds its storage and metrics at import time
+        os.environ['BANK_STORAGE'] = 'sqlite'
+        os.environ['BANK_DB_PATH'] = args.db
+        os.environ.pop('METRICS_PORT', None)
+        import bank
+        results = asyncio.run(LoadTest(bank, args).run())
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+    return 1 if results['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,226 @@
+import asyncio
+import inspect
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Bucket upper bounds in seconds: 100us to ~2 minutes, each sqrt(2) wider than
+# the last, so quantiles estimated from them are within ~20%
+BUCKETS = tuple(0.0001 * 2 ** (i / 2) for i in range(41))
+
+
+# Latency histogram with fixed buckets. Recording a value is a bisect and two
+# additions, cheap enough to leave on for every command and query.
+class Histogram:
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # Estimate the q-quantile (0 < q < 1) by interpolating inside its bucket,
+    # the same way Prometheus' histogram_quantile() does
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if i == len(BUCKETS):
+                    return BUCKETS[-1]
+                low = BUCKETS[i - 1] if i else 0.0
+                return low + (BUCKETS[i] - low) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+# Registry of labelled histograms, counters and gauges, rendered in the Prometheus text
+# exposition format. Everything runs on the event loop, so there is no locking.
+class Metrics:
+    def __init__(self):
+        self._help = {}
+        self._histograms = {}  # name -> {labels: Histogram}
+        self._counters = {}  # name -> {labels: int}
+        self._gauges = {}  # name -> callable returning a number
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def histogram(self, name, **labels):
+        series = self._histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        return histogram
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        series = self._counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + amount
+
+    # {labels: value} of one counter, as tuples of label pairs
+    def counter(self, name):
+        return dict(self._counters.get(name, {}))
+
+    # Time the body of a with block into a histogram
+    @contextmanager
+    def time(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    # A gauge is read when the metrics are rendered
+    def gauge(self, name, help_text, read):
+        self._help[name] = help_text
+        self._gauges[name] = read
+
+    # [(labels, Histogram)] of one histogram, as label dicts
+    def series(self, name):
+        return [(dict(key), histogram) for key, histogram in self._histograms.get(name, {}).items()]
+
+    def render(self):
+        lines = []
+        for name, series in self._histograms.items():
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in series.items():
+                labels = ''.join(f'{label}="{_escape(value)}",' for label, value in key)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels}le="{bound:.6g}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {histogram.count}')
+                labels = '{' + labels.rstrip(',') + '}' if labels else ''
+                lines.append(f"{name}_sum{labels} {histogram.sum}")
+                lines.append(f"{name}_count{labels} {histogram.count}")
+        for name, series in self._counters.items():
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, count in series.items():
+                labels = ','.join(f'{label}="{_escape(value)}"' for label, value in key)
+                lines.append(f"{name}{{{labels}}} {count}" if labels else f"{name} {count}")
+        for name, read in self._gauges.items():
+            lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {read()}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Proxy that times every coroutine method of a Storage backend into
+# storage_seconds{operation=...}. Each storage method is a single statement or
+# a single transaction, so this is per-query latency, including the wait for a
+# database thread or pool connection.
+class InstrumentedStorage:
+    def __init__(self, storage, metrics):
+        self._storage = storage
+        self._metrics = metrics
+        metrics.describe('storage_seconds', "Storage backend call latency by operation")
+
+    def __getattr__(self, name):
+        attr = getattr(self._storage, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        histogram = self._metrics.histogram('storage_seconds', operation=name)
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await attr(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, timed)
+        return timed
+
+
+# Samples how late the event loop wakes a sleeping task. Anything blocking the
+# loop (a slow callback, synchronous I/O) shows up here as lag.
+class LoopLagMonitor:
+    def __init__(self, metrics, interval=0.5):
+        self.metrics = metrics
+        self.interval = interval
+        self._task = None
+        metrics.describe('event_loop_lag_seconds', "Delay between a timer's deadline and its callback running")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        histogram = self.metrics.histogram('event_loop_lag_seconds')
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            histogram.observe(max(0.0, loop.time() - start - self.interval))
+
+
+# Minimal HTTP server answering GET /metrics in the Prometheus text format.
+# Bind it to localhost (the default) and let the scraper run on the same host.
+class MetricsServer:
+    def __init__(self, metrics, host='127.0.0.1', port=9100):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b'GET' and parts[1].split(b'?')[0] == b'/metrics':
+                body = self.metrics.render().encode()
+                status = b'200 OK'
+            else:
+                body = b'Not Found\n'
+                status = b'404 Not Found'
+            writer.write(b'HTTP/1.1 ' + status + b'\r\n'
+                         b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                         b'Connection: close\r\n\r\n' + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,384 @@
+# Versioned schema migrations for bank.db.
+# The schema version lives in PRAGMA user_version. Each migration is a list of
+# SQL statements or a callable taking a cursor, and runs in its own transaction
+# together with the version bump, so a database is never left half-upgraded.
+# Append new migrations to the end of the list; never edit one that has shipped.
+
+from datetime import datetime
+
+# 3: money as INTEGER cents instead of REAL. SQLite cannot change a column's
+# type, and a REAL column would store integers back as floats, so each table is
+# rebuilt with INTEGER columns and its amounts rounded to the nearest cent.
+def _integer_cents(c):
+    c.execute('''CREATE TABLE accounts_new (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    balance INTEGER,
+                    created_at TEXT
+                )''')
+    c.execute('''INSERT INTO accounts_new (user_id, username, balance, created_at)
+                 SELECT user_id, username, CAST(ROUND(balance * 100) AS INTEGER), created_at FROM accounts''')
+    c.execute("DROP TABLE accounts")
+    c.execute("ALTER TABLE accounts_new RENAME TO accounts")
+
+    c.execute('''CREATE TABLE transactions_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    type TEXT,
+                    amount INTEGER,
+                    date TEXT
+                )''')
+    c.execute('''INSERT INTO transactions_new (id, user_id, type, amount, date)
+                 SELECT id, user_id, type, CAST(ROUND(amount * 100) AS INTEGER), date FROM transactions''')
+    c.execute("DROP TABLE transactions")
+    c.execute("ALTER TABLE transactions_new RENAME TO transactions")
+    c.execute("CREATE INDEX idx_transactions_user_date ON transactions (user_id, date)")
+
+    c.execute('''CREATE TABLE pending_requests_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    type TEXT,
+                    amount INTEGER,
+                    status TEXT,
+                    date TEXT
+                )''')
+    c.execute('''INSERT INTO pending_requests_new (id, user_id, type, amount, status, date)
+                 SELECT id, user_id, type, CAST(ROUND(amount * 100) AS INTEGER), status, date FROM pending_requests''')
+    c.execute("DROP TABLE pending_requests")
+    c.execute("ALTER TABLE pending_requests_new RENAME TO pending_requests")
+    c.execute("CREATE INDEX idx_pending_requests_status ON pending_requests (status)")
+
+
+# Tables whose row changes are recorded in change_log: those migration 8
+# started logging, then those added since by the migration that creates them
+_CHANGE_LOGGED_TABLES_8 = ['accounts', 'transactions', 'pending_requests', 'balance_checkpoints',
+                           'ledger_operations', 'transaction_rollups']
+CHANGE_LOGGED_TABLES = _CHANGE_LOGGED_TABLES_8 + ['standing_orders', 'scheduled_jobs']
+
+
+# (Re)create the change_log triggers of a table from its current columns. A
+# migration that rebuilds or alters one of CHANGE_LOGGED_TABLES must call this
+# again for it, since dropping a table drops its triggers.
+def change_log_triggers(c, table):
+    columns = [column[1] for column in c.execute(f"PRAGMA table_info({table})").fetchall()]
+    for op, row in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD')):
+        data = ', '.join(f"'{column}', {row}.{column}" for column in columns)
+        c.execute(f"DROP TRIGGER IF EXISTS change_log_{table}_{op}")
+        c.execute(f'''CREATE TRIGGER change_log_{table}_{op} AFTER {op.upper()} ON {table}
+                      WHEN (SELECT enabled FROM change_log_config)
+                      BEGIN
+                          INSERT INTO change_log (at, tbl, op, data)
+                          VALUES (strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime'), '{table}', '{op}', json_object({data}));
+                      END''')
+
+
+# Ends the current transaction's run of change_log rows with a 'commit' marker,
+# so a restore can replay whole transactions only. Database runs it at the end
+# of every write; it does nothing while logging is off or when the transaction
+# logged nothing (the last row is already a marker, or the log is empty).
+CHANGE_LOG_COMMIT = '''INSERT INTO change_log (at, tbl, op, data)
+                       SELECT strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime'), NULL, 'commit', NULL
+                       WHERE (SELECT enabled FROM change_log_config)
+                         AND 'commit' != (SELECT op FROM change_log ORDER BY id DESC LIMIT 1)'''
+
+
+# 8: change log for point-in-time restore (see backup.py). Off until the backup
+# service turns it on.
+def _change_log(c):
+    c.execute('''CREATE TABLE change_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    at TEXT,
+                    tbl TEXT,
+                    op TEXT,
+                    data TEXT
+                )''')
+    c.execute("CREATE TABLE change_log_config (enabled INTEGER)")
+    c.execute("INSERT INTO change_log_config (enabled) VALUES (0)")
+    for table in _CHANGE_LOGGED_TABLES_8:
+        change_log_triggers(c, table)
+
+
+# 10: account status instead of balance=-1 locks. Older versions locked an
+# account by overwriting its balance with -1: at first -1.0 with no ledger
+# entry, which migration 3 turned into -100 cents, later -1 cent with a 'lock'
+# entry of -1 minus the old balance. Ledgered movements never took a balance
+# below zero, so a balance of -1 or -100 was written by a lock or by an admin.
+# The account's last non-zero ledger entry tells which: an 'adjustment' is an
+# admin's and the account stays active; a 'lock' is given back by a 'lock
+# reversal' entry; anything else means the balance was overwritten without an
+# entry, which only locks from before the ledger did, and it is set to 0.
+# Entries already moved to archive databases are not looked at.
+def _account_status(c):
+    c.execute("ALTER TABLE accounts ADD COLUMN status TEXT NOT NULL DEFAULT 'active'")
+    c.execute("ALTER TABLE accounts ADD COLUMN status_reason TEXT")
+    c.execute("ALTER TABLE accounts ADD COLUMN status_until TEXT")
+    c.execute('''CREATE INDEX idx_accounts_status_until ON accounts (status_until)
+                 WHERE status_until IS NOT NULL''')
+    locked = c.execute('''SELECT a.user_id, a.balance, t.type, t.amount
+                          FROM accounts a LEFT JOIN transactions t
+                               ON t.id = (SELECT MAX(id) FROM transactions WHERE user_id = a.user_id AND amount != 0)
+                          WHERE t.type IS NOT 'adjustment' AND a.balance IN (-1, -100)''').fetchall()
+    now = datetime.now().isoformat()
+    for user_id, balance, entry_type, entry_amount in locked:
+        reversal = entry_amount if entry_type == 'lock' else balance
+        c.execute('''UPDATE accounts SET status = 'locked', status_reason = 'locked by an earlier version',
+                                         balance = balance - ?
+                     WHERE user_id = ?''', (reversal, user_id))
+        c.execute("INSERT INTO transactions (user_id, type, amount, date) VALUES (?, 'lock reversal', ?, ?)",
+                  (user_id, -reversal, now))
+    change_log_triggers(c, 'accounts')
+
+
+
+# 11: standing orders and the state of scheduled jobs (see the scheduler in
+# Database). next_run is the due-time index the scheduler reads.
+def _scheduled_jobs(c):
+    c.execute('''CREATE TABLE standing_orders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sender_id INTEGER,
+                    recipient_id INTEGER,
+                    amount INTEGER,
+                    interval_days INTEGER,
+                    next_run TEXT,
+                    last_status TEXT,
+                    created_at TEXT
+                )''')
+    c.execute("CREATE INDEX idx_standing_orders_next_run ON standing_orders (next_run)")
+    c.execute("CREATE INDEX idx_standing_orders_sender ON standing_orders (sender_id)")
+    c.execute('''CREATE TABLE scheduled_jobs (
+                    name TEXT PRIMARY KEY,
+                    next_run TEXT,
+                    cursor INTEGER DEFAULT 0
+                )''')
+    c.execute("INSERT INTO scheduled_jobs (name, next_run) VALUES ('interest', NULL)")
+    for table in ('standing_orders', 'scheduled_jobs'):
+        change_log_triggers(c, table)
+
+
+MIGRATIONS = [
+    # 1: original tables. IF NOT EXISTS lets bank.db files created by older
+    # versions of the bot (which have no user_version) upgrade in place.
+    [
+        '''CREATE TABLE IF NOT EXISTS accounts (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                balance REAL,
+                created_at TEXT
+            )''',
+        '''CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                type TEXT,
+                amount REAL,
+                date TEXT
+            )''',
+        '''CREATE TABLE IF NOT EXISTS pending_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                type TEXT,
+                amount REAL,
+                status TEXT,
+                date TEXT
+            )''',
+    ],
+    # 2: indexes for /transactions and /view_requests
+    [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (user_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_pending_requests_status ON pending_requests (status)",
+    ],
+    # 3: money as INTEGER cents
+    _integer_cents,
+    # 4: balance checkpoints for incremental reconciliation (see audit.py).
+    # Every account starts from a checkpoint of its balance at upgrade time,
+    # since older versions changed balances without writing ledger entries.
+    [
+        '''CREATE TABLE balance_checkpoints (
+                user_id INTEGER PRIMARY KEY,
+                transaction_id INTEGER,
+                balance INTEGER,
+                created_at TEXT
+            )''',
+        "CREATE INDEX idx_transactions_user_id ON transactions (user_id, id)",
+        '''INSERT INTO balance_checkpoints (user_id, transaction_id, balance, created_at)
+           SELECT user_id, (SELECT COALESCE(MAX(id), 0) FROM transactions), balance, datetime('now')
+           FROM accounts''',
+    ],
+    # 5: idempotency keys of applied ledger operations, so an operation that is
+    # retried, or replayed by another bot process, is applied exactly once
+    [
+        '''CREATE TABLE ledger_operations (
+                key TEXT PRIMARY KEY,
+                created_at TEXT
+            )''',
+    ],
+    # 6: idempotency keys keep the result of their operation (the request ID of
+    # a deposit or withdrawal) and expire by age. WITHOUT ROWID stores each key
+    # once, in the primary key b-tree, instead of in a table plus an index.
+    [
+        '''CREATE TABLE ledger_operations_new (
+                key TEXT PRIMARY KEY,
+                result INTEGER,
+                created_at TEXT
+            ) WITHOUT ROWID''',
+        '''INSERT INTO ledger_operations_new (key, created_at)
+           SELECT key, created_at FROM ledger_operations''',
+        "DROP TABLE ledger_operations",
+        "ALTER TABLE ledger_operations_new RENAME TO ledger_operations",
+        "CREATE INDEX idx_ledger_operations_created_at ON ledger_operations (created_at)",
+    ],
+    # 7: per-user rollups of the transactions moved to archive databases (see
+    # archive.py)
+    [
+        '''CREATE TABLE transaction_rollups (
+                user_id INTEGER PRIMARY KEY,
+                archived_count INTEGER,
+                archived_amount INTEGER,
+                first_date TEXT,
+                last_date TEXT,
+                last_id INTEGER
+            )''',
+    ],
+    # 8: change log for point-in-time restore
+    _change_log,
+    # 9: aggregates for /leaderboard, /bank_stats and /monthly_summary, kept
+    # up to date by triggers in the same transaction as each ledger entry.
+    # Bank-wide rows are split into 16 slots by user ID so concurrent writers
+    # (PostgreSQL) rarely update the same row; readers add the slots up.
+    # Existing history is counted from the entries still in bank.db.
+    [
+        "CREATE INDEX idx_accounts_balance ON accounts (balance)",
+        '''CREATE TABLE bank_totals (
+                slot INTEGER PRIMARY KEY,
+                accounts INTEGER DEFAULT 0,
+                money_supply INTEGER DEFAULT 0,
+                deposits INTEGER DEFAULT 0,
+                withdrawals INTEGER DEFAULT 0,
+                transfers INTEGER DEFAULT 0
+            )''',
+        '''CREATE TABLE daily_totals (
+                day TEXT,
+                slot INTEGER,
+                deposits INTEGER DEFAULT 0,
+                withdrawals INTEGER DEFAULT 0,
+                transfers INTEGER DEFAULT 0,
+                entries INTEGER DEFAULT 0,
+                PRIMARY KEY (day, slot)
+            ) WITHOUT ROWID''',
+        '''CREATE TABLE monthly_summaries (
+                user_id INTEGER,
+                month TEXT,
+                deposits INTEGER DEFAULT 0,
+                withdrawals INTEGER DEFAULT 0,
+                transfers_in INTEGER DEFAULT 0,
+                transfers_out INTEGER DEFAULT 0,
+                adjustments INTEGER DEFAULT 0,
+                entries INTEGER DEFAULT 0,
+                PRIMARY KEY (user_id, month)
+            ) WITHOUT ROWID''',
+        '''INSERT INTO bank_totals (slot, accounts, money_supply)
+           SELECT user_id % 16, COUNT(*), SUM(balance) FROM accounts GROUP BY user_id % 16''',
+        '''INSERT INTO bank_totals (slot, deposits, withdrawals, transfers)
+           SELECT user_id % 16,
+                  SUM(CASE WHEN type='deposit' THEN amount ELSE 0 END),
+                  SUM(CASE WHEN type='withdrawal' THEN -amount ELSE 0 END),
+                  SUM(CASE WHEN type='transfer in' THEN amount ELSE 0 END)
+           FROM transactions WHERE true GROUP BY user_id % 16
+           ON CONFLICT (slot) DO UPDATE SET deposits = excluded.deposits,
+                                            withdrawals = excluded.withdrawals,
+                                            transfers = excluded.transfers''',
+        '''INSERT INTO daily_totals (day, slot, deposits, withdrawals, transfers, entries)
+           SELECT substr(date, 1, 10), user_id % 16,
+                  SUM(CASE WHEN type='deposit' THEN amount ELSE 0 END),
+                  SUM(CASE WHEN type='withdrawal' THEN -amount ELSE 0 END),
+                  SUM(CASE WHEN type='transfer in' THEN amount ELSE 0 END),
+                  COUNT(*)
+           FROM transactions GROUP BY substr(date, 1, 10), user_id % 16''',
+        '''INSERT INTO monthly_summaries (user_id, month, deposits, withdrawals, transfers_in, transfers_out, adjustments, entries)
+           SELECT user_id, substr(date, 1, 7),
+                  SUM(CASE WHEN type='deposit' THEN amount ELSE 0 END),
+                  SUM(CASE WHEN type='withdrawal' THEN -amount ELSE 0 END),
+                  SUM(CASE WHEN type='transfer in' THEN amount ELSE 0 END),
+                  SUM(CASE WHEN type='transfer out' THEN -amount ELSE 0 END),
+                  SUM(CASE WHEN type NOT IN ('deposit', 'withdrawal', 'transfer in', 'transfer out') THEN amount ELSE 0 END),
+                  COUNT(*)
+           FROM transactions GROUP BY user_id, substr(date, 1, 7)''',
+        '''CREATE TRIGGER aggregate_accounts AFTER INSERT ON accounts
+           BEGIN
+               INSERT INTO bank_totals (slot, accounts, money_supply) VALUES (NEW.user_id % 16, 1, NEW.balance)
+               ON CONFLICT (slot) DO UPDATE SET accounts = accounts + 1,
+                                                money_supply = money_supply + excluded.money_supply;
+           END''',
+        '''CREATE TRIGGER aggregate_transactions AFTER INSERT ON transactions
+           BEGIN
+               INSERT INTO bank_totals (slot, money_supply, deposits, withdrawals, transfers)
+               VALUES (NEW.user_id % 16, NEW.amount,
+                       CASE WHEN NEW.type='deposit' THEN NEW.amount ELSE 0 END,
+                       CASE WHEN NEW.type='withdrawal' THEN -NEW.amount ELSE 0 END,
+                       CASE WHEN NEW.type='transfer in' THEN NEW.amount ELSE 0 END)
+               ON CONFLICT (slot) DO UPDATE SET money_supply = money_supply + excluded.money_supply,
+                                                deposits = deposits + excluded.deposits,
+                                                withdrawals = withdrawals + excluded.withdrawals,
+                                                transfers = transfers + excluded.transfers;
+               INSERT INTO daily_totals (day, slot, deposits, withdrawals, transfers, entries)
+               VALUES (substr(NEW.date, 1, 10), NEW.user_id % 16,
+                       CASE WHEN NEW.type='deposit' THEN NEW.amount ELSE 0 END,
+                       CASE WHEN NEW.type='withdrawal' THEN -NEW.amount ELSE 0 END,
+                       CASE WHEN NEW.type='transfer in' THEN NEW.amount ELSE 0 END,
+                       1)
+               ON CONFLICT (day, slot) DO UPDATE SET deposits = deposits + excluded.deposits,
+                                                     withdrawals = withdrawals + excluded.withdrawals,
+                                                     transfers = transfers + excluded.transfers,
+                                                     entries = entries + 1;
+               INSERT INTO monthly_summaries (user_id, month, deposits, withdrawals, transfers_in, transfers_out, adjustments, entries)
+               VALUES (NEW.user_id, substr(NEW.date, 1, 7),
+                       CASE WHEN NEW.type='deposit' THEN NEW.amount ELSE 0 END,
+                       CASE WHEN NEW.type='withdrawal' THEN -NEW.amount ELSE 0 END,
+                       CASE WHEN NEW.type='transfer in' THEN NEW.amount ELSE 0 END,
+                       CASE WHEN NEW.type='transfer out' THEN -NEW.amount ELSE 0 END,
+                       CASE WHEN NEW.type NOT IN ('deposit', 'withdrawal', 'transfer in', 'transfer out') THEN NEW.amount ELSE 0 END,
+                       1)
+               ON CONFLICT (user_id, month) DO UPDATE SET deposits = deposits + excluded.deposits,
+                                                          withdrawals = withdrawals + excluded.withdrawals,
+                                                          transfers_in = transfers_in + excluded.transfers_in,
+                                                          transfers_out = transfers_out + excluded.transfers_out,
+                                                          adjustments = adjustments + excluded.adjustments,
+                                                          entries = entries + 1;
+           END''',
+    ],
+    # 10: account status (active, locked, frozen) with a reason and expiry
+    _account_status,
+    # 11: standing orders and scheduled jobs
+    _scheduled_jobs,
+    # 12: index for archive.select_chunk, so the archive job finds old entries
+    # without scanning the table (and finds nothing at once when none are due).
+    # SQLite only: PostgreSQL does not archive.
+    [
+        "CREATE INDEX idx_transactions_date ON transactions (date)",
+    ],
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Bring the database up to the latest version. Returns the version it started at.
+def migrate(conn):
+    start = schema_version(conn)
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= start:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            c = conn.cursor()
+            if callable(migration):
+                migration(c)
+            else:
+                for statement in migration:
+                    c.execute(statement)
+            c.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return start
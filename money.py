@@ -0,0 +1,54 @@
+from decimal import Decimal, InvalidOperation
+
+# Money is stored and computed as integer cents everywhere; it is only turned
+# into a decimal string at the edges (command input and embed output).
+CENTS_PER_UNIT = 100
+
+# Largest amount (in cents) a command accepts: 10,000,000,000.00. Balances and
+# sums over them are 64-bit integers in both backends, and 2**63 is over nine
+# million times this, so no balance or aggregate can be pushed out of range by
+# a few oversized amounts, and binding an amount can never overflow.
+MAX_AMOUNT = 10 ** 12
+
+# Interest rates are whole numbers of millionths of the balance, so interest
+# on integer cents is worked out exactly, the same way by every backend
+RATE_SCALE = 10 ** 6
+
+
+# Parse a user-supplied amount (a command option, str or float) into cents.
+# Returns None if it is not a finite number with at most two decimal places,
+# or if its size is above MAX_AMOUNT.
+def parse_amount(value):
+    try:
+        # str() first so a float option like 0.1 is read as typed, not as its binary expansion
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    if not amount.is_finite():
+        return None
+    cents = amount * CENTS_PER_UNIT
+    if cents != cents.to_integral_value() or abs(cents) > MAX_AMOUNT:
+        return None
+    return int(cents)
+
+
+# Parse a rate given as a fraction (e.g. "0.0001") into millionths. Returns
+# None if it is negative or has more than six decimal places.
+def parse_rate(value):
+    try:
+        rate = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    if not rate.is_finite() or rate < 0:
+        return None
+    scaled = rate * RATE_SCALE
+    if scaled != scaled.to_integral_value():
+        return None
+    return int(scaled)
+
+
+# Format cents as a plain decimal string, e.g. 123456 -> "1234.56"
+def format_amount(cents):
+    sign = '-' if cents < 0 else ''
+    units, rest = divmod(abs(cents), CENTS_PER_UNIT)
+    return f"{sign}{units}.{rest:02d}"
@@ -0,0 +1,152 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+import discord
+
+
+# Token bucket shared by the DM workers, kept below Discord's global limit so
+# the REST client never has to back off on 429s
+class _TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Background DM dispatcher.
+# notify() only queues a notice and returns, so command handlers are done once
+# their DB work is. Notices for the same user that arrive within
+# coalesce_window seconds are sent as one embed by a pool of worker tasks.
+# Users are resolved from the gateway cache (bot.get_user), then a TTL cache,
+# and only then with a fetch_user REST call. With metrics, the time spent
+# resolving users and sending DMs is recorded in dm_seconds{stage=...}.
+class Notifier:
+    def __init__(self, bot, workers=4, coalesce_window=2.0, rate=20.0, burst=20,
+                 user_ttl=3600.0, user_cache_size=10000, metrics=None):
+        self.bot = bot
+        self.metrics = metrics
+        self.workers = workers
+        self.coalesce_window = coalesce_window
+        self.user_ttl = user_ttl
+        self.user_cache_size = user_cache_size
+        self._bucket = _TokenBucket(rate, burst)
+        self._users = OrderedDict()  # user_id -> (user, expires_at)
+        self._pending = {}  # user_id -> [(title, description, color)]
+        self._timers = {}  # user_id -> handle that queues its notices when the window ends
+        self._queue = None
+        self._tasks = []
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._tasks = [task for task in self._tasks if not task.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._worker()))
+
+    def _remember(self, user):
+        self._users[user.id] = (user, time.monotonic() + self.user_ttl)
+        self._users.move_to_end(user.id)
+        if len(self._users) > self.user_cache_size:
+            self._users.popitem(last=False)
+
+    async def _resolve(self, user_id):
+        user = self.bot.get_user(user_id)
+        if user is not None:
+            return user
+        cached = self._users.get(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        await self._bucket.acquire()
+        start = time.perf_counter()
+        user = await self.bot.fetch_user(user_id)
+        if self.metrics is not None:
+            self.metrics.observe('dm_seconds', time.perf_counter() - start, stage='fetch_user')
+        self._remember(user)
+        return user
+
+    # Queue a DM. user may be a discord.User or a user ID.
+    def notify(self, user, title, description, color):
+        self._ensure_started()
+        if isinstance(user, int):
+            user_id = user
+        else:
+            user_id = user.id
+            self._remember(user)
+        notices = self._pending.get(user_id)
+        if notices is None:
+            self._pending[user_id] = [(title, description, color)]
+            self._timers[user_id] = asyncio.get_running_loop().call_later(self.coalesce_window, self._queue_now, user_id)
+        else:
+            notices.append((title, description, color))
+
+    def _queue_now(self, user_id):
+        self._timers.pop(user_id, None)
+        self._queue.put_nowait(user_id)
+
+    def _embed(self, notices):
+        if len(notices) == 1:
+            title, description, color = notices[0]
+            return discord.Embed(title=title, description=description, color=color)
+        embed = discord.Embed(title="Notifications", color=notices[-1][2])
+        for title, description, _ in notices[:25]:
+            embed.add_field(name=title, value=description, inline=False)
+        if len(notices) > 25:
+            embed.set_footer(text=f"and {len(notices) - 25} more")
+        return embed
+
+    async def _worker(self):
+        while True:
+            user_id = await self._queue.get()
+            try:
+                await self._send(user_id)
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, user_id):
+        notices = self._pending.pop(user_id, None)
+        if not notices:
+            return
+        try:
+            user = await self._resolve(user_id)
+            await self._bucket.acquire()
+            start = time.perf_counter()
+            await user.send(embed=self._embed(notices))
+            if self.metrics is not None:
+                self.metrics.observe('dm_seconds', time.perf_counter() - start, stage='send')
+        except discord.Forbidden:
+            print(f"Could not send DM to {user_id}. They may have DMs disabled.")
+        except discord.HTTPException as e:
+            print(f"Could not send DM to {user_id}: {e}")
+
+    # Send every queued notice now, without waiting out the coalesce window,
+    # and stop the workers once they are through or timeout seconds have
+    # passed. Call it while the bot can still reach Discord.
+    async def close(self, timeout=10.0):
+        if self._queue is None:
+            return
+        for user_id, handle in list(self._timers.items()):
+            handle.cancel()
+            self._queue_now(user_id)
+        if not self._queue.empty():
+            self._ensure_started()
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                print(f"Gave up on {len(self._pending)} DM(s) at shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,744 @@
+from datetime import datetime
+
+import asyncpg
+
+from audit import AUDIT_BATCH_SIZE
+from ledger import (ACTIVE, STATUS_ENTRY_TYPES, AccountNotFound, AccountUnavailable, DuplicateOperation,
+                    InsufficientFunds, RequestNotFound, can_receive, can_send, current_status)
+from money import RATE_SCALE
+from storage import OwnEntries, Storage, next_day, uncovered_debits
+
+# Versioned schema for PostgreSQL, the same tables and indexes as the SQLite
+# schema in migrations.py. Applied versions are recorded in schema_migrations;
+# append new migrations to the end of the list.
+PG_MIGRATIONS = [
+    # 1: initial schema
+    [
+        '''CREATE TABLE accounts (
+                user_id BIGINT PRIMARY KEY,
+                username TEXT,
+                balance BIGINT,
+                created_at TEXT
+            )''',
+        '''CREATE TABLE transactions (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT,
+                type TEXT,
+                amount BIGINT,
+                date TEXT
+            )''',
+        '''CREATE TABLE pending_requests (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT,
+                type TEXT,
+                amount BIGINT,
+                status TEXT,
+                date TEXT
+            )''',
+        '''CREATE TABLE balance_checkpoints (
+                user_id BIGINT PRIMARY KEY,
+                transaction_id BIGINT,
+                balance BIGINT,
+                created_at TEXT
+            )''',
+        "CREATE INDEX idx_transactions_user_date ON transactions (user_id, date, id)",
+        "CREATE INDEX idx_transactions_user_id ON transactions (user_id, id)",
+        "CREATE INDEX idx_pending_requests_status ON pending_requests (status)",
+    ],
+    # 2: idempotency keys of applied ledger operations
+    [
+        '''CREATE TABLE ledger_operations (
+                key TEXT PRIMARY KEY,
+                created_at TEXT
+            )''',
+    ],
+    # 3: idempotency keys keep the result of their operation and expire by age
+    [
+        "ALTER TABLE ledger_operations ADD COLUMN result BIGINT",
+        "CREATE INDEX idx_ledger_operations_created_at ON ledger_operations (created_at)",
+    ],
+    # 4: aggregates for /leaderboard, /bank_stats and /monthly_summary, kept by
+    # triggers (see migration 9 in migrations.py)
+    [
+        "CREATE INDEX idx_accounts_balance ON accounts (balance)",
+        '''CREATE TABLE bank_totals (
+                slot INTEGER PRIMARY KEY,
+                accounts BIGINT DEFAULT 0,
+                money_supply BIGINT DEFAULT 0,
+                deposits BIGINT DEFAULT 0,
+                withdrawals BIGINT DEFAULT 0,
+                transfers BIGINT DEFAULT 0
+            )''',
+        '''CREATE TABLE daily_totals (
+                day TEXT,
+                slot INTEGER,
+                deposits BIGINT DEFAULT 0,
+                withdrawals BIGINT DEFAULT 0,
+                transfers BIGINT DEFAULT 0,
+                entries BIGINT DEFAULT 0,
+                PRIMARY KEY (day, slot)
+            )''',
+        '''CREATE TABLE monthly_summaries (
+                user_id BIGINT,
+                month TEXT,
+                deposits BIGINT DEFAULT 0,
+                withdrawals BIGINT DEFAULT 0,
+                transfers_in BIGINT DEFAULT 0,
+                transfers_out BIGINT DEFAULT 0,
+                adjustments BIGINT DEFAULT 0,
+                entries BIGINT DEFAULT 0,
+                PRIMARY KEY (user_id, month)
+            )''',
+        '''INSERT INTO bank_totals (slot, accounts, money_supply)
+           SELECT user_id % 16, COUNT(*), SUM(balance) FROM accounts GROUP BY user_id % 16''',
+        '''INSERT INTO bank_totals (slot, deposits, withdrawals, transfers)
+           SELECT user_id % 16,
+                  SUM(CASE WHEN type='deposit' THEN amount ELSE 0 END),
+                  SUM(CASE WHEN type='withdrawal' THEN -amount ELSE 0 END),
+                  SUM(CASE WHEN type='transfer in' THEN amount ELSE 0 END)
+           FROM transactions GROUP BY user_id % 16
+           ON CONFLICT (slot) DO UPDATE SET deposits = EXCLUDED.deposits,
+                                            withdrawals = EXCLUDED.withdrawals,
+                                            transfers = EXCLUDED.transfers''',
+        '''INSERT INTO daily_totals (day, slot, deposits, withdrawals, transfers, entries)
+           SELECT substr(date, 1, 10), user_id % 16,
+                  SUM(CASE WHEN type='deposit' THEN amount ELSE 0 END),
+                  SUM(CASE WHEN type='withdrawal' THEN -amount ELSE 0 END),
+                  SUM(CASE WHEN type='transfer in' THEN amount ELSE 0 END),
+                  COUNT(*)
+           FROM transactions GROUP BY substr(date, 1, 10), user_id % 16''',
+        '''INSERT INTO monthly_summaries (user_id, month, deposits, withdrawals, transfers_in, transfers_out, adjustments, entries)
+           SELECT user_id, substr(date, 1, 7),
+                  SUM(CASE WHEN type='deposit' THEN amount ELSE 0 END),
+                  SUM(CASE WHEN type='withdrawal' THEN -amount ELSE 0 END),
+                  SUM(CASE WHEN type='transfer in' THEN amount ELSE 0 END),
+                  SUM(CASE WHEN type='transfer out' THEN -amount ELSE 0 END),
+                  SUM(CASE WHEN type NOT IN ('deposit', 'withdrawal', 'transfer in', 'transfer out') THEN amount ELSE 0 END),
+                  COUNT(*)
+           FROM transactions GROUP BY user_id, substr(date, 1, 7)''',
+        '''CREATE FUNCTION aggregate_accounts() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO bank_totals (slot, accounts, money_supply) VALUES (NEW.user_id % 16, 1, NEW.balance)
+               ON CONFLICT (slot) DO UPDATE SET accounts = bank_totals.accounts + 1,
+                                                money_supply = bank_totals.money_supply + EXCLUDED.money_supply;
+               RETURN NULL;
+           END
+           $$ LANGUAGE plpgsql''',
+        '''CREATE FUNCTION aggregate_transactions() RETURNS trigger AS $$
+           DECLARE
+               deposit BIGINT := CASE WHEN NEW.type = 'deposit' THEN NEW.amount ELSE 0 END;
+               withdrawal BIGINT := CASE WHEN NEW.type = 'withdrawal' THEN -NEW.amount ELSE 0 END;
+               transfer_in BIGINT := CASE WHEN NEW.type = 'transfer in' THEN NEW.amount ELSE 0 END;
+               transfer_out BIGINT := CASE WHEN NEW.type = 'transfer out' THEN -NEW.amount ELSE 0 END;
+               adjustment BIGINT := CASE WHEN NEW.type IN ('deposit', 'withdrawal', 'transfer in', 'transfer out')
+                                         THEN 0 ELSE NEW.amount END;
+           BEGIN
+               INSERT INTO bank_totals (slot, money_supply, deposits, withdrawals, transfers)
+               VALUES (NEW.user_id % 16, NEW.amount, deposit, withdrawal, transfer_in)
+               ON CONFLICT (slot) DO UPDATE SET money_supply = bank_totals.money_supply + EXCLUDED.money_supply,
+                                                deposits = bank_totals.deposits + EXCLUDED.deposits,
+                                                withdrawals = bank_totals.withdrawals + EXCLUDED.withdrawals,
+                                                transfers = bank_totals.transfers + EXCLUDED.transfers;
+               INSERT INTO daily_totals (day, slot, deposits, withdrawals, transfers, entries)
+               VALUES (substr(NEW.date, 1, 10), NEW.user_id % 16, deposit, withdrawal, transfer_in, 1)
+               ON CONFLICT (day, slot) DO UPDATE SET deposits = daily_totals.deposits + EXCLUDED.deposits,
+                                                     withdrawals = daily_totals.withdrawals + EXCLUDED.withdrawals,
+                                                     transfers = daily_totals.transfers + EXCLUDED.transfers,
+                                                     entries = daily_totals.entries + 1;
+               INSERT INTO monthly_summaries (user_id, month, deposits, withdrawals, transfers_in, transfers_out, adjustments, entries)
+               VALUES (NEW.user_id, substr(NEW.date, 1, 7), deposit, withdrawal, transfer_in, transfer_out, adjustment, 1)
+               ON CONFLICT (user_id, month) DO UPDATE SET deposits = monthly_summaries.deposits + EXCLUDED.deposits,
+                                                          withdrawals = monthly_summaries.withdrawals + EXCLUDED.withdrawals,
+                                                          transfers_in = monthly_summaries.transfers_in + EXCLUDED.transfers_in,
+                                                          transfers_out = monthly_summaries.transfers_out + EXCLUDED.transfers_out,
+                                                          adjustments = monthly_summaries.adjustments + EXCLUDED.adjustments,
+                                                          entries = monthly_summaries.entries + 1;
+               RETURN NULL;
+           END
+           $$ LANGUAGE plpgsql''',
+        "CREATE TRIGGER aggregate_accounts AFTER INSERT ON accounts FOR EACH ROW EXECUTE FUNCTION aggregate_accounts()",
+        "CREATE TRIGGER aggregate_transactions AFTER INSERT ON transactions FOR EACH ROW EXECUTE FUNCTION aggregate_transactions()",
+    ],
+    # 5: account status instead of balance=-1 (or -100 cents) locks; the
+    # balance is given back or set to 0, and accounts an admin set to those
+    # balances stay active (see migration 10 in migrations.py)
+    [
+        "ALTER TABLE accounts ADD COLUMN status TEXT NOT NULL DEFAULT 'active'",
+        "ALTER TABLE accounts ADD COLUMN status_reason TEXT",
+        "ALTER TABLE accounts ADD COLUMN status_until TEXT",
+        "CREATE INDEX idx_accounts_status_until ON accounts (status_until) WHERE status_until IS NOT NULL",
+        '''WITH locked AS (
+               SELECT a.user_id, CASE WHEN t.type = 'lock' THEN t.amount ELSE a.balance END AS reversal
+               FROM accounts a LEFT JOIN transactions t
+                    ON t.id = (SELECT MAX(id) FROM transactions WHERE user_id = a.user_id AND amount != 0)
+               WHERE a.balance IN (-1, -100) AND t.type IS DISTINCT FROM 'adjustment'
+           ), reversed AS (
+               UPDATE accounts a SET status = 'locked', status_reason = 'locked by an earlier version',
+                                     balance = a.balance - l.reversal
+               FROM locked l WHERE a.user_id = l.user_id
+               RETURNING a.user_id, l.reversal
+           )
+           INSERT INTO transactions (user_id, type, amount, date)
+           SELECT user_id, 'lock reversal', -reversal, to_char(localtimestamp, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+           FROM reversed''',
+    ],
+    # 6: standing orders and scheduled jobs (see migration 11 in migrations.py)
+    [
+        '''CREATE TABLE standing_orders (
+                id BIGSERIAL PRIMARY KEY,
+                sender_id BIGINT,
+                recipient_id BIGINT,
+                amount BIGINT,
+                interval_days INTEGER,
+                next_run TEXT,
+                last_status TEXT,
+                created_at TEXT
+            )''',
+        "CREATE INDEX idx_standing_orders_next_run ON standing_orders (next_run)",
+        "CREATE INDEX idx_standing_orders_sender ON standing_orders (sender_id)",
+        '''CREATE TABLE scheduled_jobs (
+                name TEXT PRIMARY KEY,
+                next_run TEXT,
+                cursor BIGINT DEFAULT 0
+            )''',
+        "INSERT INTO scheduled_jobs (name, next_run) VALUES ('interest', NULL)",
+    ],
+]
+
+# Any fixed key works; it only has to be the same for every replica
+_MIGRATION_LOCK = 0x62616e6b
+
+_AUDIT_SQL = '''SELECT a.user_id, a.balance,
+                       (COALESCE(k.balance, 0) + COALESCE((
+                           SELECT SUM(t.amount) FROM transactions t
+                           WHERE t.user_id = a.user_id AND t.id > COALESCE(k.transaction_id, 0)
+                       ), 0))::BIGINT
+                FROM accounts a LEFT JOIN balance_checkpoints k ON k.user_id = a.user_id'''
+
+
+# Raise unless the account exists and its status allows the movement
+async def _check_status(conn, user_id, allowed, now):
+    row = await conn.fetchrow("SELECT status, status_reason, status_until FROM accounts WHERE user_id=$1", user_id)
+    if row is None:
+        raise AccountNotFound(user_id)
+    status = current_status(row['status'], row['status_until'], now)
+    if not allowed(status):
+        raise AccountUnavailable(user_id, status, row['status_reason'], row['status_until'])
+
+
+# Ledger entries from parallel arrays, one row per element
+_INSERT_ENTRIES = '''INSERT INTO transactions (user_id, type, amount, date)
+                     SELECT * FROM unnest($1::BIGINT[], $2::TEXT[], $3::BIGINT[], $4::TEXT[])'''
+
+
+# Collects query parameters and hands out their $n placeholders
+class _Params(list):
+    def add(self, value):
+        self.append(value)
+        return f"${len(self)}"
+
+
+# PostgreSQL storage backend on an asyncpg connection pool.
+# Several bot processes can share one database. asyncpg prepares every statement
+# and keeps it in a per-connection cache, and hot statements are also prepared
+# explicitly. Ledger operations run at SERIALIZABLE isolation; serialization
+# failures and deadlocks are reported as retryable so the Ledger re-runs them.
+class PostgresStorage(Storage):
+    def __init__(self, dsn, min_size=1, max_size=10, statement_cache_size=256):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self._pool = None
+        self.own_entries = OwnEntries()
+
+    async def open(self):
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size,
+                                               statement_cache_size=self.statement_cache_size)
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                # Only one replica migrates at a time
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", _MIGRATION_LOCK)
+                await conn.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY)")
+                current = await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+                for version, statements in enumerate(PG_MIGRATIONS, start=1):
+                    if version <= current:
+                        continue
+                    for statement in statements:
+                        await conn.execute(statement)
+                    await conn.execute("INSERT INTO schema_migrations (version) VALUES ($1)", version)
+        return current
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    def is_retryable(self, error):
+        return isinstance(error, (asyncpg.SerializationError, asyncpg.DeadlockDetectedError))
+
+    # Run an INSERT INTO transactions and remember the IDs of the entries it
+    # wrote as this process's own (see OwnEntries). IDs of a transaction that
+    # then rolls back are never seen by the feed and are forgotten with the rest.
+    async def _add_entries(self, conn, sql, *args):
+        rows = await conn.fetch(sql + " RETURNING id", *args)
+        self.own_entries.add_ids(row['id'] for row in rows)
+
+    # Same for [(user_id, type, amount, date)]
+    async def _add_entry_rows(self, conn, entries):
+        await self._add_entries(conn, _INSERT_ENTRIES, *(list(column) for column in zip(*entries)))
+
+    # Accounts
+
+    async def get_account(self, user_id):
+        row = await self._pool.fetchrow('''SELECT user_id, username, balance, created_at, status, status_reason, status_until
+                                           FROM accounts WHERE user_id=$1''', user_id)
+        return tuple(row) if row else None
+
+    async def create_account(self, user_id, username, created_at):
+        created = await self._pool.fetchval('''INSERT INTO accounts (user_id, username, balance, created_at)
+                                               VALUES ($1, $2, 0, $3)
+                                               ON CONFLICT (user_id) DO NOTHING RETURNING user_id''',
+                                            user_id, username, created_at)
+        return created is not None
+
+    async def set_status(self, user_ids, status, reason=None, until=None):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch('''UPDATE accounts SET status=$1, status_reason=$2, status_until=$3
+                                           WHERE user_id = ANY($4::BIGINT[]) RETURNING user_id''',
+                                        status, reason, until, list(user_ids))
+                updated = sorted(row['user_id'] for row in rows)
+                now = datetime.now().isoformat()
+                if updated:
+                    await self._add_entry_rows(conn, [(user_id, STATUS_ENTRY_TYPES[status], 0, now) for user_id in updated])
+                return updated
+
+    async def expire_statuses(self, user_ids, now):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch('''UPDATE accounts SET status=$1, status_reason=NULL, status_until=NULL
+                                           WHERE user_id = ANY($2::BIGINT[]) AND status != 'active' AND status_until <= $3
+                                           RETURNING user_id''', ACTIVE, list(user_ids), now)
+                expired = sorted(row['user_id'] for row in rows)
+                if expired:
+                    await self._add_entry_rows(conn, [(user_id, STATUS_ENTRY_TYPES[ACTIVE], 0, now) for user_id in expired])
+                return expired
+
+    async def get_status_expiries(self):
+        rows = await self._pool.fetch('''SELECT user_id, status_until FROM accounts
+                                         WHERE status != 'active' AND status_until IS NOT NULL''')
+        return [tuple(row) for row in rows]
+
+    # Transactions
+
+    async def get_transactions_page(self, user_id, limit, after=None, before=None,
+                                    transaction_type=None, start=None, end=None):
+        params = _Params()
+        sql = f"SELECT id, user_id, type, amount, date FROM transactions WHERE user_id={params.add(user_id)}"
+        if transaction_type:
+            sql += f" AND type={params.add(transaction_type)}"
+        if start:
+            sql += f" AND date >= {params.add(start)}"
+        if end:
+            sql += f" AND date < {params.add(end)}"
+        if before:
+            sql += f" AND (date, id) > ({params.add(before[0])}, {params.add(before[1])}) ORDER BY date ASC, id ASC"
+        else:
+            if after:
+                sql += f" AND (date, id) < ({params.add(after[0])}, {params.add(after[1])})"
+            sql += " ORDER BY date DESC, id DESC"
+        sql += f" LIMIT {params.add(limit + 1)}"
+        rows = [tuple(row) for row in await self._pool.fetch(sql, *params)]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before:
+            rows.reverse()
+        return rows, has_more
+
+    # Pending requests
+
+    # Every row runs under its own savepoint, so a failing row only fails itself
+    async def add_requests(self, requests):
+        results = []
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                insert = await conn.prepare('''INSERT INTO pending_requests (user_id, type, amount, status, date)
+                                               VALUES ($1, $2, $3, 'pending', $4) RETURNING id''')
+                record = await conn.prepare('''INSERT INTO ledger_operations (key, result, created_at) VALUES ($1, $2, $3)
+                                               ON CONFLICT (key) DO NOTHING RETURNING key''')
+                for user_id, request_type, amount, date, key in requests:
+                    try:
+                        async with conn.transaction():
+                            request_id = await insert.fetchval(user_id, request_type, amount, date)
+                            if key is not None and await record.fetchval(key, request_id, date) is None:
+                                original = await conn.fetchval("SELECT result FROM ledger_operations WHERE key=$1", key)
+                                raise DuplicateOperation(key, original)
+                        results.append(request_id)
+                    except Exception as e:
+                        results.append(e)
+        return results
+
+    async def get_request(self, request_id):
+        row = await self._pool.fetchrow("SELECT id, user_id, type, amount, status, date FROM pending_requests WHERE id=$1",
+                                        request_id)
+        return tuple(row) if row else None
+
+    async def delete_request(self, request_id):
+        await self._pool.execute("DELETE FROM pending_requests WHERE id=$1", request_id)
+
+    async def get_pending_requests(self):
+        rows = await self._pool.fetch("SELECT id, user_id, type, amount, status, date FROM pending_requests WHERE status='pending'")
+        return [tuple(row) for row in rows]
+
+    # Ledger operations
+
+    async def transfer(self, sender_id, recipient_id, amount, idempotency_key=None):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction(isolation='serializable'):
+                if idempotency_key is not None:
+                    inserted = await conn.fetchval('''INSERT INTO ledger_operations (key, created_at) VALUES ($1, $2)
+                                                      ON CONFLICT (key) DO NOTHING RETURNING key''',
+                                                   idempotency_key, datetime.now().isoformat())
+                    if inserted is None:
+                        raise DuplicateOperation(idempotency_key)
+                now = datetime.now().isoformat()
+                await _check_status(conn, recipient_id, can_receive, now)
+                sender_balance = await conn.fetchval('''UPDATE accounts SET balance = balance - $1
+                                                        WHERE user_id=$2 AND balance >= $1
+                                                          AND (status = 'active' OR status_until <= $3)
+                                                        RETURNING balance''',
+                                                     amount, sender_id, now)
+                if sender_balance is None:
+                    await _check_status(conn, sender_id, can_send, now)
+                    raise InsufficientFunds(sender_id)
+                recipient_balance = await conn.fetchval("UPDATE accounts SET balance = balance + $1 WHERE user_id=$2 RETURNING balance",
+                                                        amount, recipient_id)
+                await self._add_entry_rows(conn, [(sender_id, 'transfer out', -amount, now),
+                                                  (recipient_id, 'transfer in', amount, now)])
+                return [(sender_id, sender_balance), (recipient_id, recipient_balance)]
+
+    async def set_balance(self, user_id, balance, entry_type):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction(isolation='serializable'):
+                old = await conn.fetchval("SELECT balance FROM accounts WHERE user_id=$1 FOR UPDATE", user_id)
+                if old is None:
+                    raise AccountNotFound(user_id)
+                await conn.execute("UPDATE accounts SET balance=$1 WHERE user_id=$2", balance, user_id)
+                await self._add_entries(conn, "INSERT INTO transactions (user_id, type, amount, date) VALUES ($1, $2, $3, $4)",
+                                        user_id, entry_type, balance - old, datetime.now().isoformat())
+
+    async def approve_request(self, request_id):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction(isolation='serializable'):
+                request = await conn.fetchrow("DELETE FROM pending_requests WHERE id=$1 RETURNING user_id, type, amount",
+                                              request_id)
+                if request is None:
+                    raise RequestNotFound(request_id)
+                user_id, request_type, amount = request
+                await _check_status(conn, user_id, can_receive if request_type == 'deposit' else can_send,
+                                    datetime.now().isoformat())
+
+                if request_type == 'deposit':
+                    balance = await conn.fetchval("UPDATE accounts SET balance = balance + $1 WHERE user_id=$2 RETURNING balance",
+                                                  amount, user_id)
+                    entry = ('deposit', amount)
+                else:
+                    balance = await conn.fetchval('''UPDATE accounts SET balance = balance - $1
+                                                     WHERE user_id=$2 AND balance >= $1 RETURNING balance''',
+                                                  amount, user_id)
+                    if balance is None:
+                        raise InsufficientFunds(user_id)
+                    entry = ('withdrawal', -amount)
+
+                await self._add_entries(conn, "INSERT INTO transactions (user_id, type, amount, date) VALUES ($1, $2, $3, $4)",
+                                        user_id, entry[0], entry[1], datetime.now().isoformat())
+                return tuple(request), balance
+
+    async def apply_requests(self, action, ranges=None, request_type=None, max_amount=None, before=None):
+        params = _Params()
+        where = ["status='pending'"]
+        if ranges:
+            lows = params.add([low for low, _ in ranges])
+            highs = params.add([high for _, high in ranges])
+            where.append(f'''EXISTS (SELECT 1 FROM unnest({lows}::BIGINT[], {highs}::BIGINT[]) AS r(low, high)
+                                     WHERE p.id BETWEEN r.low AND r.high)''')
+        if request_type:
+            where.append(f"type={params.add(request_type)}")
+        if max_amount is not None:
+            where.append(f"amount <= {params.add(max_amount)}")
+        if before:
+            where.append(f"date < {params.add(before)}")
+
+        async with self._pool.acquire() as conn:
+            async with conn.transaction(isolation='serializable'):
+                # Kept for the life of the connection rather than dropped on
+                # commit, so cached statements that use it stay valid
+                await conn.execute('''CREATE TEMP TABLE IF NOT EXISTS batch_requests (
+                                          id BIGINT PRIMARY KEY,
+                                          user_id BIGINT,
+                                          type TEXT,
+                                          amount BIGINT,
+                                          skip TEXT
+                                      )''')
+                await conn.execute("DELETE FROM batch_requests")
+                await conn.execute(f'''INSERT INTO batch_requests (id, user_id, type, amount)
+                                       SELECT id, user_id, type, amount FROM pending_requests p
+                                       WHERE {' AND '.join(where)}''', *params)
+
+                if action == 'approve':
+                    await conn.execute('''UPDATE batch_requests b SET skip='account not found'
+                                          WHERE NOT EXISTS (SELECT 1 FROM accounts a WHERE a.user_id = b.user_id)''')
+                    now = datetime.now().isoformat()
+                    await conn.execute('''UPDATE batch_requests SET skip='account locked'
+                                          WHERE skip IS NULL AND user_id IN (
+                                              SELECT user_id FROM accounts
+                                              WHERE status='locked' AND (status_until IS NULL OR status_until > $1)
+                                          )''', now)
+                    await conn.execute('''UPDATE batch_requests SET skip='account frozen'
+                                          WHERE skip IS NULL AND type='withdraw' AND user_id IN (
+                                              SELECT user_id FROM accounts
+                                              WHERE status='frozen' AND (status_until IS NULL OR status_until > $1)
+                                          )''', now)
+                    # Withdrawals are covered in ID order from the balance plus the
+                    # batch's deposits; a refused one does not use up any of it
+                    withdrawals = await conn.fetch('''SELECT id, user_id, amount FROM batch_requests
+                                                      WHERE type='withdraw' AND skip IS NULL ORDER BY id''')
+                    available = await conn.fetch('''SELECT a.user_id, a.balance + COALESCE((
+                                                        SELECT SUM(d.amount) FROM batch_requests d
+                                                        WHERE d.user_id = a.user_id AND d.type='deposit' AND d.skip IS NULL
+                                                    ), 0)::BIGINT
+                                                    FROM accounts a WHERE a.user_id IN (
+                                                        SELECT user_id FROM batch_requests WHERE type='withdraw' AND skip IS NULL
+                                                    )''')
+                    refused = uncovered_debits([tuple(row) for row in withdrawals], {row[0]: row[1] for row in available})
+                    if refused:
+                        await conn.execute("UPDATE batch_requests SET skip='insufficient funds' WHERE id = ANY($1::BIGINT[])",
+                                           refused)
+                    await conn.execute('''UPDATE accounts a SET balance = a.balance + d.delta
+                                          FROM (
+                                              SELECT user_id, SUM(CASE WHEN type='deposit' THEN amount ELSE -amount END) AS delta
+                                              FROM batch_requests WHERE skip IS NULL GROUP BY user_id
+                                          ) d
+                                          WHERE a.user_id = d.user_id''')
+                    await self._add_entries(conn, '''INSERT INTO transactions (user_id, type, amount, date)
+                                                   SELECT user_id,
+                                                          CASE WHEN type='deposit' THEN 'deposit' ELSE 'withdrawal' END,
+                                                          CASE WHEN type='deposit' THEN amount ELSE -amount END,
+                                                          $1
+                                                   FROM batch_requests WHERE skip IS NULL ORDER BY id''',
+                                            datetime.now().isoformat())
+
+                await conn.execute("DELETE FROM pending_requests WHERE id IN (SELECT id FROM batch_requests WHERE skip IS NULL)")
+                applied = await conn.fetch("SELECT id, user_id FROM batch_requests WHERE skip IS NULL ORDER BY id")
+                skipped = await conn.fetch("SELECT id, skip FROM batch_requests WHERE skip IS NOT NULL ORDER BY id")
+                balances = await conn.fetch('''SELECT user_id, balance FROM accounts
+                                               WHERE user_id IN (SELECT user_id FROM batch_requests WHERE skip IS NULL)''')
+                return ([tuple(row) for row in applied], [tuple(row) for row in skipped],
+                        [tuple(row) for row in balances])
+
+    async def expire_operations(self, before, batch_size=5000):
+        removed = 0
+        while True:
+            status = await self._pool.execute('''DELETE FROM ledger_operations WHERE key IN (
+                                                     SELECT key FROM ledger_operations WHERE created_at < $1 LIMIT $2
+                                                 )''', before, batch_size)
+            count = int(status.split()[-1])
+            removed += count
+            if count < batch_size:
+                return removed
+
+    # Scheduled jobs
+
+    async def create_standing_order(self, sender_id, recipient_id, amount, interval_days, next_run, created_at):
+        return await self._pool.fetchval('''INSERT INTO standing_orders (sender_id, recipient_id, amount, interval_days, next_run, created_at)
+                                            VALUES ($1, $2, $3, $4, $5, $6) RETURNING id''',
+                                         sender_id, recipient_id, amount, interval_days, next_run, created_at)
+
+    async def get_standing_orders(self, sender_id):
+        rows = await self._pool.fetch('''SELECT id, sender_id, recipient_id, amount, interval_days, next_run, last_status, created_at
+                                         FROM standing_orders WHERE sender_id=$1 ORDER BY id''', sender_id)
+        return [tuple(row) for row in rows]
+
+    async def cancel_standing_order(self, order_id, sender_id):
+        status = await self._pool.execute("DELETE FROM standing_orders WHERE id=$1 AND sender_id=$2", order_id, sender_id)
+        return int(status.split()[-1]) > 0
+
+    async def run_standing_orders(self, now, limit):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction(isolation='serializable'):
+                await conn.execute('''CREATE TEMP TABLE IF NOT EXISTS due_orders (
+                                          id BIGINT PRIMARY KEY,
+                                          sender_id BIGINT,
+                                          recipient_id BIGINT,
+                                          amount BIGINT,
+                                          skip TEXT
+                                      )''')
+                await conn.execute("DELETE FROM due_orders")
+                await conn.execute('''INSERT INTO due_orders (id, sender_id, recipient_id, amount)
+                                      SELECT id, sender_id, recipient_id, amount FROM standing_orders
+                                      WHERE next_run <= $1 ORDER BY next_run, id LIMIT $2''', now, limit)
+                await conn.execute('''UPDATE due_orders d SET skip='account not found'
+                                      WHERE NOT EXISTS (SELECT 1 FROM accounts a WHERE a.user_id = d.sender_id)
+                                         OR NOT EXISTS (SELECT 1 FROM accounts a WHERE a.user_id = d.recipient_id)''')
+                await conn.execute('''UPDATE due_orders d SET skip='account ' || a.status
+                                      FROM accounts a
+                                      WHERE d.skip IS NULL AND a.user_id = d.sender_id
+                                        AND a.status != 'active' AND (a.status_until IS NULL OR a.status_until > $1)''',
+                                   now)
+                await conn.execute('''UPDATE due_orders SET skip='recipient locked'
+                                      WHERE skip IS NULL AND recipient_id IN (
+                                          SELECT user_id FROM accounts
+                                          WHERE status='locked' AND (status_until IS NULL OR status_until > $1)
+                                      )''', now)
+                # A refused order does not use up the balance for the sender's later ones
+                orders = await conn.fetch("SELECT id, sender_id, amount FROM due_orders WHERE skip IS NULL ORDER BY id")
+                available = await conn.fetch('''SELECT user_id, balance FROM accounts
+                                                WHERE user_id IN (SELECT sender_id FROM due_orders WHERE skip IS NULL)''')
+                refused = uncovered_debits([tuple(row) for row in orders], {row[0]: row[1] for row in available})
+                if refused:
+                    await conn.execute("UPDATE due_orders SET skip='insufficient funds' WHERE id = ANY($1::BIGINT[])",
+                                       refused)
+                await conn.execute('''UPDATE accounts a SET balance = a.balance + d.delta
+                                      FROM (
+                                          SELECT user_id, SUM(amount) AS delta FROM (
+                                              SELECT recipient_id AS user_id, amount FROM due_orders WHERE skip IS NULL
+                                              UNION ALL
+                                              SELECT sender_id, -amount FROM due_orders WHERE skip IS NULL
+                                          ) legs GROUP BY user_id
+                                      ) d
+                                      WHERE a.user_id = d.user_id''')
+                await self._add_entries(conn, '''INSERT INTO transactions (user_id, type, amount, date)
+                                               SELECT user_id, type, amount, $1 FROM (
+                                                   SELECT id, 0 AS leg, sender_id AS user_id, 'transfer out' AS type, -amount AS amount
+                                                   FROM due_orders WHERE skip IS NULL
+                                                   UNION ALL
+                                                   SELECT id, 1, recipient_id, 'transfer in', amount FROM due_orders WHERE skip IS NULL
+                                               ) legs ORDER BY id, leg''', datetime.now().isoformat())
+                await conn.execute('''UPDATE standing_orders o
+                                      SET next_run = to_char(o.next_run::timestamp + o.interval_days * interval '1 day',
+                                                             'YYYY-MM-DD"T"HH24:MI:SS'),
+                                          last_status = COALESCE(d.skip, 'paid')
+                                      FROM due_orders d WHERE d.id = o.id''')
+                paid = await conn.fetch("SELECT id, sender_id, recipient_id, amount FROM due_orders WHERE skip IS NULL ORDER BY id")
+                skipped = await conn.fetch("SELECT id, sender_id, skip FROM due_orders WHERE skip IS NOT NULL ORDER BY id")
+                balances = await conn.fetch('''SELECT user_id, balance FROM accounts
+                                               WHERE user_id IN (SELECT sender_id FROM due_orders WHERE skip IS NULL
+                                                                 UNION SELECT recipient_id FROM due_orders WHERE skip IS NULL)''')
+                return ([tuple(row) for row in paid], [tuple(row) for row in skipped],
+                        [tuple(row) for row in balances])
+
+    async def pay_interest(self, rate, today, limit):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction(isolation='serializable'):
+                job = await conn.fetchrow("SELECT next_run, cursor FROM scheduled_jobs WHERE name='interest' FOR UPDATE")
+                day, cursor = job['next_run'], job['cursor']
+                if day is None:
+                    await conn.execute("UPDATE scheduled_jobs SET next_run=$1, cursor=0 WHERE name='interest'", next_day(today))
+                    return None
+                if day > today:
+                    return None
+                if not rate:
+                    await conn.execute("UPDATE scheduled_jobs SET next_run=$1, cursor=0 WHERE name='interest'", next_day(today))
+                    return day, [], []
+                await conn.execute("CREATE TEMP TABLE IF NOT EXISTS interest_batch (user_id BIGINT PRIMARY KEY, amount BIGINT)")
+                await conn.execute("DELETE FROM interest_batch")
+                count = int((await conn.execute('''INSERT INTO interest_batch (user_id, amount)
+                                                   SELECT user_id, (balance / $5) * $1 + (balance % $5) * $1 / $5 FROM accounts
+                                                   WHERE user_id > $2 AND balance > 0
+                                                     AND NOT (status = 'locked' AND (status_until IS NULL OR status_until > $3))
+                                                   ORDER BY user_id LIMIT $4''',
+                                                rate, cursor, datetime.now().isoformat(), limit, RATE_SCALE)).split()[-1])
+                last = await conn.fetchval("SELECT MAX(user_id) FROM interest_batch")
+                await conn.execute("DELETE FROM interest_batch WHERE amount <= 0")
+                balances = await conn.fetch('''UPDATE accounts a SET balance = a.balance + b.amount
+                                               FROM interest_batch b WHERE a.user_id = b.user_id
+                                               RETURNING a.user_id, a.balance''')
+                await self._add_entries(conn, '''INSERT INTO transactions (user_id, type, amount, date)
+                                               SELECT user_id, 'interest', amount, $1 FROM interest_batch ORDER BY user_id''',
+                                        datetime.now().isoformat())
+                if count < limit:
+                    await conn.execute("UPDATE scheduled_jobs SET next_run=$1, cursor=0 WHERE name='interest'", next_day(day))
+                else:
+                    await conn.execute("UPDATE scheduled_jobs SET cursor=$1 WHERE name='interest'", last)
+                paid = await conn.fetch("SELECT user_id, amount FROM interest_batch ORDER BY user_id")
+                return day, [tuple(row) for row in paid], [tuple(row) for row in balances]
+
+    # Change feed
+
+    async def get_last_transaction_id(self):
+        return await self._pool.fetchval("SELECT COALESCE(MAX(id), 0) FROM transactions")
+
+    async def get_ledger_changes(self, after_id, limit):
+        rows = await self._pool.fetch("SELECT id, user_id FROM transactions WHERE id > $1 ORDER BY id LIMIT $2",
+                                      after_id, limit)
+        return [tuple(row) for row in rows]
+
+    # Analytics (aggregates kept by the triggers of migration 4)
+
+    async def get_top_balances(self, limit):
+        rows = await self._pool.fetch('''SELECT user_id, balance FROM accounts WHERE balance > 0
+                                         ORDER BY balance DESC, user_id LIMIT $1''', limit)
+        return [tuple(row) for row in rows]
+
+    async def get_bank_totals(self):
+        row = await self._pool.fetchrow('''SELECT COALESCE(SUM(accounts), 0)::BIGINT, COALESCE(SUM(money_supply), 0)::BIGINT,
+                                                  COALESCE(SUM(deposits), 0)::BIGINT, COALESCE(SUM(withdrawals), 0)::BIGINT,
+                                                  COALESCE(SUM(transfers), 0)::BIGINT
+                                           FROM bank_totals''')
+        return tuple(row)
+
+    async def get_daily_totals(self, since):
+        rows = await self._pool.fetch('''SELECT day, SUM(deposits)::BIGINT, SUM(withdrawals)::BIGINT,
+                                                SUM(transfers)::BIGINT, SUM(entries)::BIGINT
+                                         FROM daily_totals WHERE day >= $1 GROUP BY day ORDER BY day DESC''', since)
+        return [tuple(row) for row in rows]
+
+    async def get_monthly_summaries(self, user_id, limit, month=None):
+        sql = '''SELECT month, deposits, withdrawals, transfers_in, transfers_out, adjustments, entries
+                 FROM monthly_summaries WHERE user_id=$1'''
+        if month:
+            rows = await self._pool.fetch(sql + " AND month=$2", user_id, month)
+        else:
+            rows = await self._pool.fetch(sql + " ORDER BY month DESC LIMIT $2", user_id, limit)
+        return [tuple(row) for row in rows]
+
+    # Audit
+
+    # Transaction IDs come from a sequence and can commit out of order, so the
+    # audit holds off new ledger entries while it reads; otherwise a checkpoint
+    # could be placed past an entry that commits a moment later.
+    async def _audit(self, sql, *params):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("LOCK TABLE transactions IN SHARE MODE")
+                rows = await conn.fetch(sql, *params)
+                high = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM transactions")
+                now = datetime.now().isoformat()
+                mismatches = []
+                verified = []
+                for user_id, balance, expected in rows:
+                    if balance == expected:
+                        verified.append((user_id, high, balance, now))
+                    else:
+                        mismatches.append((user_id, balance, expected))
+                await conn.executemany('''INSERT INTO balance_checkpoints (user_id, transaction_id, balance, created_at)
+                                          VALUES ($1, $2, $3, $4)
+                                          ON CONFLICT (user_id) DO UPDATE SET transaction_id = EXCLUDED.transaction_id,
+                                                                              balance = EXCLUDED.balance,
+                                                                              created_at = EXCLUDED.created_at''',
+                                       verified)
+                return rows, mismatches
+
+    async def audit_account(self, user_id):
+        rows, _ = await self._audit(_AUDIT_SQL + " WHERE a.user_id=$1", user_id)
+        if not rows:
+            return None
+        return rows[0][1], rows[0][2]
+
+    async def audit_batch(self, after_user_id=None):
+        after = after_user_id if after_user_id is not None else -1 << 63
+        rows, mismatches = await self._audit(_AUDIT_SQL + " WHERE a.user_id > $1 ORDER BY a.user_id LIMIT $2",
+                                             after, AUDIT_BATCH_SIZE)
+        last_user_id = rows[-1][0] if len(rows) == AUDIT_BATCH_SIZE else None
+        return last_user_id, len(rows), mismatches
@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from loadtest import git_commit
+
+# Offline startup benchmark: how long a bot process takes from launch until it
+# is ready to connect to the gateway. Each run is a fresh Python process that
+# imports bank.py and runs the bot's setup_hook (loading the command modules,
+# opening the database and starting the services, syncing the command tree)
+# against a temporary bank.db, with Discord's sync call replaced by a stub that
+# waits sync_latency. The first run starts from an empty database and no sync
+# state, like a first deployment; the later ones reuse both, like a restart.
+# Login and the gateway handshake need a token and are not included. Reports
+# the time of each phase per run and writes them as JSON:
+#   python startup.py --runs 5 --output startup.json
+
+
+# One run, in this process; prints its phases as JSON
+async def measure(started, sync_latency):
+    phases = {}
+    before = time.perf_counter()
+    import bank
+    phases['import_seconds'] = time.perf_counter() - before
+
+    synced = []
+
+    async def sync(*args, **kwargs):
+        await asyncio.sleep(sync_latency)
+        synced.append(True)
+        return []
+    bank.bot.tree.sync = sync
+
+    before = time.perf_counter()
+    await bank.bot.setup_hook()
+    phases['setup_hook_seconds'] = time.perf_counter() - before
+    phases['time_to_ready_seconds'] = time.perf_counter() - started
+    phases['commands'] = len(bank.bot.tree.get_commands())
+    phases['synced'] = bool(synced)
+
+    for task in (bank.checkpoint_balances, bank.expire_operations, bank.archive_transactions,
+                 bank.run_scheduled_jobs):
+        task.cancel()
+    await bank.stop_services()
+    return phases
+
+
+def run_child(args, tmp):
+    env = dict(os.environ,
+               BANK_STORAGE='sqlite',
+               BANK_DB_PATH=args.db,
+               COMMAND_SYNC_STATE=os.path.join(tmp, 'command_tree.sha256'))
+    for name in ('METRICS_PORT', 'BACKUP_DIR', 'RATE_LIMIT_STATE'):
+        env.pop(name, None)
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child',
+                             '--sync-latency-ms', str(args.sync_latency_ms)],
+                            capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode:
+        raise RuntimeError(f"startup run failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv):
+    started = time.perf_counter()
+    parser = argparse.ArgumentParser(description="Offline benchmark of the bank bot's time to ready.")
+    parser.add_argument('--runs', type=int, default=3, help="bot processes to start one after another")
+    parser.add_argument('--sync-latency-ms', type=float, default=1000.0,
+                        help="simulated duration of a command tree sync")
+    parser.add_argument('--db', help="database path (default: a temporary file)")
+    parser.add_argument('--label', help="free-form label stored in the results")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv[1:])
+
+    if args.child:
+        print(json.dumps(asyncio.run(measure(started, args.sync_latency_ms / 1000))))
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.db is None:
+            args.db = os.path.join(tmp, 'bank.db')
+        runs = [run_child(args, tmp) for _ in range(args.runs)]
+
+    results = {
+        'commit': git_commit(),
+        'label': args.label,
+        'config': {'runs': args.runs, 'sync_latency_ms': args.sync_latency_ms},
+        'cold': runs[0],
+        'warm': runs[1:],
+    }
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
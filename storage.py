@@ -0,0 +1,299 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_right, insort
+from datetime import date, timedelta
+
+
+# Storage backend interface.
+# Everything the bot persists goes through these methods, so the commands, the
+# ledger and the caches work the same against any backend. Rows are returned as
+# tuples in the column order of the SQLite schema (see migrations.py) and money
+# is always integer cents. Ledger operations raise the exceptions in ledger.py
+# and return the balances they committed so callers can write them through.
+#
+# Backends: db.Database (SQLite, the default) and pg.PostgresStorage. A backend
+# that leaves any abstract method out cannot be instantiated.
+class Storage(ABC):
+    # Ledger entries written by this process (an OwnEntries), or None if the
+    # backend does not keep track
+    own_entries = None
+
+    # Whether archive_transactions is implemented
+    supports_archive = False
+    # Whether backup.BackupService can back it up (SQLite only)
+    supports_backup = False
+
+    # Connect and bring the schema up to date
+    @abstractmethod
+    async def open(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def close(self):
+        raise NotImplementedError
+
+    # True if a failed ledger operation can safely be retried (lock contention,
+    # serialization failures)
+    def is_retryable(self, error):
+        return False
+
+    # Accounts
+
+    @abstractmethod
+    async def get_account(self, user_id):
+        raise NotImplementedError
+
+    # Create the account unless it already exists, in a single statement so
+    # that two concurrent registrations cannot both insert. Returns True if it
+    # was created.
+    @abstractmethod
+    async def create_account(self, user_id, username, created_at):
+        raise NotImplementedError
+
+    # Set the status (see ledger.py) of many accounts in one transaction,
+    # writing a ledger entry of amount 0 for each. Returns the IDs of the
+    # accounts that exist, in order.
+    @abstractmethod
+    async def set_status(self, user_ids, status, reason=None, until=None):
+        raise NotImplementedError
+
+    # Make the given accounts active again if their status expired by now
+    # (ISO time). Returns the IDs of those reactivated.
+    @abstractmethod
+    async def expire_statuses(self, user_ids, now):
+        raise NotImplementedError
+
+    # [(user_id, status_until)] of every lock or freeze with an expiry
+    @abstractmethod
+    async def get_status_expiries(self):
+        raise NotImplementedError
+
+    # Transactions
+
+    # One page of a user's history, newest first, keyset-paginated on (date, id).
+    # Pass the (date, id) of the last row of the current page as after= for the
+    # next (older) page, or of its first row as before= for the previous (newer)
+    # page. Returns (rows, has_more), where has_more says whether another page
+    # exists in the direction fetched.
+    @abstractmethod
+    async def get_transactions_page(self, user_id, limit, after=None, before=None,
+                                    transaction_type=None, start=None, end=None):
+        raise NotImplementedError
+
+    # Pending requests
+
+    # Insert many (user_id, type, amount, date, idempotency_key) requests in one
+    # transaction; the key may be None. Returns one result per row: its new ID,
+    # or the exception that row raised. A row whose key has been used before
+    # gets DuplicateOperation carrying the ID of the original request.
+    @abstractmethod
+    async def add_requests(self, requests):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_request(self, request_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_request(self, request_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_pending_requests(self):
+        raise NotImplementedError
+
+    # Ledger operations
+
+    # Returns [(user_id, balance)] for sender and recipient. A transfer with an
+    # idempotency_key is applied at most once across every process sharing the
+    # storage; repeating it raises DuplicateOperation and changes nothing.
+    @abstractmethod
+    async def transfer(self, sender_id, recipient_id, amount, idempotency_key=None):
+        raise NotImplementedError
+
+    # Returns ((user_id, type, amount), balance)
+    @abstractmethod
+    async def approve_request(self, request_id):
+        raise NotImplementedError
+
+    # Returns (applied, skipped, balances); see Ledger.apply_requests
+    @abstractmethod
+    async def apply_requests(self, action, ranges=None, request_type=None, max_amount=None, before=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_balance(self, user_id, balance, entry_type):
+        raise NotImplementedError
+
+    # Scheduled jobs
+
+    # next_run is the ISO time of the first payment. Returns the new order's ID.
+    @abstractmethod
+    async def create_standing_order(self, sender_id, recipient_id, amount, interval_days, next_run, created_at):
+        raise NotImplementedError
+
+    # [(id, sender_id, recipient_id, amount, interval_days, next_run, last_status, created_at)]
+    # of a user's standing orders, oldest first
+    @abstractmethod
+    async def get_standing_orders(self, sender_id):
+        raise NotImplementedError
+
+    # Returns False if the user has no standing order with this ID
+    @abstractmethod
+    async def cancel_standing_order(self, order_id, sender_id):
+        raise NotImplementedError
+
+    # Pay up to limit standing orders due by now (ISO time), oldest due first,
+    # in one transaction, and move each one interval on. An order that cannot
+    # be paid is skipped for this run. Returns (paid, skipped, balances): paid
+    # is [(order_id, sender_id, recipient_id, amount)], skipped is
+    # [(order_id, sender_id, reason)].
+    @abstractmethod
+    async def run_standing_orders(self, now, limit):
+        raise NotImplementedError
+
+    # Pay interest at rate (in millionths, see money.RATE_SCALE; rounded down
+    # to the cent, in integer arithmetic) on up to
+    # limit accounts for the oldest day not yet paid, if that day is on or
+    # before today (YYYY-MM-DD), in one transaction. A day is done once every
+    # account has had a batch; a rate of 0 just marks the days done. Returns
+    # None if no day is due, else (day, paid, balances) with paid as
+    # [(user_id, amount)].
+    @abstractmethod
+    async def pay_interest(self, rate, today, limit):
+        raise NotImplementedError
+
+    # Change feed (see feed.py)
+
+    @abstractmethod
+    async def get_last_transaction_id(self):
+        raise NotImplementedError
+
+    # Returns [(transaction_id, user_id)] for ledger entries after after_id
+    @abstractmethod
+    async def get_ledger_changes(self, after_id, limit):
+        raise NotImplementedError
+
+    # Move transactions older than cutoff (ISO date) out of the live tables,
+    # keeping per-user rollups, without holding up commands. Returns how many
+    # were moved. get_transactions_page still returns archived history.
+    # Optional: only called when supports_archive is set.
+    async def archive_transactions(self, cutoff):
+        raise NotImplementedError
+
+    # Forget idempotency keys recorded before the given ISO timestamp.
+    # Returns how many were removed.
+    @abstractmethod
+    async def expire_operations(self, before):
+        raise NotImplementedError
+
+    # Analytics, read from aggregates the backend keeps up to date with every
+    # ledger entry, so none of these scan accounts or transactions
+
+    # [(user_id, balance)] of the richest accounts with a positive balance
+    @abstractmethod
+    async def get_top_balances(self, limit):
+        raise NotImplementedError
+
+    # (accounts, money_supply, deposits, withdrawals, transfers) over all time
+    @abstractmethod
+    async def get_bank_totals(self):
+        raise NotImplementedError
+
+    # [(day, deposits, withdrawals, transfers, entries)] from the given
+    # YYYY-MM-DD on, newest first
+    @abstractmethod
+    async def get_daily_totals(self, since):
+        raise NotImplementedError
+
+    # [(month, deposits, withdrawals, transfers_in, transfers_out, adjustments,
+    # entries)] of a user's latest months, newest first, or of one YYYY-MM
+    @abstractmethod
+    async def get_monthly_summaries(self, user_id, limit, month=None):
+        raise NotImplementedError
+
+    # Audit (see audit.py)
+
+    # Returns None if the account does not exist, else (balance, expected_balance)
+    @abstractmethod
+    async def audit_account(self, user_id):
+        raise NotImplementedError
+
+    # Returns (last_user_id, checked, mismatches)
+    @abstractmethod
+    async def audit_batch(self, after_user_id=None):
+        raise NotImplementedError
+
+
+# IDs of the ledger entries this process wrote, as sorted inclusive ranges.
+# The ledger writes the balances of its own transactions through to the
+# account cache, so the change feed (see feed.py) only needs to invalidate
+# accounts for entries written by other processes. Filled by the backend, on
+# its writer thread for SQLite, and read by the feed on the event loop.
+class OwnEntries:
+    def __init__(self):
+        self._ranges = []
+        self._lock = threading.Lock()
+
+    def add(self, low, high):
+        with self._lock:
+            insort(self._ranges, (low, high))
+
+    # IDs in any order; consecutive ones are kept as one range
+    def add_ids(self, ids):
+        low = high = None
+        for transaction_id in sorted(ids):
+            if high is not None and transaction_id == high + 1:
+                high = transaction_id
+                continue
+            if low is not None:
+                self.add(low, high)
+            low = high = transaction_id
+        if low is not None:
+            self.add(low, high)
+
+    def __contains__(self, transaction_id):
+        with self._lock:
+            i = bisect_right(self._ranges, (transaction_id, float('inf')))
+            return i > 0 and self._ranges[i - 1][1] >= transaction_id
+
+    # Drop the IDs up to and including up_to, once the feed is past them
+    def forget(self, up_to):
+        with self._lock:
+            self._ranges = [(max(low, up_to + 1), high) for low, high in self._ranges if high > up_to]
+
+
+# IDs of the debits that cannot be covered when each user's debits are taken
+# in order from what they have available, a {user_id: cents} dict. rows are
+# (id, user_id, amount) in the order they would be applied. A debit that is
+# refused takes nothing, so a later, smaller one may still go through.
+def uncovered_debits(rows, available):
+    remaining = dict(available)
+    refused = []
+    for row_id, user_id, amount in rows:
+        if amount <= remaining.get(user_id, 0):
+            remaining[user_id] -= amount
+        else:
+            refused.append(row_id)
+    return refused
+
+
+# The day (YYYY-MM-DD) after day
+def next_day(day):
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+# Build the backend selected by the environment:
+#   BANK_STORAGE=sqlite (default)  BANK_DB_PATH=bank.db  BANK_ARCHIVE_DIR=archive (next to the database)
+#   BANK_STORAGE=postgres          BANK_DATABASE_URL=postgresql://...  BANK_DB_POOL_SIZE=10
+def open_storage():
+    backend = os.getenv('BANK_STORAGE', 'sqlite').lower()
+    if backend == 'sqlite':
+        from db import Database
+        return Database(os.getenv('BANK_DB_PATH', 'bank.db'), archive_dir=os.getenv('BANK_ARCHIVE_DIR'))
+    if backend in ('postgres', 'postgresql'):
+        from pg import PostgresStorage
+        return PostgresStorage(os.getenv('BANK_DATABASE_URL'),
+                               max_size=int(os.getenv('BANK_DB_POOL_SIZE', '10')))
+    raise ValueError(f"Unknown BANK_STORAGE backend: {backend}")
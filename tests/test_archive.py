@@ -0,0 +1,30 @@
+import sqlite3
+
+from archive import select_chunk
+from migrations import migrate
+
+
+# The hourly archive job looks up old entries through the date index instead
+# of scanning the transactions table
+def test_select_chunk_uses_the_date_index():
+    conn = sqlite3.connect(':memory:')
+    try:
+        migrate(conn)
+        conn.executemany("INSERT INTO transactions (user_id, type, amount, date) VALUES (?, 'deposit', 100, ?)",
+                         [(user_id % 50, f"2024-{user_id % 12 + 1:02d}-01") for user_id in range(5000)])
+        conn.execute('''INSERT INTO balance_checkpoints (user_id, transaction_id, balance, created_at)
+                        SELECT DISTINCT user_id, 1000000, 0, '2024-12-31' FROM transactions''')
+        queries = []
+        conn.set_trace_callback(queries.append)
+        assert select_chunk(conn, '2024-01-01') == []
+        conn.set_trace_callback(None)
+
+        # The traced statement has its parameters filled in
+        plan = ' | '.join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {queries[-1]}"))
+        assert 'USING INDEX idx_transactions_date' in plan and 'SCAN t' not in plan
+
+        rows = select_chunk(conn, '2024-03-01', limit=10)
+        assert len(rows) == 10 and all(row[4] < '2024-03-01' for row in rows)
+        assert rows == sorted(rows, key=lambda row: (row[4], row[0]))
+    finally:
+        conn.close()
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import random
+from datetime import datetime
+
+import pytest
+
+import backup
+from backup import BackupService, change_log_enabled, enable_change_log, list_snapshots, restore
+from db import Database
+from ledger import InsufficientFunds, Ledger
+
+ACCOUNTS = 20
+OPENING_BALANCE = 10000
+
+
+async def open_bank(path):
+    db = Database(str(path))
+    await db.open()
+    ledger = Ledger(db)
+    for user_id in range(ACCOUNTS):
+        await db.create_account(user_id, f"user{user_id}", datetime.now().isoformat())
+        await ledger.set_balance(user_id, OPENING_BALANCE, 'adjustment')
+    return db, ledger
+
+
+# Random transfers until stop is set
+def start_transfers(ledger, stop, workers=4):
+    async def worker():
+        while not stop.is_set():
+            sender_id, recipient_id = random.sample(range(ACCOUNTS), 2)
+            try:
+                await ledger.transfer(sender_id, recipient_id, random.randint(1, 500))
+            except InsufficientFunds:
+                pass
+    return [asyncio.create_task(worker()) for _ in range(workers)]
+
+
+# (balances, entries, mismatches) of a database file
+async def inspect(path):
+    db = Database(str(path))
+    await db.open()
+    try:
+        balances = await db.fetchall("SELECT user_id, balance FROM accounts ORDER BY user_id")
+        entries = (await db.fetchone("SELECT COUNT(*) FROM transactions"))[0]
+        mismatches = []
+        after = None
+        while True:
+            after, _, batch = await db.audit_batch(after)
+            mismatches.extend(batch)
+            if after is None:
+                return balances, entries, mismatches
+    finally:
+        await db.close()
+
+
+def test_needs_sqlite():
+    pytest.importorskip('asyncpg')
+    from pg import PostgresStorage
+    with pytest.raises(ValueError):
+        BackupService(PostgresStorage('postgresql://localhost/bank'), 'backups')
+
+
+# ship() only takes the rows logged before it was called, so a steady stream
+# of writes cannot keep it from returning
+def test_ship_returns_under_sustained_writes(tmp_path):
+    async def main():
+        db, ledger = await open_bank(tmp_path / 'bank.db')
+        # Batches small enough that the writers log rows faster than they ship
+        service = BackupService(db, str(tmp_path / 'backups'), batch_size=10)
+        os.makedirs(backup._changes_dir(service.directory))
+        await db.write(enable_change_log, True)
+        stop = asyncio.Event()
+        workers = start_transfers(ledger, stop)
+        try:
+            await asyncio.sleep(0.1)
+            logged = await db.read(backup.change_position)
+            assert await asyncio.wait_for(service.ship(), 10) >= logged
+            assert await db.read(backup.change_position) > service._shipped
+        finally:
+            stop.set()
+            await asyncio.gather(*workers)
+            await db.close()
+    asyncio.run(main())
+
+
+def test_restore_while_transfers_run(tmp_path):
+    async def main():
+        db, ledger = await open_bank(tmp_path / 'bank.db')
+        directory = str(tmp_path / 'backups')
+        service = BackupService(db, directory, snapshot_interval=0.3, ship_interval=0.05, keep=20)
+        await service.start()
+        stop = asyncio.Event()
+        workers = start_transfers(ledger, stop)
+        try:
+            await asyncio.sleep(0.8)
+            middle = datetime.now().isoformat()
+            await asyncio.sleep(0.2)
+            # Restoring from the backups as they are being written
+            await asyncio.to_thread(restore, directory, str(tmp_path / 'during.db'))
+            await asyncio.sleep(0.5)
+        finally:
+            stop.set()
+            await asyncio.gather(*workers)
+        await service.close()
+        assert not await db.read(change_log_enabled)
+        assert await db.fetchone("SELECT COUNT(*) FROM change_log") == (0,)
+        final = await db.fetchall("SELECT user_id, balance FROM accounts ORDER BY user_id")
+        entries = (await db.fetchone("SELECT COUNT(*) FROM transactions"))[0]
+        await db.close()
+        assert len(list_snapshots(directory)) > 1
+
+        # Latest: exactly the state the bot left behind
+        restore(directory, str(tmp_path / 'latest.db'))
+        assert await inspect(tmp_path / 'latest.db') == (final, entries, [])
+
+        # Any earlier point: whole transactions only, so the books balance
+        restore(directory, str(tmp_path / 'middle.db'), middle)
+        for name in ('during.db', 'middle.db'):
+            balances, _, mismatches = await inspect(tmp_path / name)
+            assert mismatches == []
+            assert sum(balance for _, balance in balances) == ACCOUNTS * OPENING_BALANCE
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from batcher import BatcherClosed, WriteBatcher
+from db import Database
+from ledger import DuplicateOperation
+
+
+async def submit_burst(path):
+    db = Database(str(path))
+    await db.open()
+    batches = []
+
+    async def write_batch(rows):
+        batches.append(len(rows))
+        return await db.add_requests(rows)
+
+    batcher = WriteBatcher(write_batch, max_batch=50, max_delay=0.01)
+    try:
+        now = datetime.now().isoformat()
+        rows = [(user_id, 'deposit', user_id * 100, now, f"key-{user_id}") for user_id in range(1, 201)]
+        # The repeated key fails for its own caller only
+        rows.append((1, 'deposit', 100, now, 'key-1'))
+        results = await asyncio.gather(*(batcher.submit(row) for row in rows), return_exceptions=True)
+        stored = {request_id: await db.get_request(request_id) for request_id in results[:-1]}
+    finally:
+        await batcher.close()
+        await db.close()
+    return batches, results, stored
+
+
+def test_burst_is_grouped_and_every_caller_gets_its_own_row(tmp_path):
+    batches, results, stored = asyncio.run(submit_burst(tmp_path / 'bank.db'))
+
+    assert sum(batches) == 201
+    assert max(batches) == 50 and len(batches) < 10
+    assert len(set(results[:-1])) == 200
+    for user_id, request_id in enumerate(results[:-1], start=1):
+        assert stored[request_id][1:4] == (user_id, 'deposit', user_id * 100)
+    assert isinstance(results[-1], DuplicateOperation)
+    assert results[-1].result == results[0]
+
+
+async def close_mid_batch(path):
+    db = Database(str(path))
+    await db.open()
+    writing = asyncio.Event()
+    release = asyncio.Event()
+
+    async def write_batch(rows):
+        writing.set()
+        await release.wait()
+        return await db.add_requests(rows)
+
+    batcher = WriteBatcher(write_batch, max_batch=10, max_delay=0.01)
+    try:
+        now = datetime.now().isoformat()
+        rows = [(user_id, 'deposit', 100, now, None) for user_id in range(1, 26)]
+        callers = [asyncio.ensure_future(batcher.submit(row)) for row in rows]
+        # The first batch is being written, the rest are still queued
+        await writing.wait()
+        closing = asyncio.ensure_future(batcher.close())
+        await asyncio.sleep(0.01)
+        release.set()
+        await closing
+        results = await asyncio.wait_for(asyncio.gather(*callers), 1)
+        count = await db.fetchone("SELECT COUNT(*) FROM pending_requests")
+    finally:
+        await db.close()
+    return results, count[0]
+
+
+def test_close_writes_the_batch_in_flight_and_the_queue(tmp_path):
+    results, count = asyncio.run(close_mid_batch(tmp_path / 'bank.db'))
+
+    assert len(set(results)) == 25
+    assert count == 25
+
+
+# A row collected but still waiting out max_delay is written too, and the
+# batcher refuses rows once closed
+def test_close_writes_a_collected_batch(tmp_path):
+    async def main():
+        written = []
+
+        async def write_batch(rows):
+            written.extend(rows)
+            return list(range(len(rows)))
+
+        batcher = WriteBatcher(write_batch, max_delay=60)
+        caller = asyncio.ensure_future(batcher.submit('row'))
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(batcher.close(), 1)
+        result = await caller
+        with pytest.raises(BatcherClosed):
+            await batcher.submit('late')
+        return written, result
+
+    assert asyncio.run(main()) == (['row'], 0)
+
+
+# If the flush task dies mid-write, its callers get an error instead of hanging
+def test_cancelled_flush_fails_its_callers():
+    async def main():
+        async def write_batch(rows):
+            await asyncio.sleep(60)
+
+        batcher = WriteBatcher(write_batch, max_delay=0)
+        caller = asyncio.ensure_future(batcher.submit('row'))
+        await asyncio.sleep(0.01)
+        batcher._task.cancel()
+        with pytest.raises(BatcherClosed):
+            await asyncio.wait_for(caller, 1)
+
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime
+
+from cache import AccountCache
+from db import Database
+from ledger import Ledger
+
+
+async def exercise(path):
+    db = Database(str(path))
+    await db.open()
+    try:
+        now = datetime.now().isoformat()
+        for user_id in (1, 2, 3):
+            await db.create_account(user_id, f"user{user_id}", now)
+        cache = AccountCache(db, maxsize=2)
+        ledger = Ledger(db, cache=cache)
+        await ledger.set_balance(1, 500, 'adjustment')
+        await ledger.set_balance(2, 500, 'adjustment')
+
+        results = {}
+        first = await cache.get(1)
+        again = await cache.get(1)
+        results['same_record'] = first is again
+        await cache.get(2)
+        # Write-through: the cached records show what the transfer committed
+        await ledger.transfer(1, 2, 200)
+        results['after_transfer'] = ((await cache.get(1)).balance, (await cache.get(2)).balance)
+        results['stats_before_eviction'] = cache.stats()
+        # Bounded: loading a third account evicts the least recently used one
+        await cache.get(3)
+        results['cached'] = sorted(cache._records)
+        # A change made behind the cache's back shows after invalidate()
+        await db.execute("UPDATE accounts SET username='renamed' WHERE user_id=3")
+        results['stale'] = (await cache.get(3)).username
+        cache.invalidate(3)
+        results['fresh'] = (await cache.get(3)).username
+        results['missing'] = await cache.get(99)
+        return results
+    finally:
+        await db.close()
+
+
+def test_cache_write_through_bound_and_invalidation(tmp_path):
+    results = asyncio.run(exercise(tmp_path / 'bank.db'))
+
+    assert results['same_record']
+    assert results['after_transfer'] == (300, 700)
+    assert results['stats_before_eviction']['hits'] == 3
+    assert results['stats_before_eviction']['misses'] == 2
+    assert results['cached'] == [2, 3]
+    assert results['stale'] == 'user3'
+    assert results['fresh'] == 'renamed'
+    assert results['missing'] is None
@@ -0,0 +1,66 @@
+import asyncio
+
+from cache import AccountCache
+from feed import LedgerFeed
+from ledger import Ledger
+
+# Two bot processes sharing one database, each with its own storage object,
+# account cache, ledger and change feed. Runs once per backend in
+# conftest.BACKENDS.
+
+NOW = '2024-05-01T12:00:00'
+
+
+class Process:
+    def __init__(self, storage):
+        self.storage = storage
+        self.cache = AccountCache(storage)
+        self.ledger = Ledger(storage, cache=self.cache)
+        # Polled by hand below
+        self.feed = LedgerFeed(storage, self.cache, interval=3600)
+
+
+def test_feed_skips_own_entries(make_storage):
+    async def main():
+        first, second = Process(make_storage()), Process(make_storage())
+        await first.storage.open()
+        await second.storage.open()
+        try:
+            for user_id in (1, 2):
+                await first.storage.create_account(user_id, f"user{user_id}", NOW)
+            await first.ledger.set_balance(1, 1000, 'adjustment')
+            for process in (first, second):
+                await process.feed.start()
+                for user_id in (1, 2):
+                    await process.cache.get(user_id)
+
+            # The writer keeps its written-through records, the other process
+            # drops its stale ones and loads the new balance
+            await first.ledger.transfer(1, 2, 300)
+            await first.feed.poll()
+            await second.feed.poll()
+            assert first.cache.peek(1).balance == 700 and first.cache.peek(2).balance == 300
+            assert second.cache.peek(1) is None and second.cache.peek(2) is None
+            assert (await second.cache.get(1)).balance == 700
+
+            # And the other way round
+            await second.ledger.transfer(1, 2, 100)
+            await first.feed.poll()
+            await second.feed.poll()
+            assert first.cache.peek(1) is None
+            assert second.cache.peek(1).balance == 600
+            assert (await first.cache.get(1)).balance == 600
+
+            # A keyed transfer replayed by the other process is applied once
+            results = await asyncio.gather(first.ledger.transfer(1, 2, 50, 'interaction-1'),
+                                           second.ledger.transfer(1, 2, 50, 'interaction-1'))
+            assert sorted(results) == [False, True]
+            for process in (first, second):
+                await process.feed.poll()
+                assert (await process.cache.get(1)).balance == 550
+                assert (await process.cache.get(2)).balance == 450
+        finally:
+            for process in (first, second):
+                await process.feed.close()
+                await process.storage.close()
+    asyncio.run(main())
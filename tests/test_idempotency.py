@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+import idempotency
+from db import Database
+from idempotency import RecentOperations
+from ledger import DuplicateOperation, Ledger
+
+
+@pytest.fixture
+def clock(clock, monkeypatch):
+    monkeypatch.setattr(idempotency, 'time', clock)
+    return clock
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, value):
+        self.calls += 1
+        return value
+
+
+# A recent key is answered from memory with the first run's result, until it
+# expires after ttl seconds
+def test_replay_and_expiry(clock):
+    async def main():
+        operations = RecentOperations(ttl=60)
+        operation = Counter()
+        assert await operations.run('key', operation, 'first') == 'first'
+
+        clock.now += 59
+        with pytest.raises(DuplicateOperation) as replay:
+            await operations.run('key', operation, 'second')
+        assert replay.value.result == 'first'
+        assert operation.calls == 1
+
+        clock.now += 1
+        assert await operations.run('key', operation, 'third') == 'third'
+        assert operation.calls == 2
+
+        # A None key always runs
+        await operations.run(None, operation, 'x')
+        await operations.run(None, operation, 'x')
+        assert operation.calls == 4
+
+    asyncio.run(main())
+
+
+# The least recently used key is forgotten once maxsize is reached
+def test_maxsize(clock):
+    async def main():
+        operations = RecentOperations(maxsize=2)
+        operation = Counter()
+        for key in ('a', 'b', 'c'):
+            await operations.run(key, operation, key)
+        with pytest.raises(DuplicateOperation):
+            await operations.run('c', operation, 'c')
+        assert await operations.run('a', operation, 'again') == 'again'
+
+    asyncio.run(main())
+
+
+# A repeat that arrives while the first run is in progress waits for it
+# instead of starting a second one; a failed run is not remembered
+def test_repeat_waits_for_the_running_operation():
+    async def main():
+        operations = RecentOperations()
+        release = asyncio.Event()
+        calls = []
+
+        async def operation(value):
+            calls.append(value)
+            await release.wait()
+            return value
+
+        first = asyncio.ensure_future(operations.run('key', operation, 'first'))
+        second = asyncio.ensure_future(operations.run('key', operation, 'second'))
+        await asyncio.sleep(0)
+        release.set()
+        assert await first == 'first'
+        with pytest.raises(DuplicateOperation) as replay:
+            await second
+        assert replay.value.result == 'first'
+        assert calls == ['first']
+
+        async def failing():
+            raise ValueError("boom")
+
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await operations.run('failing', failing)
+
+    asyncio.run(main())
+
+
+# Replays through the ledger are applied once: the first from memory, and one
+# the front no longer remembers by the key stored with the transfer
+def test_ledger_transfer_replay(tmp_path, clock):
+    async def main():
+        db = Database(str(tmp_path / 'bank.db'))
+        await db.open()
+        try:
+            for user_id in (1, 2):
+                await db.create_account(user_id, f"user{user_id}", '2024-05-01T12:00:00')
+            ledger = Ledger(db, operations=RecentOperations(ttl=60))
+            await ledger.set_balance(1, 1000, 'adjustment')
+
+            assert await ledger.transfer(1, 2, 100, 'transfer:1')
+            assert not await ledger.transfer(1, 2, 100, 'transfer:1')
+            clock.now += 60
+            assert not await ledger.transfer(1, 2, 100, 'transfer:1')
+            return (await db.get_account(1))[2], (await db.get_account(2))[2]
+        finally:
+            await db.close()
+
+    assert asyncio.run(main()) == (900, 100)
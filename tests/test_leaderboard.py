@@ -0,0 +1,68 @@
+import asyncio
+
+from leaderboard import Leaderboard
+
+
+# Balances kept in a dict, standing in for the balance index
+class FakeStorage:
+    def __init__(self, balances):
+        self.balances = dict(balances)
+        self.loads = 0
+
+    async def get_top_balances(self, limit):
+        self.loads += 1
+        ranked = sorted(((user_id, balance) for user_id, balance in self.balances.items() if balance > 0),
+                        key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+
+# Commit a balance and write it through, as the Ledger does
+def write(db, leaderboard, user_id, balance):
+    db.balances[user_id] = balance
+    leaderboard.set_balance(user_id, balance)
+
+
+def test_write_through_keeps_the_top_current():
+    async def main():
+        db = FakeStorage({1: 500, 2: 400, 3: 300, 4: 200, 5: 100})
+        # Holds three accounts, so everyone else has at most 300
+        leaderboard = Leaderboard(db, size=2, spare=1, refresh=3600)
+        assert await leaderboard.top() == [(1, 500), (2, 400)]
+        assert db.loads == 1
+
+        # Dropping to the bound or below leaves the list: account 4 (200) is
+        # not held and could now be richer
+        write(db, leaderboard, 1, 250)
+        assert await leaderboard.top() == [(2, 400), (3, 300)]
+
+        # An account not held enters once its balance is above the bound
+        write(db, leaderboard, 5, 450)
+        assert await leaderboard.top() == [(5, 450), (2, 400)]
+        # Over capacity the lowest held entry is dropped
+        write(db, leaderboard, 4, 600)
+        assert await leaderboard.top() == [(4, 600), (5, 450)]
+        assert db.loads == 1
+
+        # Fewer than size entries left: reloaded from storage
+        write(db, leaderboard, 4, 100)
+        write(db, leaderboard, 5, 100)
+        assert await leaderboard.top() == [(2, 400), (3, 300)]
+        assert db.loads == 2
+
+    asyncio.run(main())
+
+
+# When storage has fewer positive balances than capacity, every one of them is
+# held, so nothing is reloaded however few are left
+def test_small_bank_is_not_reloaded():
+    async def main():
+        db = FakeStorage({1: 100, 2: 0})
+        leaderboard = Leaderboard(db, size=2, spare=1, refresh=3600)
+        assert await leaderboard.top() == [(1, 100)]
+        write(db, leaderboard, 2, 50)
+        assert await leaderboard.top() == [(1, 100), (2, 50)]
+        write(db, leaderboard, 1, 0)
+        assert await leaderboard.top() == [(2, 50)]
+        assert db.loads == 1
+
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+import asyncio
+import random
+from datetime import datetime
+
+from cache import AccountCache
+from db import Database
+from ledger import InsufficientFunds, Ledger
+
+# Thousands of concurrent transfers between a few accounts, so that most of
+# them contend for the same rows, through two Database objects on one file
+# (two bot processes). Money must be conserved, no balance may go negative and
+# every balance must reconcile with the ledger.
+
+ACCOUNTS = 20
+INITIAL_BALANCE = 10000
+TRANSFERS = 4000
+
+
+async def create_accounts(db):
+    now = datetime.now().isoformat()
+    ledger = Ledger(db)
+    for user_id in range(1, ACCOUNTS + 1):
+        await db.create_account(user_id, f"user{user_id}", now)
+        await ledger.set_balance(user_id, INITIAL_BALANCE, 'adjustment')
+
+
+async def audit_all(db):
+    mismatches = []
+    after = None
+    while True:
+        after, _, batch = await db.audit_batch(after)
+        mismatches.extend(batch)
+        if after is None:
+            return mismatches
+
+
+async def stress(path):
+    first, second = Database(str(path)), Database(str(path))
+    await first.open()
+    await second.open()
+    try:
+        await create_accounts(first)
+        caches = [AccountCache(first), AccountCache(second)]
+        ledgers = [Ledger(first, cache=caches[0], retries=50, backoff=0.001),
+                   Ledger(second, cache=caches[1], retries=50, backoff=0.001)]
+        rng = random.Random(1)
+        outcomes = {'applied': 0, 'insufficient': 0}
+
+        async def transfer(ledger, sender_id, recipient_id, amount):
+            try:
+                await ledger.transfer(sender_id, recipient_id, amount)
+                outcomes['applied'] += 1
+            except InsufficientFunds:
+                outcomes['insufficient'] += 1
+
+        jobs = []
+        for _ in range(TRANSFERS):
+            sender_id, recipient_id = rng.sample(range(1, ACCOUNTS + 1), 2)
+            # Amounts up to the whole starting balance drain accounts often
+            jobs.append(transfer(rng.choice(ledgers), sender_id, recipient_id, rng.randint(1, INITIAL_BALANCE)))
+        await asyncio.gather(*jobs)
+
+        balances = await first.fetchall("SELECT user_id, balance FROM accounts")
+        return outcomes, balances, await audit_all(first)
+    finally:
+        await first.close()
+        await second.close()
+
+
+def test_concurrent_transfers_conserve_money(tmp_path):
+    outcomes, balances, mismatches = asyncio.run(stress(tmp_path / 'bank.db'))
+
+    assert outcomes['applied'] + outcomes['insufficient'] == TRANSFERS
+    assert outcomes['applied'] > 0 and outcomes['insufficient'] > 0
+    assert sum(balance for _, balance in balances) == ACCOUNTS * INITIAL_BALANCE
+    assert min(balance for _, balance in balances) >= 0
+    assert mismatches == []
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+import limits
+from limits import RateLimiter, WriteGate, parse_command_limits, parse_limit
+
+
+@pytest.fixture
+def clock(clock, monkeypatch):
+    monkeypatch.setattr(limits, 'time', clock)
+    return clock
+
+
+def test_parse_limit():
+    assert parse_limit('5/60') == (5 / 60, 5)
+    assert parse_limit('10') == (10, 10)
+    assert parse_limit('off') is None
+    assert parse_limit('') is None
+    assert parse_command_limits('transfer=5/60, deposit=off') == {'transfer': (5 / 60, 5), 'deposit': None}
+
+
+# A burst of 3 refilled at one token every 2 seconds
+def test_burst_then_refill(clock):
+    limiter = RateLimiter(user=parse_limit('3/6'))
+    for _ in range(3):
+        assert limiter.acquire(1, None, 'deposit') == (None, 0.0)
+    scope, retry_after = limiter.acquire(1, None, 'deposit')
+    assert scope == 'user' and retry_after == pytest.approx(2)
+
+    # Other users have buckets of their own
+    assert limiter.acquire(2, None, 'deposit') == (None, 0.0)
+
+    clock.now += 1
+    scope, retry_after = limiter.acquire(1, None, 'deposit')
+    assert scope == 'user' and retry_after == pytest.approx(1)
+    clock.now += 1
+    assert limiter.acquire(1, None, 'deposit') == (None, 0.0)
+    assert limiter.acquire(1, None, 'deposit')[0] == 'user'
+
+    # A long pause refills up to the burst, not beyond it
+    clock.now += 600
+    for _ in range(3):
+        assert limiter.acquire(1, None, 'deposit') == (None, 0.0)
+    assert limiter.acquire(1, None, 'deposit')[0] == 'user'
+
+
+# A refused invocation takes no token from any bucket
+def test_first_empty_bucket_refuses(clock):
+    limiter = RateLimiter(user=parse_limit('10/10'), commands={'transfer': parse_limit('1/10')},
+                          guild=parse_limit('3/10'))
+    assert limiter.acquire(1, 7, 'transfer') == (None, 0.0)
+    assert limiter.acquire(1, 7, 'transfer')[0] == 'command'
+    assert limiter.acquire(1, 7, 'deposit') == (None, 0.0)
+    assert limiter.acquire(2, 7, 'deposit') == (None, 0.0)
+    scope, retry_after = limiter.acquire(3, 7, 'deposit')
+    assert scope == 'guild' and retry_after == pytest.approx(10 / 3)
+    # Commands outside a guild skip the guild bucket
+    assert limiter.acquire(3, None, 'deposit') == (None, 0.0)
+
+
+def test_global_limit(clock):
+    limiter = RateLimiter(global_limit=parse_limit('2/1'))
+    assert limiter.acquire(1, None, 'balance') == (None, 0.0)
+    assert limiter.acquire(2, None, 'balance') == (None, 0.0)
+    assert limiter.acquire(3, None, 'balance')[0] == 'global'
+    clock.now += 0.5
+    assert limiter.acquire(3, None, 'balance') == (None, 0.0)
+
+
+# Saved buckets come back after a restart, refilled for the downtime
+# (the fake clock moves time() and monotonic() together)
+def test_state_survives_restart(tmp_path, clock):
+    path = str(tmp_path / 'limits.json')
+    limiter = RateLimiter(user=parse_limit('2/10'), state_path=path)
+    limiter.acquire(1, None, 'deposit')
+    limiter.acquire(1, None, 'deposit')
+    limiter.close()
+
+    restarted = RateLimiter(user=parse_limit('2/10'), state_path=path)
+    restarted.open()
+    assert restarted.acquire(1, None, 'deposit')[0] == 'user'
+    clock.now += 5
+    restarted = RateLimiter(user=parse_limit('2/10'), state_path=path)
+    restarted.open()
+    assert restarted.acquire(1, None, 'deposit') == (None, 0.0)
+    assert restarted.acquire(1, None, 'deposit')[0] == 'user'
+
+
+def test_write_gate_opens_and_closes():
+    async def main():
+        gate = WriteGate(limit=2, max_waiting=1, timeout=0.05)
+        assert await gate.enter() and await gate.enter()
+        assert gate.active == 2
+
+        # Full: one command may wait, and times out if no slot frees up
+        assert not await gate.enter()
+        assert gate.waiting == 0
+
+        # A waiting command gets the slot that is given back
+        waiter = asyncio.ensure_future(gate.enter())
+        await asyncio.sleep(0)
+        assert gate.waiting == 1
+        # Beyond max_waiting the command is shed at once
+        assert not await gate.enter()
+        gate.leave()
+        assert await waiter
+        assert gate.active == 2 and gate.waiting == 0
+
+        # Once the slots are free, commands are admitted without waiting again
+        gate.leave()
+        gate.leave()
+        assert gate.active == 0
+        assert await gate.enter()
+        gate.leave()
+
+    asyncio.run(main())
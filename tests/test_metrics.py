@@ -0,0 +1,96 @@
+import asyncio
+
+from db import Database
+from ledger import InsufficientFunds, Ledger
+from metrics import BUCKETS, Histogram, InstrumentedStorage, Metrics, MetricsServer
+
+NOW = '2024-05-01T12:00:00'
+
+
+def test_histogram_quantiles():
+    histogram = Histogram()
+    for _ in range(90):
+        histogram.observe(0.001)
+    for _ in range(10):
+        histogram.observe(1.0)
+    assert histogram.count == 100
+    assert abs(histogram.sum - 10.09) < 1e-9
+    # Estimates stay inside the bucket holding the true value, which is at
+    # most sqrt(2) wide
+    assert 2 ** -0.5 < histogram.quantile(0.5) / 0.001 < 2 ** 0.5
+    assert 2 ** -0.5 < histogram.quantile(0.99) / 1.0 < 2 ** 0.5
+    histogram.observe(10 ** 6)
+    assert histogram.counts[-1] == 1
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_counters_render():
+    metrics = Metrics()
+    metrics.describe('commands_shed_total', "Commands refused")
+    metrics.increment('commands_shed_total', command='transfer', reason='user')
+    metrics.increment('commands_shed_total', command='transfer', reason='user')
+    metrics.increment('commands_shed_total', command='deposit', reason='busy')
+    assert metrics.counter('commands_shed_total') == {
+        (('command', 'transfer'), ('reason', 'user')): 2,
+        (('command', 'deposit'), ('reason', 'busy')): 1,
+    }
+    text = metrics.render()
+    assert '# TYPE commands_shed_total counter' in text
+    assert 'commands_shed_total{command="transfer",reason="user"} 2' in text
+
+
+# Every ledger operation is timed into storage_seconds under the storage method
+# it ran, successful or not
+def test_ledger_operations_are_timed(tmp_path):
+    async def main():
+        metrics = Metrics()
+        db = InstrumentedStorage(Database(str(tmp_path / 'bank.db')), metrics)
+        await db.open()
+        try:
+            for user_id in (1, 2):
+                await db.create_account(user_id, f"user{user_id}", NOW)
+            ledger = Ledger(db)
+            await ledger.set_balance(1, 1000, 'adjustment')
+            await ledger.transfer(1, 2, 300)
+            await ledger.transfer(1, 2, 200)
+            try:
+                await ledger.transfer(2, 1, 10 ** 6)
+            except InsufficientFunds:
+                pass
+        finally:
+            await db.close()
+        return metrics
+
+    metrics = asyncio.run(main())
+    counts = {labels['operation']: histogram.count for labels, histogram in metrics.series('storage_seconds')}
+    assert counts['transfer'] == 3
+    assert counts['set_balance'] == 1
+    assert counts['create_account'] == 2
+    text = metrics.render()
+    assert 'storage_seconds_count{operation="transfer"} 3' in text
+    assert f'storage_seconds_bucket{{operation="transfer",le="{BUCKETS[0]:.6g}"}}' in text
+    assert 'storage_seconds_bucket{operation="transfer",le="+Inf"} 3' in text
+
+
+def test_metrics_endpoint():
+    async def main():
+        metrics = Metrics()
+        metrics.observe('command_seconds', 0.01, command='balance', status='ok')
+        server = MetricsServer(metrics, port=0)
+        await server.start()
+        try:
+            port = server._server.sockets[0].getsockname()[1]
+            responses = []
+            for path in (b'/metrics', b'/other'):
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(b'GET ' + path + b' HTTP/1.1\r\nHost: localhost\r\n\r\n')
+                responses.append(await reader.read())
+                writer.close()
+        finally:
+            await server.close()
+        return responses
+
+    found, missing = asyncio.run(main())
+    assert found.startswith(b'HTTP/1.1 200 OK')
+    assert b'command_seconds_count{command="balance",status="ok"} 1' in found
+    assert missing.startswith(b'HTTP/1.1 404')
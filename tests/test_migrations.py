@@ -0,0 +1,83 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from ledger import LOCKED, AccountUnavailable
+
+# Upgrading a bank that still has balance=-1 locks. Alice is an ordinary
+# account; Bob was locked by the first version (-1.0, no ledger entry, so
+# -100 cents after migration 3); Carol by a later one (-1 cent and a 'lock'
+# entry taking her 40.00 balance). Dave and Erin hold the same balances as
+# Bob and Carol, but set by an admin's adjustment, and are not locks.
+ACCOUNTS = [(1, 'alice', 2550), (2, 'bob', -100), (3, 'carol', -1), (4, 'dave', -100), (5, 'erin', -1)]
+ENTRIES = [(1, 'deposit', 2550), (2, 'deposit', 4000), (3, 'deposit', 4000), (3, 'lock', -4001),
+           (4, 'deposit', 500), (4, 'adjustment', -600), (5, 'adjustment', -1)]
+DATE = '2024-01-01T00:00:00'
+
+
+# bank.db as the first version created it: money as REAL dollars, no schema
+# version
+def baseline_sqlite(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE accounts (user_id INTEGER PRIMARY KEY, username TEXT, balance REAL, created_at TEXT)")
+    conn.execute('''CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, type TEXT,
+                                               amount REAL, date TEXT)''')
+    conn.execute('''CREATE TABLE pending_requests (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, type TEXT,
+                                                   amount REAL, status TEXT, date TEXT)''')
+    conn.executemany("INSERT INTO accounts VALUES (?, ?, ?, ?)",
+                     [(user_id, name, cents / 100, DATE) for user_id, name, cents in ACCOUNTS])
+    conn.executemany("INSERT INTO transactions (user_id, type, amount, date) VALUES (?, ?, ?, ?)",
+                     [(user_id, entry_type, cents / 100, DATE) for user_id, entry_type, cents in ENTRIES])
+    conn.commit()
+    conn.close()
+
+
+# A PostgreSQL schema at version 4, holding a bank imported from an upgraded
+# bank.db along with its balance checkpoints
+async def version_4_postgres(dsn):
+    import asyncpg
+    from pg import PG_MIGRATIONS
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute("CREATE TABLE schema_migrations (version INTEGER PRIMARY KEY)")
+        for version, statements in enumerate(PG_MIGRATIONS[:4], start=1):
+            for statement in statements:
+                await conn.execute(statement)
+            await conn.execute("INSERT INTO schema_migrations (version) VALUES ($1)", version)
+        await conn.executemany("INSERT INTO accounts VALUES ($1, $2, $3, $4)",
+                               [(user_id, name, cents, DATE) for user_id, name, cents in ACCOUNTS])
+        await conn.executemany("INSERT INTO transactions (user_id, type, amount, date) VALUES ($1, $2, $3, $4)",
+                               [(user_id, entry_type, cents, DATE) for user_id, entry_type, cents in ENTRIES])
+        await conn.execute('''INSERT INTO balance_checkpoints (user_id, transaction_id, balance, created_at)
+                              SELECT user_id, (SELECT MAX(id) FROM transactions), balance, $1 FROM accounts''', DATE)
+    finally:
+        await conn.close()
+
+
+def test_balance_locks_become_status(make_storage):
+    async def main():
+        storage = make_storage()
+        if hasattr(storage, 'dsn'):
+            await version_4_postgres(storage.dsn)
+        else:
+            baseline_sqlite(storage.path)
+        await storage.open()
+        try:
+            alice, bob, carol, dave, erin = [await storage.get_account(user_id) for user_id, _, _ in ACCOUNTS]
+            assert alice[2] == 2550 and alice[4] != LOCKED
+            assert dave[2] == -100 and dave[4] != LOCKED
+            assert erin[2] == -1 and erin[4] != LOCKED
+            # Bob's old balance was overwritten by the lock, Carol's is given back
+            assert bob[2] == 0 and bob[4] == LOCKED
+            assert carol[2] == 4000 and carol[4] == LOCKED
+            rows, _ = await storage.get_transactions_page(2, 10)
+            assert [(row[2], row[3]) for row in rows] == [('lock reversal', 100), ('deposit', 4000)]
+            assert await storage.audit_batch() == (None, 5, [])
+
+            for sender_id, recipient_id in ((1, 2), (2, 1), (3, 1)):
+                with pytest.raises(AccountUnavailable):
+                    await storage.transfer(sender_id, recipient_id, 100)
+        finally:
+            await storage.close()
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+import sqlite3
+
+from migrations import migrate
+from money import MAX_AMOUNT, format_amount, parse_amount, parse_rate
+
+
+def test_parse_amount():
+    assert parse_amount(0.1) == 10
+    assert parse_amount(19.99) == 1999
+    assert parse_amount('1234.5') == 123450
+    assert parse_amount(100) == 10000
+    assert parse_amount(0.001) is None
+    assert parse_amount('abc') is None
+    assert parse_amount(float('inf')) is None
+    assert parse_amount(float('nan')) is None
+
+
+def test_parse_amount_limit():
+    assert parse_amount('10000000000.00') == MAX_AMOUNT
+    assert parse_amount('-10000000000') == -MAX_AMOUNT
+    assert parse_amount('10000000000.01') is None
+    assert parse_amount(1e20) is None
+    assert parse_amount(-1e20) is None
+    # A whole bank of maximal balances still sums inside a 64-bit integer
+    assert MAX_AMOUNT * 1_000_000 < 2 ** 63
+
+
+def test_parse_rate():
+    assert parse_rate('0.0001') == 100
+    assert parse_rate('0.00028') == 280
+    assert parse_rate('0') == 0
+    assert parse_rate('0.0000001') is None
+    assert parse_rate('-0.01') is None
+    assert parse_rate('abc') is None
+
+
+def test_format_amount():
+    assert format_amount(0) == "0.00"
+    assert format_amount(5) == "0.05"
+    assert format_amount(123456) == "1234.56"
+    assert format_amount(-150) == "-1.50"
+
+
+# Ten deposits of 0.1 leave a REAL balance of 0.9999999999999999; the upgrade
+# stores it and the entries as exact cents
+def test_real_money_converts_to_cents(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'bank.db')
+    try:
+        conn.execute("CREATE TABLE accounts (user_id INTEGER PRIMARY KEY, username TEXT, balance REAL, created_at TEXT)")
+        conn.execute('''CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, type TEXT,
+                                                   amount REAL, date TEXT)''')
+        balance = 0.0
+        for _ in range(10):
+            balance += 0.1
+            conn.execute("INSERT INTO transactions (user_id, type, amount, date) VALUES (1, 'deposit', 0.1, '2024-01-01')")
+        assert balance != 1.0
+        conn.execute("INSERT INTO accounts VALUES (1, 'user1', ?, '2024-01-01')", (balance,))
+        conn.commit()
+
+        migrate(conn)
+        assert conn.execute("SELECT balance, typeof(balance) FROM accounts").fetchone() == (100, 'integer')
+        assert conn.execute("SELECT SUM(amount), typeof(SUM(amount)) FROM transactions").fetchone() == (100, 'integer')
+    finally:
+        conn.close()
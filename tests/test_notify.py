@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('discord')
+
+from notify import Notifier
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.embeds = []
+
+    async def send(self, embed=None):
+        await asyncio.sleep(0.01)
+        self.embeds.append(embed)
+
+
+class FakeBot:
+    def __init__(self, users):
+        self.users = users
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+
+
+async def notify_and_close():
+    users = {1: FakeUser(1), 2: FakeUser(2)}
+    # A window far longer than the test: only close() can send these
+    notifier = Notifier(FakeBot(users), coalesce_window=60.0)
+    for i in range(3):
+        notifier.notify(1, f"Notice {i}", "Something happened.", 0)
+    notifier.notify(users[2], "Hello", "Just one.", 0)
+    start = time.perf_counter()
+    await notifier.close()
+    return users, time.perf_counter() - start, notifier
+
+
+def test_close_sends_pending_notices_at_once():
+    users, elapsed, notifier = asyncio.run(notify_and_close())
+
+    assert elapsed < 5
+    assert [embed.title for embed in users[1].embeds] == ["Notifications"]
+    assert len(users[1].embeds[0].fields) == 3
+    assert [embed.title for embed in users[2].embeds] == ["Hello"]
+    assert notifier._tasks == [] and notifier._pending == {}
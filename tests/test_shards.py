@@ -0,0 +1,260 @@
+import asyncio
+import multiprocessing
+import os
+import traceback
+
+import pytest
+
+# Bot processes that share one database, each run as a real OS process and
+# driven from the test over a pipe. The first test runs the storage, account
+# cache, ledger and change feed of two processes; the second starts bank.py
+# itself twice as the two halves of a sharded deployment (SHARD_COUNT=2 with
+# SHARD_IDS=0 and SHARD_IDS=1). The gateway is stubbed: each bot runs its
+# setup_hook without logging in, and the slash command callbacks are called
+# with the fake interactions from loadtest.py. Both use SQLite, the one backend
+# several processes can share here without a server.
+
+NOW = '2024-05-01T12:00:00'
+
+
+# Child side: run handler's methods as the parent asks for them, until 'stop'
+def serve(conn, make_handler):
+    async def main():
+        loop = asyncio.get_running_loop()
+        handler = await make_handler()
+        while True:
+            name, args = await loop.run_in_executor(None, conn.recv)
+            try:
+                conn.send(('ok', await getattr(handler, name)(*args)))
+            except Exception:
+                conn.send(('error', traceback.format_exc()))
+            if name == 'stop':
+                return
+    asyncio.run(main())
+
+
+class Worker:
+    def __init__(self, target, *args):
+        context = multiprocessing.get_context('spawn')
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=target, args=(child, *args), daemon=True)
+        self.process.start()
+
+    def send(self, name, *args):
+        self.conn.send((name, args))
+
+    def receive(self, timeout=30):
+        if not self.conn.poll(timeout):
+            raise AssertionError("worker process did not answer")
+        status, value = self.conn.recv()
+        if status == 'error':
+            raise AssertionError(f"worker process failed:\n{value}")
+        return value
+
+    def call(self, name, *args):
+        self.send(name, *args)
+        return self.receive()
+
+    def stop(self):
+        if self.process.is_alive():
+            try:
+                self.call('stop')
+            finally:
+                self.process.join(10)
+                if self.process.is_alive():
+                    self.process.kill()
+
+
+# Send the same call to every worker at once and collect the answers
+def call_all(workers, name, *args):
+    for worker in workers:
+        worker.send(name, *args)
+    return [worker.receive() for worker in workers]
+
+
+class LedgerProcess:
+    def __init__(self, path):
+        from cache import AccountCache
+        from db import Database
+        from feed import LedgerFeed
+        from ledger import Ledger
+        self.storage = Database(path)
+        self.cache = AccountCache(self.storage)
+        self.ledger = Ledger(self.storage, cache=self.cache)
+        # Polled by the test
+        self.feed = LedgerFeed(self.storage, self.cache, interval=3600)
+
+    async def start(self):
+        await self.storage.open()
+        await self.feed.start()
+        return self
+
+    async def create_account(self, user_id, balance):
+        await self.storage.create_account(user_id, f"user{user_id}", NOW)
+        if balance:
+            await self.ledger.set_balance(user_id, balance, 'adjustment')
+
+    async def transfer(self, sender_id, recipient_id, amount, key=None):
+        return await self.ledger.transfer(sender_id, recipient_id, amount, key)
+
+    async def poll(self):
+        await self.feed.poll()
+
+    async def cached_balance(self, user_id):
+        record = self.cache.peek(user_id)
+        return record.balance if record is not None else None
+
+    async def balance(self, user_id):
+        return (await self.cache.get(user_id)).balance
+
+    async def stop(self):
+        await self.feed.close()
+        await self.storage.close()
+
+
+def run_ledger_process(conn, path):
+    serve(conn, lambda: LedgerProcess(path).start())
+
+
+def test_feed_across_processes(tmp_path):
+    path = str(tmp_path / 'bank.db')
+    first = Worker(run_ledger_process, path)
+    try:
+        first.call('create_account', 1, 1000)
+        first.call('create_account', 2, 0)
+        second = Worker(run_ledger_process, path)
+        try:
+            workers = [first, second]
+            for user_id in (1, 2):
+                assert call_all(workers, 'balance', user_id) == [1000 if user_id == 1 else 0] * 2
+
+            # The writer keeps its written-through records, the other process
+            # drops its stale ones and loads the new balance
+            assert first.call('transfer', 1, 2, 300)
+            call_all(workers, 'poll')
+            assert first.call('cached_balance', 1) == 700
+            assert second.call('cached_balance', 1) is None and second.call('cached_balance', 2) is None
+            assert second.call('balance', 1) == 700
+
+            # And the other way round
+            assert second.call('transfer', 1, 2, 100)
+            call_all(workers, 'poll')
+            assert first.call('cached_balance', 1) is None
+            assert second.call('cached_balance', 1) == 600
+            assert first.call('balance', 1) == 600
+
+            # The same keyed transfer arriving at both processes is applied once
+            assert sorted(call_all(workers, 'transfer', 1, 2, 50, 'interaction-1')) == [False, True]
+            call_all(workers, 'poll')
+            assert call_all(workers, 'balance', 1) == [550, 550]
+            assert call_all(workers, 'balance', 2) == [450, 450]
+        finally:
+            second.stop()
+    finally:
+        first.stop()
+
+
+class BotProcess:
+    async def start(self):
+        import bank
+        from loadtest import FakeInteraction, FakeUser
+        self.bank = bank
+        self.FakeInteraction = FakeInteraction
+        self.FakeUser = FakeUser
+        self.users = {}
+        self.synced = False
+
+        # No gateway: nothing is logged in, Discord's REST calls are stubs
+        async def sync(*args, **kwargs):
+            self.synced = True
+            return []
+        bank.bot.tree.sync = sync
+        bank.bot.get_user = lambda user_id: None
+
+        async def fetch_user(user_id):
+            return self.user(user_id)
+        bank.bot.fetch_user = fetch_user
+
+        await bank.bot.setup_hook()
+        return self
+
+    def user(self, user_id):
+        if user_id not in self.users:
+            self.users[user_id] = self.FakeUser(user_id, 0)
+        return self.users[user_id]
+
+    async def info(self):
+        return {'shard_ids': self.bank.bot.shard_ids, 'primary': self.bank.bot.is_primary, 'synced': self.synced}
+
+    # Run a slash command as if the gateway had delivered interaction_id to this shard
+    async def command(self, name, user_id, interaction_id, *args):
+        interaction = self.FakeInteraction(self.user(user_id), 0)
+        interaction.id = interaction_id
+        await self.bank.bot.tree.get_command(name).callback(interaction, *args)
+        return [embed.title for embed in interaction.response.embeds]
+
+    async def set_balance(self, user_id, balance):
+        await self.bank.ledger.set_balance(user_id, balance, 'adjustment')
+
+    async def poll(self):
+        await self.bank.feed.poll()
+
+    async def cached_balance(self, user_id):
+        record = self.bank.accounts.peek(user_id)
+        return record.balance if record is not None else None
+
+    async def balance(self, user_id):
+        return (await self.bank.accounts.get(user_id)).balance
+
+    async def stop(self):
+        bank = self.bank
+        for task in (bank.checkpoint_balances, bank.expire_operations, bank.archive_transactions,
+                     bank.run_scheduled_jobs):
+            task.cancel()
+        await bank.stop_services()
+
+
+def run_bot_process(conn, env):
+    # bank.py reads its settings at import time
+    os.environ.update(env)
+    for name in ('METRICS_PORT', 'BACKUP_DIR', 'RATE_LIMIT_STATE', 'ARCHIVE_AFTER_DAYS'):
+        os.environ.pop(name, None)
+    serve(conn, lambda: BotProcess().start())
+
+
+def test_sharded_bot_processes(tmp_path):
+    pytest.importorskip('discord')
+    env = {'BANK_STORAGE': 'sqlite', 'BANK_DB_PATH': str(tmp_path / 'bank.db'),
+           'COMMAND_SYNC_STATE': str(tmp_path / 'command_tree.sha256'), 'SHARD_COUNT': '2'}
+    # Shard 0 starts first, so it is the one that creates the schema
+    first = Worker(run_bot_process, dict(env, SHARD_IDS='0'))
+    try:
+        assert first.call('info') == {'shard_ids': [0], 'primary': True, 'synced': True}
+        second = Worker(run_bot_process, dict(env, SHARD_IDS='1'))
+        try:
+            workers = [first, second]
+            # Only the process that owns shard 0 syncs the command tree
+            assert second.call('info') == {'shard_ids': [1], 'primary': False, 'synced': False}
+
+            assert first.call('command', 'register', 101, 1) == ['Account Registered']
+            assert second.call('command', 'register', 102, 2) == ['Account Registered']
+            first.call('set_balance', 101, 1000)
+            call_all(workers, 'poll')
+            assert call_all(workers, 'balance', 101) == [1000, 1000]
+
+            # A transfer served by one shard invalidates the other's cache
+            assert first.call('command', 'transfer', 101, 3, 102, 3.0) == ['Transfer Completed']
+            second.call('poll')
+            assert second.call('cached_balance', 101) is None
+            assert second.call('balance', 101) == 700
+
+            # One interaction delivered to both shards moves the money once
+            results = call_all(workers, 'command', 'transfer', 101, 4, 102, 0.5)
+            assert results == [['Transfer Completed']] * 2
+            call_all(workers, 'poll')
+            assert call_all(workers, 'balance', 101) == [650, 650]
+            assert call_all(workers, 'balance', 102) == [350, 350]
+        finally:
+            second.stop()
+    finally:
+        first.stop()
@@ -0,0 +1,353 @@
+import inspect
+from datetime import datetime, timedelta
+
+import pytest
+
+from ledger import (AccountNotFound, AccountUnavailable, DuplicateOperation, InsufficientFunds, RequestNotFound,
+                    ACTIVE, FROZEN, LOCKED)
+from storage import Storage
+
+# The behaviour every Storage backend must share (see storage.py). Each test
+# runs once per backend in conftest.BACKENDS.
+
+NOW = '2024-05-01T12:00:00'
+
+
+async def open_accounts(storage, balances):
+    for user_id, balance in balances.items():
+        assert await storage.create_account(user_id, f"user{user_id}", NOW)
+        if balance:
+            await storage.set_balance(user_id, balance, 'adjustment')
+
+
+async def balance_of(storage, user_id):
+    return (await storage.get_account(user_id))[2]
+
+
+async def audit_all(storage):
+    mismatches = []
+    after = None
+    while True:
+        after, _, batch = await storage.audit_batch(after)
+        mismatches.extend(batch)
+        if after is None:
+            return mismatches
+
+
+def test_accounts(with_storage):
+    async def scenario(storage):
+        assert await storage.create_account(1, 'alice', NOW)
+        assert not await storage.create_account(1, 'someone else', NOW)
+        assert await storage.get_account(1) == (1, 'alice', 0, NOW, ACTIVE, None, None)
+        assert await storage.get_account(2) is None
+    with_storage(scenario)
+
+
+def test_transfer(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 1000, 2: 0})
+        assert await storage.transfer(1, 2, 300) == [(1, 700), (2, 300)]
+        with pytest.raises(InsufficientFunds):
+            await storage.transfer(1, 2, 701)
+        with pytest.raises(AccountNotFound):
+            await storage.transfer(1, 3, 100)
+        assert await storage.transfer(1, 2, 100, 'key-1') == [(1, 600), (2, 400)]
+        with pytest.raises(DuplicateOperation):
+            await storage.transfer(1, 2, 100, 'key-1')
+        assert (await balance_of(storage, 1), await balance_of(storage, 2)) == (600, 400)
+        rows, has_more = await storage.get_transactions_page(2, 10)
+        assert [(row[2], row[3]) for row in rows] == [('transfer in', 100), ('transfer in', 300)]
+        assert not has_more
+        assert await audit_all(storage) == []
+    with_storage(scenario)
+
+
+def test_requests(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 100})
+        first, second, repeat = await storage.add_requests([
+            (1, 'deposit', 500, NOW, 'deposit-1'),
+            (1, 'withdraw', 1000, NOW, None),
+            (1, 'deposit', 500, NOW, 'deposit-1'),
+        ])
+        assert isinstance(repeat, DuplicateOperation) and repeat.result == first
+        assert await storage.get_request(first) == (first, 1, 'deposit', 500, 'pending', NOW)
+        assert sorted(row[0] for row in await storage.get_pending_requests()) == [first, second]
+
+        assert await storage.approve_request(first) == ((1, 'deposit', 500), 600)
+        with pytest.raises(RequestNotFound):
+            await storage.approve_request(first)
+        with pytest.raises(InsufficientFunds):
+            await storage.approve_request(second)
+        assert await storage.get_request(second) is not None
+        await storage.delete_request(second)
+        assert await storage.get_pending_requests() == []
+        assert await audit_all(storage) == []
+    with_storage(scenario)
+
+
+# A row that cannot even be bound fails alone; the rest of its batch is written
+def test_bad_request_row_fails_alone(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 0})
+        bad, good = await storage.add_requests([
+            (1, 'deposit', 10 ** 22, NOW, 'too-large'),
+            (1, 'deposit', 500, NOW, 'normal'),
+        ])
+        assert isinstance(bad, Exception)
+        assert await storage.get_request(good) == (good, 1, 'deposit', 500, 'pending', NOW)
+        assert [row[0] for row in await storage.get_pending_requests()] == [good]
+        # The failed row's key was rolled back with it
+        retried, = await storage.add_requests([(1, 'deposit', 500, NOW, 'too-large')])
+        assert not isinstance(retried, Exception)
+    with_storage(scenario)
+
+
+def test_apply_requests(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 100, 2: 0})
+        ids = await storage.add_requests([
+            (1, 'withdraw', 300, NOW, None),   # covered by the deposit below
+            (1, 'deposit', 250, NOW, None),
+            (2, 'withdraw', 50, NOW, None),    # nothing to cover it
+            (3, 'deposit', 50, NOW, None),     # no such account
+            (2, 'deposit', 10, NOW, None),     # outside the range
+        ])
+        applied, skipped, balances = await storage.apply_requests('approve', ranges=[(ids[0], ids[3])])
+        assert applied == [(ids[0], 1), (ids[1], 1)]
+        assert skipped == [(ids[2], 'insufficient funds'), (ids[3], 'account not found')]
+        assert sorted(balances) == [(1, 50)]
+
+        applied, skipped, _ = await storage.apply_requests('reject', request_type='deposit')
+        assert sorted(applied) == [(ids[3], 3), (ids[4], 2)]
+        assert [row[0] for row in await storage.get_pending_requests()] == [ids[2]]
+        assert await audit_all(storage) == []
+    with_storage(scenario)
+
+
+# A withdrawal the balance cannot cover is skipped without using up the
+# balance, so a later affordable one still goes through
+def test_apply_requests_skips_only_uncovered_withdrawals(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 100})
+        too_large, affordable, next_too_large = await storage.add_requests([
+            (1, 'withdraw', 150, NOW, None),
+            (1, 'withdraw', 50, NOW, None),
+            (1, 'withdraw', 60, NOW, None),
+        ])
+        applied, skipped, balances = await storage.apply_requests('approve')
+        assert applied == [(affordable, 1)]
+        assert skipped == [(too_large, 'insufficient funds'), (next_too_large, 'insufficient funds')]
+        assert balances == [(1, 50)]
+        assert await audit_all(storage) == []
+    with_storage(scenario)
+
+
+def test_status(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 1000, 2: 1000, 3: 1000})
+        assert await storage.set_status([1, 99], LOCKED, 'investigation') == [1]
+        assert (await storage.get_account(1))[4:6] == (LOCKED, 'investigation')
+        for sender_id, recipient_id in ((1, 2), (2, 1)):
+            with pytest.raises(AccountUnavailable) as raised:
+                await storage.transfer(sender_id, recipient_id, 10)
+            assert raised.value.user_id == 1 and raised.value.status == LOCKED
+
+        # Frozen accounts can still receive money
+        await storage.set_status([2], FROZEN)
+        with pytest.raises(AccountUnavailable):
+            await storage.transfer(2, 3, 10)
+        await storage.transfer(3, 2, 10)
+
+        # A lapsed lock no longer applies, even before it is cleared
+        past = (datetime.now() - timedelta(minutes=1)).isoformat()
+        await storage.set_status([3], LOCKED, until=past)
+        assert await storage.get_status_expiries() == [(3, past)]
+        await storage.transfer(3, 2, 10)
+        assert await storage.expire_statuses([3, 2], datetime.now().isoformat()) == [3]
+        assert (await storage.get_account(3))[4:] == (ACTIVE, None, None)
+        assert await storage.get_status_expiries() == []
+
+        assert await storage.set_status([1, 2], ACTIVE) == [1, 2]
+        await storage.transfer(1, 2, 10)
+        assert await audit_all(storage) == []
+    with_storage(scenario)
+
+
+def test_transactions_page(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 0, 2: 0})
+        for amount in range(1, 8):
+            await storage.set_balance(1, amount * 100, 'adjustment')
+        newest, has_more = await storage.get_transactions_page(1, 3)
+        assert has_more and [row[3] for row in newest] == [100, 100, 100]
+        older, has_more = await storage.get_transactions_page(1, 3, after=(newest[-1][4], newest[-1][0]))
+        oldest, has_more_after = await storage.get_transactions_page(1, 3, after=(older[-1][4], older[-1][0]))
+        assert has_more and not has_more_after
+        assert [row[0] for row in newest + older + oldest] == sorted((row[0] for row in newest + older + oldest),
+                                                                      reverse=True)
+        assert len(oldest) == 1
+        back, has_newer = await storage.get_transactions_page(1, 3, before=(older[0][4], older[0][0]))
+        assert back == newest and not has_newer
+        filtered, _ = await storage.get_transactions_page(1, 10, transaction_type='transfer in')
+        assert filtered == []
+    with_storage(scenario)
+
+
+def test_change_feed(with_storage):
+    async def scenario(storage):
+        assert await storage.get_last_transaction_id() == 0
+        await open_accounts(storage, {1: 100, 2: 0})
+        start = await storage.get_last_transaction_id()
+        await storage.transfer(1, 2, 10)
+        changes = await storage.get_ledger_changes(start, 10)
+        assert [user_id for _, user_id in changes] == [1, 2]
+        assert changes[-1][0] == await storage.get_last_transaction_id()
+        assert await storage.get_ledger_changes(changes[0][0], 1) == changes[1:]
+    with_storage(scenario)
+
+
+def test_expire_operations(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 100, 2: 0})
+        await storage.transfer(1, 2, 10, 'old')
+        cutoff = datetime.now().isoformat()
+        await storage.add_requests([(1, 'deposit', 5, '9999-01-01T00:00:00', 'new')])
+        assert await storage.expire_operations(cutoff) == 1
+        # The expired key can be used again, the other one cannot
+        await storage.transfer(1, 2, 10, 'old')
+        assert isinstance((await storage.add_requests([(1, 'deposit', 5, NOW, 'new')]))[0], DuplicateOperation)
+    with_storage(scenario)
+
+
+def test_aggregates(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 0, 2: 0, 3: 0})
+        ids = await storage.add_requests([(1, 'deposit', 1000, NOW, None), (2, 'deposit', 500, NOW, None),
+                                          (1, 'withdraw', 200, NOW, None)])
+        await storage.apply_requests('approve', ranges=[(ids[0], ids[-1])])
+        await storage.transfer(1, 3, 300)
+        assert await storage.get_top_balances(2) == [(1, 500), (2, 500)]
+        assert await storage.get_bank_totals() == (3, 1300, 1500, 200, 300)
+        today = datetime.now().strftime('%Y-%m-%d')
+        assert await storage.get_daily_totals(today) == [(today, 1500, 200, 300, 5)]
+        month = today[:7]
+        assert await storage.get_monthly_summaries(1, 12) == [(month, 1000, 200, 0, 300, 0, 3)]
+        assert await storage.get_monthly_summaries(3, 12, month='2000-01') == []
+    with_storage(scenario)
+
+
+def test_audit(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 1000, 2: 0})
+        await storage.transfer(1, 2, 250)
+        assert await storage.audit_account(1) == (750, 750)
+        assert await storage.audit_account(99) is None
+        assert await storage.audit_batch() == (None, 2, [])
+    with_storage(scenario)
+
+
+def test_standing_orders(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 1000, 2: 0, 3: 50})
+        first = await storage.create_standing_order(1, 2, 300, 7, '2024-05-01T09:00:00', NOW)
+        second = await storage.create_standing_order(3, 2, 100, 1, '2024-05-01T10:00:00', NOW)
+        later = await storage.create_standing_order(1, 3, 100, 30, '2024-06-01T00:00:00', NOW)
+        assert [row[0] for row in await storage.get_standing_orders(1)] == [first, later]
+
+        paid, skipped, balances = await storage.run_standing_orders(NOW, 10)
+        assert paid == [(first, 1, 2, 300)]
+        assert skipped == [(second, 3, 'insufficient funds')]
+        assert sorted(balances) == [(1, 700), (2, 300)]
+        orders = {row[0]: row for row in await storage.get_standing_orders(1) + await storage.get_standing_orders(3)}
+        assert orders[first][5:7] == ('2024-05-08T09:00:00', 'paid')
+        assert orders[second][5:7] == ('2024-05-02T10:00:00', 'insufficient funds')
+        assert orders[later][5:7] == ('2024-06-01T00:00:00', None)
+
+        assert not await storage.cancel_standing_order(first, 2)
+        assert await storage.cancel_standing_order(first, 1)
+        assert [row[0] for row in await storage.get_standing_orders(1)] == [later]
+        assert await audit_all(storage) == []
+    with_storage(scenario)
+
+
+# An order the sender cannot cover is skipped without holding up their later,
+# affordable ones, on every run
+def test_standing_orders_skip_only_uncovered(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 100, 2: 0})
+        too_large = await storage.create_standing_order(1, 2, 150, 1, '2024-05-01T09:00:00', NOW)
+        affordable = await storage.create_standing_order(1, 2, 40, 1, '2024-05-01T09:00:00', NOW)
+        for run, balance in (('2024-05-01T12:00:00', 60), ('2024-05-02T12:00:00', 20)):
+            paid, skipped, _ = await storage.run_standing_orders(run, 10)
+            assert paid == [(affordable, 1, 2, 40)]
+            assert skipped == [(too_large, 1, 'insufficient funds')]
+            assert await balance_of(storage, 1) == balance
+        assert await audit_all(storage) == []
+    with_storage(scenario)
+
+
+def test_interest(with_storage):
+    async def scenario(storage):
+        # Interest is rounded down; locked accounts earn none
+        await open_accounts(storage, {1: 10000, 2: 999, 3: 5000, 4: 0})
+        await storage.set_status([3], LOCKED)
+        # The first run only schedules the next day
+        assert await storage.pay_interest(10000, '2024-05-01', 2) is None
+        assert await storage.pay_interest(10000, '2024-05-01', 2) is None
+        day, paid, balances = await storage.pay_interest(10000, '2024-05-02', 2)
+        assert day == '2024-05-02' and paid == [(1, 100), (2, 9)]
+        assert sorted(balances) == [(1, 10100), (2, 1008)]
+        day, paid, _ = await storage.pay_interest(10000, '2024-05-02', 2)
+        assert day == '2024-05-02' and paid == []
+        assert await storage.pay_interest(10000, '2024-05-02', 2) is None
+        assert (await storage.pay_interest(0, '2024-05-05', 2)) == ('2024-05-03', [], [])
+        assert await storage.pay_interest(10000, '2024-05-05', 2) is None
+        assert await audit_all(storage) == []
+    with_storage(scenario)
+
+
+# Interest is exact integer arithmetic: 729652250000 * 0.000280 is exactly
+# 204302630, which floor(balance * 0.00028) in floating point gets one short
+def test_interest_is_exact(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 729652250000})
+        assert await storage.pay_interest(280, '2024-05-01', 10) is None
+        _, paid, balances = await storage.pay_interest(280, '2024-05-02', 10)
+        assert paid == [(1, 204302630)]
+        assert balances == [(1, 729856552630)]
+    with_storage(scenario)
+
+
+# Callers check supports_archive before archiving (see bank.setup_hook)
+def test_archive_support(with_storage):
+    async def scenario(storage):
+        await open_accounts(storage, {1: 1000})
+        if not storage.supports_archive:
+            with pytest.raises(NotImplementedError):
+                await storage.archive_transactions('9999-01-01')
+            return
+        # Only entries covered by a balance checkpoint are archived
+        assert await audit_all(storage) == []
+        assert await storage.archive_transactions('9999-01-01') == 1
+        rows, _ = await storage.get_transactions_page(1, 10)
+        assert [row[3] for row in rows] == [1000]
+        assert await audit_all(storage) == []
+    with_storage(scenario)
+
+
+# A backend missing part of the interface fails when it is created, not on
+# the first call to the missing method
+def test_incomplete_backend_is_refused():
+    class Partial(Storage):
+        async def open(self):
+            pass
+
+        async def close(self):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
+    # Every storage operation is abstract but the optional archive_transactions
+    operations = {name for name, attr in vars(Storage).items() if inspect.iscoroutinefunction(attr)}
+    assert Storage.__abstractmethods__ == operations - {'archive_transactions'}
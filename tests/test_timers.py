@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import pytest
+
+import timers
+from timers import TimerWheel
+
+
+@pytest.fixture
+def clock(clock, monkeypatch):
+    monkeypatch.setattr(timers, 'time', clock)
+    return clock
+
+
+async def noop(keys):
+    pass
+
+
+# The wheel is stepped by hand, one tick number at a time. Timers fire tick
+# by tick; those due in the same tick come in the order they were scheduled.
+def test_fires_in_deadline_order(clock):
+    wheel = TimerWheel(noop, tick=1.0, slots=8)
+    wheel.schedule('c', 1003)
+    wheel.schedule('a', 1001)
+    wheel.schedule('b', 1001.5)   # rounded up to the next tick
+    wheel.schedule('a2', 1000.2)
+    assert len(wheel) == 4
+    assert wheel._advance(1000) == []
+    assert wheel._advance(1001) == ['a', 'a2']
+    assert wheel._advance(1002) == ['b']
+    assert wheel._advance(1003) == ['c']
+    assert len(wheel) == 0
+
+    # A deadline already past fires on the next tick
+    wheel.schedule('late', 990)
+    assert wheel._advance(1004) == ['late']
+
+
+def test_cancel_and_reschedule(clock):
+    wheel = TimerWheel(noop, tick=1.0, slots=8)
+    wheel.schedule('a', 1002)
+    wheel.schedule('b', 1002)
+    wheel.cancel('a')
+    wheel.cancel('missing')
+    # Scheduling a key again replaces its timer
+    wheel.schedule('b', 1004)
+    assert len(wheel) == 1
+    assert wheel._advance(1003) == []
+    assert wheel._advance(1004) == ['b']
+
+
+# Timers more than one turn away share a bucket with nearer ones and stay put
+# until the turn they are due
+def test_timers_beyond_one_turn(clock):
+    wheel = TimerWheel(noop, tick=1.0, slots=8)
+    wheel.schedule('near', 1001)
+    wheel.schedule('two turns', 1017)   # same bucket as 'near'
+    wheel.schedule('three turns', 1025)
+    assert wheel._advance(1001) == ['near']
+    assert wheel._advance(1009) == []
+    assert wheel._advance(1017) == ['two turns']
+    # A long idle stretch visits each bucket once and still finds it
+    assert wheel._advance(1100) == ['three turns']
+    assert len(wheel) == 0
+
+
+def test_callback_runs_and_is_retried():
+    async def main():
+        calls = []
+
+        async def callback(keys):
+            calls.append(sorted(keys))
+            if len(calls) == 1:
+                raise RuntimeError("storage unavailable")
+
+        wheel = TimerWheel(callback, tick=0.01, retry=0.02)
+        wheel.start()
+        try:
+            now = time.time()
+            wheel.schedule(2, now + 0.03)
+            wheel.schedule(1, now + 0.03)
+            for _ in range(100):
+                if len(calls) == 2:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await wheel.close()
+        return calls
+
+    assert asyncio.run(main()) == [[1, 2], [1, 2]]
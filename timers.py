@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+
+# Hashed timer wheel for deadlines that are far apart and mostly far away,
+# like the expiry of account locks.
+# The wheel has slots buckets of tick seconds each; a timer goes into the
+# bucket its deadline falls in, wrapping around, and only that bucket is looked
+# at when its tick comes. Scheduling and cancelling are O(1), and a tick costs
+# the timers in one bucket, however many are pending. Timers more than one turn
+# of the wheel away stay in their bucket until the turn they are due.
+#
+# Due keys are handed to callback(keys) in one call per tick; if it fails they
+# are tried again retry seconds later. Nothing runs while no timer is pending.
+# Deadlines are wall-clock (time.time()) seconds.
+class TimerWheel:
+    def __init__(self, callback, tick=1.0, slots=512, retry=60.0):
+        self.callback = callback
+        self.tick = tick
+        self.slots = slots
+        self.retry = retry
+        self._buckets = [dict() for _ in range(slots)]  # key -> tick number it is due
+        self._timers = {}  # key -> tick number it is due
+        self._current = self._tick_of(time.time()) - 1  # tick number processed last
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def _tick_of(self, deadline):
+        return int(deadline // self.tick)
+
+    # Call back key at deadline, replacing any timer key already has
+    def schedule(self, key, deadline):
+        self.cancel(key)
+        # The first tick at or after the deadline
+        due = max(-int(-deadline // self.tick), self._current + 1)
+        self._buckets[due % self.slots][key] = due
+        self._timers[key] = due
+        self._wakeup.set()
+
+    def cancel(self, key):
+        due = self._timers.pop(key, None)
+        if due is not None:
+            del self._buckets[due % self.slots][key]
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # Keys of the timers due by tick number now, taken off the wheel
+    def _advance(self, now):
+        due = []
+        # After a long idle stretch a full turn visits every bucket once
+        first = max(self._current + 1, now - self.slots + 1)
+        for tick in range(first, now + 1):
+            bucket = self._buckets[tick % self.slots]
+            for key in [key for key, at in bucket.items() if at <= now]:
+                del bucket[key]
+                del self._timers[key]
+                due.append(key)
+        self._current = now
+        return due
+
+    async def _run(self):
+        while True:
+            if not self._timers:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            now = time.time()
+            due = self._advance(self._tick_of(now))
+            if due:
+                try:
+                    await self.callback(due)
+                except Exception as e:
+                    print(f"Timer callback failed, retrying in {self.retry:g}s: {e}")
+                    for key in due:
+                        if key not in self._timers:
+                            self.schedule(key, now + self.retry)
+            await asyncio.sleep(self.tick - now % self.tick)